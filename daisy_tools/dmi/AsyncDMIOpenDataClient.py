@@ -0,0 +1,142 @@
+import asyncio
+from daisy_tools.dmi.DMIOpenDataClient import DMIOpenDataClient
+from daisy_tools.dmi.util import combine_series
+
+__all__ = [
+    'AsyncDMIOpenDataClient',
+    'fetch_data',
+]
+
+class AsyncDMIOpenDataClient():
+    """Asyncio version of `DMIOpenDataClient`.
+
+    The methods mirror `DMIOpenDataClient`, but are coroutines. Requests are run in threads on a
+    shared connection pool, and at most `max_concurrency` queries run at the same time, so many
+    series can be fetched concurrently without flooding the server. Each query is paginated as in
+    `DMIOpenDataClient`.
+
+    A client must only be used from a single event loop. Use `fetch_data` from synchronous code.
+
+    Args:
+        api_key (str): DMI API key.
+        api_name (str): "climateData" or "metObs".
+        version (str): API version.
+        max_concurrency (int): Maximum number of concurrent queries.
+        **kwargs: Passed to `DMIOpenDataClient`, e.g. max_workers, timeout and retries.
+    """
+    def __init__(self, api_key: str, api_name: str = "metObs", version: str = "v2",
+                 max_concurrency: int = 8, **kwargs):
+        if max_concurrency < 1:
+            raise ValueError(f"Invalid value for `max_concurrency`: {max_concurrency}")
+        max_workers = kwargs.get("max_workers", 4)
+        # Enough connections for all pages of all concurrent queries
+        kwargs.setdefault("pool_size", max_concurrency * max_workers)
+        self.client = DMIOpenDataClient(api_key, api_name, version, **kwargs)
+        self.api_name = api_name
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def close(self):
+        """Close the connections of the client."""
+        self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    async def _run(self, func, *args, **kwargs):
+        async with self._semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def get_stations(self, limit=None, offset=0):
+        return await self._run(self.client.get_stations, limit=limit, offset=offset)
+
+    async def get_observations(self, parameter=None, station_id=None, from_time=None,
+                               to_time=None, limit=None, offset=0):
+        return await self._run(self.client.get_observations, parameter=parameter,
+                               station_id=station_id, from_time=from_time, to_time=to_time,
+                               limit=limit, offset=offset)
+
+    async def get_climate_data(self, parameter=None, station_id=None, from_time=None,
+                               to_time=None, time_resolution=None, limit=None, offset=0):
+        return await self._run(self.client.get_climate_data, parameter=parameter,
+                               station_id=station_id, from_time=from_time, to_time=to_time,
+                               time_resolution=time_resolution, limit=limit, offset=offset)
+
+    async def station_catalog(self):
+        return await self._run(self.client.station_catalog)
+
+    async def get_closest_station(self, latitude: float, longitude: float, pars=[],
+                                  catalog=None):
+        if catalog is None:
+            catalog = await self.station_catalog()
+        return self.client.get_closest_station(latitude, longitude, pars, catalog=catalog)
+
+    async def get_station_info(self, station_id):
+        return await self._run(self.client.get_station_info, station_id)
+
+    async def get_series(self, *, par, station_id, timeres, startdate=None, enddate=None):
+        return await self._run(self.client.get_series, par=par, station_id=station_id,
+                               timeres=timeres, startdate=startdate, enddate=enddate)
+
+    async def get_grid_data(self, parameter=None, cell_id=None, from_time=None, to_time=None,
+                            time_resolution=None, limit=None, offset=0, size=None):
+        return await self._run(self.client.get_grid_data, parameter=parameter, cell_id=cell_id,
+                               from_time=from_time, to_time=to_time,
+                               time_resolution=time_resolution, limit=limit, offset=offset,
+                               size=size)
+
+    async def get_grid_cell_data_df(self, cell_id, par, timeres="hour", startdate=None,
+                                    enddate=None):
+        return await self._run(self.client.get_grid_cell_data_df, cell_id, par, timeres,
+                               startdate, enddate)
+
+    async def get_grid_cell_data(self, *, cell_id, timeres, pars, startdate=None, enddate=None):
+        series = await asyncio.gather(*(
+            self.get_grid_cell_data_df(cell_id, par, timeres, startdate, enddate) for par in pars
+        ))
+        return combine_series(dict(zip(pars, series)))
+
+    async def get_data(self, *, latitude, longitude, timeres, pars, startdate=None,
+                       enddate=None):
+        """Get series of parameters from the stations closest to a location.
+
+        Same as `DMIOpenDataClient.get_data`, but the series of all parameters are fetched
+        concurrently.
+        """
+        if self.api_name != "climateData":
+            raise ValueError(f"get_data not implemented for API: {self.api_name}")
+        catalog = await self.station_catalog()
+        rows = self.client.closest_stations(latitude=latitude, longitude=longitude, pars=pars,
+                                            catalog=catalog)
+        series = await asyncio.gather(*(
+            self.get_series(par=row['par'], station_id=row['id'], timeres=timeres,
+                            startdate=startdate, enddate=enddate)
+            for row in rows
+        ))
+        p = combine_series({row['par']: s for row, s in zip(rows, series)})
+        return p, self.client.station_metadata(rows)
+
+
+def fetch_data(*, api_key, latitude, longitude, timeres, pars, startdate=None, enddate=None,
+               **kwargs):
+    """Synchronous wrapper of `AsyncDMIOpenDataClient.get_data`.
+
+    Must not be called from a running event loop, e.g. in a notebook cell. Use
+    `await AsyncDMIOpenDataClient(...).get_data(...)` there.
+
+    Args:
+        api_key (str): climateData API key.
+        **kwargs: Passed to `AsyncDMIOpenDataClient`.
+
+    Returns:
+        tuple of pandas.DataFrame: Data and metadata as returned by `DMIOpenDataClient.get_data`.
+    """
+    async def run():
+        async with AsyncDMIOpenDataClient(api_key, "climateData", **kwargs) as client:
+            return await client.get_data(latitude=latitude, longitude=longitude,
+                                         timeres=timeres, pars=pars, startdate=startdate,
+                                         enddate=enddate)
+    return asyncio.run(run())
@@ -1,10 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import requests
-from tenacity import retry, stop_after_attempt, wait_random
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import numpy as np
 import pandas as pd
 from pyproj import Proj
 from math import trunc
-from daisy_tools.dmi.util import construct_datetime_argument, distance
+from daisy_tools.dmi.util import construct_datetime_argument, distance, loads, \
+    features_to_series, combine_series, time_windows
+from daisy_tools.dmi.StationCatalog import StationCatalog
+from daisy_tools.dmi.RateLimiter import RateLimiter
 
 __all__ = [
     'DMIOpenDataClient',
@@ -15,7 +21,19 @@ class DMIOpenDataClient():
     SUPPORTED_APIS = {"climateData", "metObs"}
     SUPPORTED_VERSIONS = {"v2"}
 
-    def __init__(self, api_key: str, api_name: str = "metObs", version: str = "v2"):
+    # Number of features requested per page when paginating
+    PAGE_SIZE = 10000
+    # Grid cell sizes of climateData in m
+    GRID_SIZES = {"10km": 10000, "20km": 20000}
+    # Responses that are worth retrying. 429 is rate limiting, the rest are server side failures.
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, api_key: str, api_name: str = "metObs", version: str = "v2",
+                 max_workers: int = 4, timeout=(10, 120), retries: int = 5,
+                 backoff_factor: float = 0.5, pool_size: int = None, station_cache: str = None,
+                 station_ttl: float = 86400, observation_store=None, window=None,
+                 window_retries: int = 2, rate_limit: float = None, rate_burst: int = None,
+                 rate_limit_file: str = None):
         if api_key is None:
             raise ValueError(f"Invalid value for `api_key`: {api_key}")
 
@@ -25,37 +43,248 @@ class DMIOpenDataClient():
         if version not in self.SUPPORTED_VERSIONS:
             raise ValueError(f"API version {version} not supported")
 
+        if max_workers < 1:
+            raise ValueError(f"Invalid value for `max_workers`: {max_workers}")
+
         self.api_key = api_key
         self.api_name = api_name
         self.version = version
+        # Number of pages fetched concurrently
+        self.max_workers = max_workers
+        # (connect, read) timeout in seconds
+        self.timeout = timeout
+        # Connections kept alive. Defaults to one per worker.
+        self.pool_size = pool_size or max_workers
+        # Token bucket shared by all clients with the same API key, or None for no limit
+        self.rate_limiter = None
+        if rate_limit is not None:
+            self.rate_limiter = RateLimiter.shared(api_key, rate_limit, rate_burst,
+                                                   rate_limit_file)
+        self.session = self._create_session(retries, backoff_factor)
+        # JSON file caching the station list, and seconds it is valid
+        self.station_cache = station_cache
+        self.station_ttl = station_ttl
+        self._catalog = None
+        self._catalog_lock = threading.Lock()
+        # ObservationStore used by get_series, so only missing data is fetched
+        self.observation_store = observation_store
+        # Long time ranges are split in windows of this length and fetched in parallel, e.g.
+        # "YS" for calendar years. See `util.time_windows`.
+        self.window = window
+        # Times a failed window is fetched again
+        self.window_retries = window_retries
+
+    def _create_session(self, retries, backoff_factor):
+        # Retry GET requests on connection errors and transient responses with exponential
+        # backoff. A Retry-After header from the server overrides the backoff. With a rate limiter,
+        # every attempt waits for a token.
+        retry = _RateLimitedRetry(
+            rate_limiter=self.rate_limiter,
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUS,
+            allowed_methods=frozenset({"GET"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = _RateLimitedAdapter(self.rate_limiter, pool_connections=1,
+                                      pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        """Close the connections of the client."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def base_url(self, api: str):
         if api not in self.SUPPORTED_APIS:
             raise NotImplementedError(f"Following API is not supported yet: {api}")
         return self.BASE_URL.format(version=self.version, api=api)
 
-    @retry(stop=stop_after_attempt(10), wait=wait_random(min=0.1, max=1.00))
     def _query(self, api: str, service: str, params, **kwargs):
-        res = []
-        try:
-            res = requests.get(
-                url=f"{self.base_url(api=api)}/{service}",
-                params={"api-key": self.api_key, **params},
-                **kwargs,
+        kwargs.setdefault("timeout", self.timeout)
+        res = self.session.get(
+            url=f"{self.base_url(api=api)}/{service}",
+            params={"api-key": self.api_key, **params},
+            **kwargs,
+        )
+        if not res.ok:
+            # DMI describes the error in a JSON body
+            try:
+                message = loads(res.content).get("message", res.text)
+            except ValueError:
+                message = res.text
+            raise requests.HTTPError(f"HTTPError {res.status_code}, message: {message}",
+                                     response=res)
+        return loads(res.content)
+
+    def paginate(self, api: str, service: str, params, limit=None, offset=0, page_size=None,
+                 workers=None):
+        """Iterate over the features of a query, fetching pages concurrently.
+
+        The first page is fetched on its own, so queries that fit in a page cost one request. If
+        there are more pages, they are requested with offset arithmetic, up to `workers` pages at a
+        time, and bounded by `numberMatched` when the server reports it. Features are yielded in
+        the order of the collection. The last page is the first page with fewer features than
+        requested and no next link, or a full page without a next link if the server links pages.
+
+        Args:
+            api (str): API name.
+            service (str): Service path, e.g. "collections/stationValue/items".
+            params (dict): Query parameters, without limit and offset.
+            limit (int): Maximum number of features. If None get all features.
+            offset (int): Number of features to skip.
+            page_size (int): Number of features per request. Defaults to `PAGE_SIZE`.
+            workers (int): Number of pages fetched at a time. Defaults to `max_workers`.
+
+        Yields:
+            dict: Feature.
+
+        Raises:
+            ValueError: If the server returns a short page that has a next link. This happens if
+                `page_size` is larger than the server allows, and continuing would skip data.
+        """
+        page_size = page_size or self.PAGE_SIZE
+        workers = workers or self.max_workers
+        end = None if limit is None else offset + limit
+
+        def page_limit(page_offset):
+            return page_size if end is None else min(page_size, end - page_offset)
+
+        def fetch(page_offset):
+            return self._query(
+                api=api,
+                service=service,
+                params={**params, "limit": page_limit(page_offset), "offset": page_offset},
             )
-            res.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            print(f'HTTPError {res.status_code}, message: {eval(err.response.text)["message"]}')
-        return res.json()
-
-    def get_stations(self, limit=10000, offset=0):
 
-        res = self._query(
+        def is_last(res, page_offset):
+            # Tell if a page is the last page. A full page is the last if the server links pages
+            # and gives no next link.
+            returned = res.get("numberReturned", len(res.get("features", [])))
+            links = res.get("links") or []
+            has_next = any(link.get("rel") == "next" for link in links)
+            if returned >= page_limit(page_offset):
+                return bool(links) and not has_next
+            if has_next:
+                raise ValueError(
+                    f"Server returned {returned} features when {page_size} were "
+                    f"requested and more are available. Use a smaller page_size."
+                )
+            return True
+
+        if end is not None and offset >= end:
+            return
+        res = fetch(offset)
+        yield from res.get("features", [])
+        if is_last(res, offset):
+            return
+        if res.get("numberMatched") is not None:
+            # The total is known, so no page past the end is requested
+            end = res["numberMatched"] if end is None else min(end, res["numberMatched"])
+
+        with ThreadPoolExecutor(workers) as executor:
+            pending = []
+            next_offset = offset + page_size
+            try:
+                while True:
+                    # Keep `workers` pages in flight
+                    while len(pending) < workers and (end is None or next_offset < end):
+                        pending.append((next_offset, executor.submit(fetch, next_offset)))
+                        next_offset += page_size
+                    if not pending:
+                        return
+                    page_offset, future = pending.pop(0)
+                    res = future.result()
+                    yield from res.get("features", [])
+                    if is_last(res, page_offset):
+                        return
+            finally:
+                # Pages past the end are not needed
+                for _, future in pending:
+                    future.cancel()
+
+    def fetch_windows(self, fetch, windows):
+        """Fetch time windows in parallel, retrying failed windows on their own.
+
+        Args:
+            fetch (callable): Called as fetch(from_time, to_time) for each window.
+            windows (list of tuple): (from_time, to_time) pairs, e.g. from `util.time_windows`.
+
+        Yields:
+            tuple: (window, result) pairs in the order the windows finish.
+
+        Raises:
+            requests.RequestException: If a window still fails after `window_retries` retries.
+                Raised when all other windows are done, so their results are not lost.
+        """
+        def fetch_window(window):
+            for attempt in range(self.window_retries + 1):
+                try:
+                    return fetch(*window)
+                except requests.RequestException:
+                    if attempt == self.window_retries:
+                        raise
+            return None
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            futures = {executor.submit(fetch_window, window): window for window in windows}
+            error = None
+            try:
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except requests.RequestException as err:
+                        error = error or err
+                        continue
+                    yield futures[future], result
+            finally:
+                for future in futures:
+                    future.cancel()
+            if error is not None:
+                raise error
+
+    def _windowed(self, api: str, service: str, params, from_time, to_time, window):
+        # All features in the time range, fetched in windows
+        def fetch(window_from, window_to):
+            return list(self.paginate(
+                api=api,
+                service=service,
+                params={**params, "datetime": construct_datetime_argument(window_from, window_to)},
+                # The windows are fetched in parallel
+                workers=1,
+            ))
+        windows = time_windows(from_time, to_time, window)
+        results = dict(self.fetch_windows(fetch, windows))
+        features, seen = [], set()
+        for span in windows:
+            for feature in results[span]:
+                # Guard against features on a window edge being returned twice
+                feature_id = feature.get("id")
+                if feature_id is not None:
+                    if feature_id in seen:
+                        continue
+                    seen.add(feature_id)
+                features.append(feature)
+        return features
+
+    def get_stations(self, limit=None, offset=0):
+
+        return list(self.paginate(
             api=self.api_name,
             service="collections/station/items",
-            params={"limit": limit, "offset": offset},
-        )
-        return res.get("features", [])
+            params={},
+            limit=limit,
+            offset=offset,
+        ))
 
     def get_observations(
         self,
@@ -63,21 +292,25 @@ class DMIOpenDataClient():
         station_id=None,
         from_time=None,
         to_time=None,
-        limit=10000,
+        limit=None,
         offset=0,
+        window=None,
+        workers=None,
     ):
-        res = self._query(
+        return self._get_features(
             api="metObs",
             service="collections/observation/items",
             params={
                 "parameterId": parameter,
                 "stationId": station_id,
-                "datetime": construct_datetime_argument(from_time=from_time, to_time=to_time),
-                "limit": limit,
-                "offset": offset,
             },
+            from_time=from_time,
+            to_time=to_time,
+            limit=limit,
+            offset=offset,
+            window=window,
+            workers=workers,
         )
-        return res.get("features", [])
 
     def get_climate_data(
         self,
@@ -86,51 +319,101 @@ class DMIOpenDataClient():
         from_time=None,
         to_time=None,
         time_resolution=None,
-        limit=10000,
+        limit=None,
         offset=0,
+        window=None,
+        workers=None,
     ):
-        res = self._query(
+        return self._get_features(
             api="climateData",
             service="collections/stationValue/items",
             params={
                 "parameterId": parameter,
                 "stationId": station_id,
-                "datetime": construct_datetime_argument(from_time=from_time, to_time=to_time),
                 "timeResolution": time_resolution,
-                "limit": limit,
-                "offset": offset,
             },
+            from_time=from_time,
+            to_time=to_time,
+            limit=limit,
+            offset=offset,
+            window=window,
+            workers=workers,
         )
 
-        return res.get("features", [])
-
-    def get_closest_station(
-        self, latitude: float, longitude: float, pars=[]
+    def get_grid_data(
+        self,
+        parameter=None,
+        cell_id=None,
+        from_time=None,
+        to_time=None,
+        time_resolution=None,
+        limit=None,
+        offset=0,
+        window=None,
+        size=None,
+        workers=None,
     ):
-        stations = self.get_stations()
-        closest_station, closest_dist = None, float("inf")
-        wanted_pars = set(pars)
-
-        for station in stations:
-            coordinates = station.get("geometry", {}).get("coordinates")
-            if coordinates is None or len(coordinates) < 2:
-                continue
+        size = size or (cell_id.split("_")[0] if cell_id else "10km")
+        if size not in self.GRID_SIZES:
+            raise ValueError(f"Invalid grid size {size}. "
+                             f"Valid sizes are {', '.join(self.GRID_SIZES)}")
+        return self._get_features(
+            api="climateData",
+            service=f"collections/{size}GridValue/items",
+            params={
+                "parameterId": parameter,
+                "cellId": cell_id,
+                "timeResolution": time_resolution,
+            },
+            from_time=from_time,
+            to_time=to_time,
+            limit=limit,
+            offset=offset,
+            window=window,
+            workers=workers,
+        )
 
-            lat, lon = coordinates[1], coordinates[0]
-            if lat is None or lon is None:
-                continue
+    def _get_features(self, api, service, params, from_time, to_time, limit, offset, window,
+                      workers):
+        # Split the time range in windows if a window is given, there is a start time and all
+        # features are wanted. window=None uses the window of the client and False disables it.
+        # `workers` is the number of pages fetched at a time, see `paginate`.
+        if window is None:
+            window = self.window
+        if window and from_time is not None and limit is None and offset == 0:
+            return self._windowed(api, service, params, from_time, to_time, window)
+        return list(self.paginate(
+            api=api,
+            service=service,
+            params={
+                **params,
+                "datetime": construct_datetime_argument(from_time=from_time, to_time=to_time),
+            },
+            limit=limit,
+            offset=offset,
+            workers=workers,
+        ))
 
-            has_pars = set(station['properties']['parameterId'])
-            if not wanted_pars.issubset(has_pars):
-                continue
+    def station_catalog(self):
+        """Get the station catalog of the API, fetching it the first time.
 
-            # Calculate distance
-            dist = distance(lat1=latitude, lon1=longitude, lat2=lat, lon2=lon)
+        The catalog is kept in memory, and on disk in `station_cache` if given, so stations are
+        only downloaded once per `station_ttl` seconds.
 
-            if dist < closest_dist:
-                closest_dist, closest_station = dist, station
+        Returns:
+            StationCatalog
+        """
+        with self._catalog_lock:
+            if self._catalog is None:
+                self._catalog = StationCatalog.load(self, self.station_cache, self.station_ttl)
+            return self._catalog
 
-        return closest_station
+    def get_closest_station(
+        self, latitude: float, longitude: float, pars=[], catalog=None
+    ):
+        if catalog is None:
+            catalog = self.station_catalog()
+        return catalog.closest_station(latitude, longitude, pars)
 
     def get_station_info(
         self, station_id
@@ -156,22 +439,57 @@ class DMIOpenDataClient():
         print("Looking up parameter ", par)
         if self.api_name != "climateData":
             raise ValueError(f"get_series not implemented for API: {self.api_name}")
-        data = self.get_climate_data(par, station_id=station_id, time_resolution=timeres, limit=200000, from_time=startdate, to_time=enddate)
-        if len(data) > 0:
-            print(f"Found {len(data)} datapoints")
+        if self.observation_store is not None:
+            series = self.observation_store.get_series(
+                self, par=par, station_id=station_id, timeres=timeres, startdate=startdate,
+                enddate=enddate,
+            )
+        else:
+            data = self.get_climate_data(
+                par, station_id=station_id, time_resolution=timeres, from_time=startdate,
+                to_time=enddate,
+            )
+            series = features_to_series(data)
+        if len(series) > 0:
+            print(f"Found {len(series)} datapoints")
         else:
             print("No data, ignoring")
-        return pd.Series(self.get_value(data), index=self.get_index(data))
+        return series
 
     def get_data(self, *, latitude, longitude, timeres, pars, startdate=None, enddate=None):
         if self.api_name != "climateData":
             raise ValueError(f"get_data not implemented for API: {self.api_name}")
-        p = pd.DataFrame()
-        m = pd.DataFrame(columns=["par", "id", "dist", "lat", "lon"])
+        rows = self.closest_stations(latitude=latitude, longitude=longitude, pars=pars)
+        m = self.station_metadata(rows)
+        p = combine_series({
+            row['par']: self.get_series(
+                par=row['par'], station_id=row['id'], timeres=timeres, startdate=startdate,
+                enddate=enddate,
+            )
+            for row in rows
+        })
+        return p, m
 
+    def closest_stations(self, *, latitude, longitude, pars, catalog=None):
+        """Find the closest station for each parameter.
+
+        Args:
+            latitude (float): Latitude of site.
+            longitude (float): Longitude of site.
+            pars (list of str): Parameters.
+            catalog (StationCatalog): Stations to search. Defaults to `station_catalog()`.
+
+        Returns:
+            list of dict: One row with the keys par, id, dist, lat and lon for each parameter
+                with a station, in the order of `pars`.
+        """
+        if catalog is None:
+            catalog = self.station_catalog()
+        rows = []
         for par in pars:
             print(f"Looking for station with parameter {par}")
-            station = self.get_closest_station(latitude=latitude, longitude=longitude, pars=[par])
+            station = self.get_closest_station(latitude=latitude, longitude=longitude, pars=[par],
+                                               catalog=catalog)
 
             if not station:
                 print(f"No station found with parameter {par}")
@@ -183,16 +501,52 @@ class DMIOpenDataClient():
             dist = distance(lat1=latitude, lon1=longitude, lat2=station_lat, lon2=station_lon)
 
             print("Found", par, "in station", station_id, dist, "km away")
-            new_row = pd.DataFrame(
-                {'par': par, 'id': station_id, 'dist': dist, 'lat': station_lat, 'lon': station_lon}, index=[0])
-            m = m.dropna(axis=1, how='all')
-            m = pd.concat([new_row, m], ignore_index=True)
-            s = self.get_series(par=par, station_id=station_id, timeres=timeres, startdate=startdate, enddate=enddate)
-
-            if len(s) > 0:
-                p[par] = s
-
-        return p, m
+            rows.append({'par': par, 'id': station_id, 'dist': dist, 'lat': station_lat,
+                         'lon': station_lon})
+        return rows
+
+    @staticmethod
+    def station_metadata(rows):
+        """Metadata table of `get_data` from rows of `closest_stations`, latest row first."""
+        return pd.DataFrame(rows[::-1], columns=["par", "id", "dist", "lat", "lon"])
+
+    def get_grid_cell_data_df(self, cell_id, par, timeres="hour", startdate=None, enddate=None):
+        """Get a series of a parameter in a grid cell.
+
+        Args:
+            cell_id (str): Grid cell id, e.g. from `grid_name`.
+            par (str): Parameter.
+            timeres (str): Time resolution.
+            startdate (datetime): Start of series.
+            enddate (datetime): End of series.
+
+        Returns:
+            pandas.Series: Values named `par`, indexed by the end time of each value in UTC.
+        """
+        if self.api_name != "climateData":
+            raise ValueError(f"get_grid_cell_data_df not implemented for API: {self.api_name}")
+        if self.observation_store is not None:
+            series = self.observation_store.get_series(self, par=par, cell_id=cell_id,
+                                                       timeres=timeres, startdate=startdate,
+                                                       enddate=enddate)
+        else:
+            data = self.get_grid_data(par, cell_id=cell_id, time_resolution=timeres,
+                                      from_time=startdate, to_time=enddate)
+            series = features_to_series(data)
+        return series.rename(par)
+
+    def get_grid_cell_data(self, *, cell_id, timeres, pars, startdate=None, enddate=None):
+        """Get series of parameters in a grid cell. The parameters are fetched concurrently.
+
+        Returns:
+            pandas.DataFrame: A column per parameter with data, indexed by time in UTC.
+        """
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            series = executor.map(
+                lambda par: self.get_grid_cell_data_df(cell_id, par, timeres, startdate, enddate),
+                pars
+            )
+            return combine_series(dict(zip(pars, series)))
 
     def grid_name(self, latitude, longitude, size="10km"):
         # DMI uses "Det Dansk Kvadratnet" which uses ETRS89 / EPSG25832.
@@ -209,3 +563,35 @@ class DMIOpenDataClient():
         e = str(trunc(east / r) * m)
         cell_id = f"{size}_{n}_{e}"
         return cell_id
+
+
+class _RateLimitedAdapter(HTTPAdapter):
+    # Takes a token from the rate limiter before the first attempt of each request
+    def __init__(self, rate_limiter, **kwargs):
+        self.rate_limiter = rate_limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, *args, **kwargs):  # pylint: disable=signature-differs
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return super().send(request, *args, **kwargs)
+
+
+class _RateLimitedRetry(Retry):
+    # Takes a token before each retry. On 429 Too Many Requests, all clients sharing the limiter
+    # pause until the time given by Retry-After, so they do not keep hitting the limit.
+    def __init__(self, *args, rate_limiter=None, **kwargs):
+        self.rate_limiter = rate_limiter
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.rate_limiter = self.rate_limiter
+        return retry
+
+    def sleep(self, response=None):
+        if self.rate_limiter is not None and response is not None and response.status == 429:
+            self.rate_limiter.pause(self.get_retry_after(response) or self.get_backoff_time())
+        super().sleep(response)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
@@ -0,0 +1,223 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+from daisy_tools.dmi.util import features_to_series, time_windows
+
+__all__ = [
+    'ObservationStore',
+]
+
+# Open ends of requested intervals, in seconds since the epoch
+_EARLIEST = -2**62
+_LATEST = 2**62
+
+class ObservationStore():
+    """Local SQLite store of DMI series that only fetches what is missing.
+
+    Values are stored per api, station or grid cell, parameter and time resolution together with
+    the time intervals that have been fetched. When a series is requested, only the parts of the
+    interval that are not covered are fetched from DMI, and the series is then read from the
+    store.
+
+    Recent data may still be added or corrected by DMI, so coverage is never recorded later than
+    `recent` before the time of fetching. Requests reaching into that period always fetch it
+    again.
+
+    If the client has a `window`, missing intervals are fetched in windows, and each window is
+    stored as soon as it arrives. If a window fails, the other windows are kept, and the next
+    request only fetches the failed window.
+
+    The store can be shared by threads and by processes.
+
+    Args:
+        path (str): Path to SQLite database. Created if it does not exist.
+        recent (datetime.timedelta): Period before now that is always fetched again.
+    """
+    def __init__(self, path, recent=timedelta(days=2)):
+        self.path = path
+        self.recent = recent
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS observation (
+                    api TEXT NOT NULL,
+                    station_id TEXT NOT NULL,
+                    parameter TEXT NOT NULL,
+                    timeres TEXT NOT NULL,
+                    time INTEGER NOT NULL,
+                    value REAL,
+                    PRIMARY KEY (api, station_id, parameter, timeres, time)
+                ) WITHOUT ROWID
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS coverage (
+                    api TEXT NOT NULL,
+                    station_id TEXT NOT NULL,
+                    parameter TEXT NOT NULL,
+                    timeres TEXT NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL
+                )
+            """)
+            self._db.execute("""
+                CREATE INDEX IF NOT EXISTS coverage_key
+                ON coverage (api, station_id, parameter, timeres)
+            """)
+
+    def close(self):
+        """Close the database."""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def coverage(self, key):
+        """Get the covered intervals of a series.
+
+        Args:
+            key (tuple of str): (api, station_id, parameter, timeres)
+
+        Returns:
+            list of tuple: Sorted, non-overlapping (start, end) intervals in seconds since the
+                epoch.
+        """
+        with self._lock:
+            return self._db.execute("""
+                SELECT start, end FROM coverage
+                WHERE api = ? AND station_id = ? AND parameter = ? AND timeres = ?
+                ORDER BY start
+            """, key).fetchall()
+
+    def missing(self, key, startdate=None, enddate=None):
+        """Get the parts of a requested interval that are not covered.
+
+        Args:
+            key (tuple of str): (api, station_id, parameter, timeres)
+            startdate (datetime): Start of interval. None for no limit.
+            enddate (datetime): End of interval. None for no limit.
+
+        Returns:
+            list of tuple: Closed (start, end) intervals in seconds since the epoch, where the
+                open ends of the request are kept open.
+        """
+        start, end = _seconds(startdate, _EARLIEST), _seconds(enddate, _LATEST)
+        gaps = []
+        for covered_start, covered_end in self.coverage(key):
+            if covered_end < start:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > start:
+                gaps.append((start, covered_start - 1))
+            start = max(start, covered_end + 1)
+        if start <= end:
+            gaps.append((start, end))
+        return gaps
+
+    def get_series(self, client, *, par, timeres, station_id=None, cell_id=None, startdate=None,
+                   enddate=None):
+        """Get a climate data series, fetching the missing parts with `client`.
+
+        Args:
+            client (DMIOpenDataClient): Client for the climateData API.
+            par (str): Parameter.
+            timeres (str): Time resolution.
+            station_id (str): Station. Either station_id or cell_id must be given.
+            cell_id (str): Grid cell, e.g. 10km_622_71.
+            startdate (datetime): Start of series. None for no limit.
+            enddate (datetime): End of series. None for no limit.
+
+        Returns:
+            pandas.Series: Values indexed by the end time of each observation in UTC, sorted by
+                time.
+        """
+        if (station_id is None) == (cell_id is None):
+            raise ValueError("Give either station_id or cell_id")
+        if cell_id is not None:
+            # Cell ids start with the grid size, so they never match station ids
+            key = (f"{client.api_name}/grid", str(cell_id), par, timeres)
+        else:
+            key = (client.api_name, str(station_id), par, timeres)
+
+        # Windows are fetched in parallel, so the pages of each window are fetched in turn
+        workers = 1 if client.window else None
+
+        def fetch(from_time, to_time):
+            if cell_id is not None:
+                return client.get_grid_data(par, cell_id=cell_id, time_resolution=timeres,
+                                            from_time=from_time, to_time=to_time, window=False,
+                                            workers=workers)
+            return client.get_climate_data(par, station_id=station_id, time_resolution=timeres,
+                                           from_time=from_time, to_time=to_time, window=False,
+                                           workers=workers)
+
+        for gap_start, gap_end in self.missing(key, startdate, enddate):
+            fetched_at = datetime.now(timezone.utc)
+            window = (_datetime(gap_start, _EARLIEST), _datetime(gap_end, _LATEST))
+            windows = [window] if not client.window else time_windows(*window, client.window)
+            for (from_time, to_time), data in client.fetch_windows(fetch, windows):
+                series = features_to_series(data)
+                times = series.index.values.astype("datetime64[s]").astype(np.int64)
+                # Only data older than `recent` is final
+                covered_end = min(_seconds(to_time, _LATEST),
+                                  _seconds(fetched_at - self.recent, _LATEST))
+                self._insert(key, times, series.values, _seconds(from_time, _EARLIEST),
+                             covered_end)
+        return self._read(key, _seconds(startdate, _EARLIEST), _seconds(enddate, _LATEST))
+
+    def _insert(self, key, times, values, start, end):
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO observation VALUES (?, ?, ?, ?, ?, ?)",
+                ((*key, int(t), None if np.isnan(v) else float(v))
+                 for t, v in zip(times, values))
+            )
+            if start >= end:
+                return
+            # Merge the new interval with the intervals it overlaps or touches. Windows end one
+            # second before the next starts, so intervals one second apart touch.
+            where = "api = ? AND station_id = ? AND parameter = ? AND timeres = ?"
+            overlapping = self._db.execute(
+                f"SELECT min(start), max(end) FROM coverage WHERE {where} "
+                "AND start <= ? AND end >= ?", (*key, end + 1, start - 1)
+            ).fetchone()
+            if overlapping[0] is not None:
+                start, end = min(start, overlapping[0]), max(end, overlapping[1])
+            self._db.execute(f"DELETE FROM coverage WHERE {where} AND start <= ? AND end >= ?",
+                             (*key, end + 1, start - 1))
+            self._db.execute("INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?)",
+                             (*key, start, end))
+
+    def _read(self, key, start, end):
+        with self._lock:
+            rows = self._db.execute("""
+                SELECT time, value FROM observation
+                WHERE api = ? AND station_id = ? AND parameter = ? AND timeres = ?
+                AND time BETWEEN ? AND ?
+                ORDER BY time
+            """, (*key, start, end)).fetchall()
+        times = np.array([row[0] for row in rows], dtype=np.int64)
+        values = np.array([row[1] for row in rows], dtype=float)
+        return pd.Series(values, index=pd.to_datetime(times, unit="s"))
+
+
+def _seconds(dt, default):
+    # Naive datetimes are UTC, as in `util.format_datetime`
+    if dt is None:
+        return default
+    if dt.utcoffset() is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _datetime(seconds, open_end):
+    if seconds == open_end:
+        return None
+    return datetime.fromtimestamp(seconds, timezone.utc)
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+__all__ = [
+    'RateLimiter',
+]
+
+# Tokens, time of last update and end of pause, stored in the state file of shared limiters
+_STATE = struct.Struct("<ddd")
+
+class RateLimiter():
+    """Token bucket limiting the rate of requests.
+
+    The bucket holds up to `burst` tokens and is refilled with `rate` tokens per second. Each
+    request takes a token. When the bucket is empty, a request reserves the next token and sleeps
+    until it is due, so waiting requests are served in turn and the rate stays at `rate` without
+    polling.
+
+    If `path` is given, the bucket is stored in that file and shared by all processes using it. The
+    file is locked with `fcntl` on POSIX and `msvcrt` on Windows. Otherwise the bucket is shared by
+    the threads of the process.
+
+    Use `shared` to get the limiter of an API key, so all clients using the key share it.
+
+    Args:
+        rate (float): Requests per second.
+        burst (int): Requests that can be made at once after an idle period. Defaults to one
+            second worth of requests.
+        path (str): File holding the bucket shared between processes. Created if it does not
+            exist.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rate: float, burst: int = None, path: str = None):
+        if rate is None or rate <= 0:
+            raise ValueError(f"Invalid value for `rate`: {rate}")
+        if burst is None:
+            burst = max(1, int(rate))
+        if burst < 1:
+            raise ValueError(f"Invalid value for `burst`: {burst}")
+        if path is not None and fcntl is None and msvcrt is None:
+            raise NotImplementedError("File locking is not supported on this platform")
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        # Processes only share the wall clock, a single process can use the monotonic clock
+        self._clock = time.monotonic if path is None else time.time
+        self._updated = self._clock()
+        self._paused = 0.0
+        self._file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, "a+b")  # pylint: disable=consider-using-with
+
+    @classmethod
+    def shared(cls, api_key: str, rate: float, burst: int = None, path: str = None):
+        """Get the limiter shared by all users of an API key.
+
+        Args:
+            api_key (str): API key. Only a hash of the key is kept.
+            rate (float): Requests per second.
+            burst (int): Requests that can be made at once.
+            path (str): File holding the bucket shared between processes.
+
+        Returns:
+            RateLimiter
+        """
+        key = (hashlib.sha256(api_key.encode()).hexdigest(),
+               None if path is None else os.path.abspath(path))
+        with cls._shared_lock:
+            limiter = cls._shared.get(key)
+            if limiter is None:
+                limiter = cls._shared[key] = cls(rate, burst, path)
+            elif limiter.rate != rate or (burst is not None and limiter.burst != burst):
+                raise ValueError(f"API key is already limited to {limiter.rate} requests per "
+                                 f"second with burst {limiter.burst}")
+            return limiter
+
+    def close(self):
+        """Close the state file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def acquire(self):
+        """Take a token, sleeping until one is available.
+
+        Returns:
+            float: Seconds slept.
+        """
+        slept = 0
+        while True:
+            wait = self._update(self._take)
+            if wait > 0:
+                time.sleep(wait)
+                slept += wait
+            # Tokens reserved before a pause are not used during the pause
+            if not self._update(lambda tokens, paused, now: (tokens, paused, paused > now)):
+                return slept
+
+    def pause(self, seconds: float):
+        """Stop all requests for `seconds`, e.g. when the server responds 429 Too Many Requests.
+
+        Args:
+            seconds (float): Seconds until the next request.
+        """
+        def stop(tokens, paused, now):
+            return min(tokens, -seconds * self.rate), max(paused, now + seconds), None
+        self._update(stop)
+
+    def _take(self, tokens, paused, now):
+        # Reserve a token and return seconds until it is due
+        tokens -= 1
+        return tokens, paused, max(0, -tokens / self.rate, paused - now)
+
+    def _update(self, update):
+        # Refill the bucket and apply `update`, which gets the tokens, the end of the current
+        # pause and the time, and returns new tokens and pause end and a result
+        with self._lock:
+            if self._file is None:
+                now = self._clock()
+                self._tokens, self._paused, result = self._refill(update, self._tokens,
+                                                                  self._updated, self._paused, now)
+                self._updated = now
+                return result
+            with _FileLock(self._file):
+                self._file.seek(0)
+                state = self._file.read(_STATE.size)
+                if len(state) == _STATE.size:
+                    tokens, updated, paused = _STATE.unpack(state)
+                else:
+                    tokens, updated, paused = float(self.burst), self._clock(), 0.0
+                now = self._clock()
+                tokens, paused, result = self._refill(update, tokens, updated, paused, now)
+                self._file.seek(0)
+                self._file.truncate()
+                self._file.write(_STATE.pack(tokens, now, paused))
+                self._file.flush()
+            return result
+
+    def _refill(self, update, tokens, updated, paused, now):
+        # Clocks may go backwards, e.g. when the system time is adjusted
+        tokens = min(self.burst, tokens + max(0, now - updated) * self.rate)
+        return update(tokens, paused, now)
+
+
+class _FileLock():
+    # Exclusive lock on an open file, held by one process at a time
+    def __init__(self, file):
+        self.file = file
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            # Blocks for up to 10 s at a time
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
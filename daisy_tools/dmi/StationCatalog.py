@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+from daisy_tools.dmi.util import CONST_EARTH_RADIUS
+
+__all__ = [
+    'StationCatalog',
+]
+
+class StationCatalog():
+    """In-memory station list with a spatial index for nearest station queries.
+
+    Station positions are stored as 3D unit vectors in a KD-tree, so nearest neighbours in the
+    tree are nearest neighbours on the sphere. The parameters of each station are stored as a
+    bitmask, and a tree is built for each combination of wanted parameters the first time it is
+    queried.
+
+    Args:
+        features (list of dict): Stations as returned by `DMIOpenDataClient.get_stations`.
+            Stations without coordinates are ignored.
+    """
+    def __init__(self, features):
+        self.features = [
+            station for station in features
+            if len(station.get("geometry", {}).get("coordinates") or []) >= 2
+            and None not in station["geometry"]["coordinates"][:2]
+        ]
+        coordinates = np.array([station["geometry"]["coordinates"][:2]
+                                for station in self.features], dtype=float).reshape(-1, 2)
+        self.longitude, self.latitude = coordinates[:, 0], coordinates[:, 1]
+        self.station_id = np.array([station["properties"].get("stationId")
+                                    for station in self.features], dtype=object)
+        self.parameters = sorted({par for station in self.features
+                                  for par in station["properties"].get("parameterId") or []})
+        self._bit = {par: i for i, par in enumerate(self.parameters)}
+        self.mask = np.zeros((len(self.features), max(1, -(-len(self.parameters) // 64))),
+                             dtype=np.uint64)
+        for row, station in enumerate(self.features):
+            for par in station["properties"].get("parameterId") or []:
+                bit = self._bit[par]
+                self.mask[row, bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+        self._vectors = _unit_vectors(self.latitude, self.longitude)
+        self._trees = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.features)
+
+    @classmethod
+    def load(cls, client, cache_path=None, ttl=86400):
+        """Get the station catalog of a client, using a disk cache if given.
+
+        Args:
+            client (DMIOpenDataClient): Client used to fetch the stations if not cached.
+            cache_path (str): JSON file with cached stations. If None the stations are always
+                fetched.
+            ttl (float): Seconds a cached catalog is valid.
+
+        Returns:
+            StationCatalog
+        """
+        if cache_path is not None and os.path.exists(cache_path) and \
+           time.time() - os.path.getmtime(cache_path) < ttl:
+            with open(cache_path, encoding="utf8") as f:
+                return cls(json.load(f))
+        features = client.get_stations()
+        if cache_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            # Write to a temporary file, so other processes never read a partial file
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf8") as f:
+                json.dump(features, f)
+            os.replace(tmp_path, cache_path)
+        return cls(features)
+
+    def has_parameters(self, pars):
+        """Boolean array telling which stations have all parameters in `pars`."""
+        if any(par not in self._bit for par in pars):
+            return np.zeros(len(self), dtype=bool)
+        wanted = np.zeros(self.mask.shape[1], dtype=np.uint64)
+        for par in pars:
+            bit = self._bit[par]
+            wanted[bit // 64] |= np.uint64(1) << np.uint64(bit % 64)
+        return ((self.mask & wanted) == wanted).all(axis=1)
+
+    def _tree(self, pars):
+        key = frozenset(pars)
+        with self._lock:
+            if key not in self._trees:
+                rows = np.flatnonzero(self.has_parameters(key))
+                tree = cKDTree(self._vectors[rows]) if len(rows) > 0 else None
+                self._trees[key] = (tree, rows)
+            return self._trees[key]
+
+    def nearest(self, latitude, longitude, pars=(), k=1):
+        """Find the nearest stations with the given parameters for many locations.
+
+        Args:
+            latitude (array-like of float): Latitudes of locations.
+            longitude (array-like of float): Longitudes of locations.
+            pars (list of str): Parameters the stations must have.
+            k (int): Number of stations to find for each location.
+
+        Returns:
+            tuple of numpy.ndarray: Indices into `features` and great-circle distances in km.
+                Shape is that of `latitude`, with an extra last axis of length k if k > 1. If
+                fewer than k stations have the parameters, the index is -1 and the distance is
+                inf. Of stations at the same distance, the first in `features` is returned.
+        """
+        latitude = np.asarray(latitude, dtype=float)
+        longitude = np.asarray(longitude, dtype=float)
+        shape = np.broadcast(latitude, longitude).shape + ((k,) if k > 1 else ())
+        tree, rows = self._tree(pars)
+        if tree is None:
+            return np.full(shape, -1), np.full(shape, np.inf)
+        points = _unit_vectors(latitude.ravel(), longitude.ravel())
+        # Query a few extra stations at k=1 to break ties, e.g. several records of a station
+        n = min(len(rows), k if k > 1 else 8)
+        chord, index = tree.query(points, k=n)
+        chord, index = chord.reshape(len(points), -1), index.reshape(len(points), -1)
+        found = index < len(rows)
+        index = np.where(found, rows[np.minimum(index, len(rows) - 1)], -1)
+        dist = np.where(found, 2 * CONST_EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0, 1)),
+                        np.inf)
+        if k == 1:
+            tied = chord <= chord[:, :1] * (1 + 1e-12)
+            index = np.where(tied, index, np.iinfo(index.dtype).max).min(axis=1, keepdims=True)
+            dist = dist[:, :1]
+        elif n < k:
+            index = np.pad(index, ((0, 0), (0, k - n)), constant_values=-1)
+            dist = np.pad(dist, ((0, 0), (0, k - n)), constant_values=np.inf)
+        return index.reshape(shape), dist.reshape(shape)
+
+    def closest_station(self, latitude: float, longitude: float, pars=()):
+        """Get the closest station with all parameters in `pars`.
+
+        Returns:
+            dict: Station as returned by `DMIOpenDataClient.get_stations`, or None if no station
+                has the parameters.
+        """
+        index, _ = self.nearest(latitude, longitude, pars)
+        index = int(index)
+        return None if index < 0 else self.features[index]
+
+
+def _unit_vectors(latitude, longitude):
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
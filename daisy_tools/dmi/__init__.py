@@ -1,2 +1,7 @@
 from .DMIOpenDataClient import *
-from .util import *
\ No newline at end of file
+from .AsyncDMIOpenDataClient import *
+from .StationCatalog import *
+from .ObservationStore import *
+from .RateLimiter import *
+from .bulk import *
+from .util import *
@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+from daisy_tools.dmi.DMIOpenDataClient import DMIOpenDataClient
+from daisy_tools.dmi.util import combine_series, distance
+
+__all__ = [
+    'read_sites',
+    'nearest_stations',
+    'grid_cells',
+    'download_series',
+    'site_frames',
+]
+
+def read_sites(path: str) -> pd.DataFrame:
+    """Read a site table from a csv file.
+
+    The file must have an id column and either latitude and longitude columns or x and y columns
+    in EPSG:25832.
+
+    Args:
+        path (str): Path to csv file.
+
+    Returns:
+        pandas.DataFrame: Sites with the columns id, latitude and longitude.
+    """
+    sites = pd.read_csv(path, dtype={"id": str})
+    if "id" not in sites.columns:
+        raise ValueError(f"{path} has no id column")
+    if sites["id"].duplicated().any():
+        raise ValueError(f"Site ids in {path} are not unique")
+    if "latitude" not in sites.columns or "longitude" not in sites.columns:
+        if "x" not in sites.columns or "y" not in sites.columns:
+            raise ValueError(f"{path} must have latitude and longitude or x and y columns")
+        transformer = Transformer.from_crs("EPSG:25832", "EPSG:4326", always_xy=True)
+        sites["longitude"], sites["latitude"] = transformer.transform(sites["x"].values,
+                                                                      sites["y"].values)
+    return sites[["id", "latitude", "longitude"]]
+
+def nearest_stations(catalog, sites: pd.DataFrame, pars) -> pd.DataFrame:
+    """Find the closest station with each parameter for all sites at once.
+
+    Args:
+        catalog (StationCatalog): Stations, e.g. from `DMIOpenDataClient.station_catalog`.
+        sites (pandas.DataFrame): Sites with the columns id, latitude and longitude.
+        pars (list of str): Parameters.
+
+    Returns:
+        pandas.DataFrame: A row per site and parameter with a station, with the columns site,
+            par, id, dist, lat and lon as in the metadata of `DMIOpenDataClient.get_data`.
+    """
+    tables = []
+    for par in pars:
+        index, dist = catalog.nearest(sites["latitude"].values, sites["longitude"].values, [par])
+        found = index >= 0
+        if not found.any():
+            print(f"No station found with parameter {par}")
+            continue
+        index = index[found]
+        tables.append(pd.DataFrame({
+            "site": sites["id"].values[found],
+            "par": par,
+            "id": catalog.station_id[index],
+            "dist": dist[found],
+            "lat": catalog.latitude[index],
+            "lon": catalog.longitude[index],
+        }))
+    if not tables:
+        return pd.DataFrame(columns=["site", "par", "id", "dist", "lat", "lon"])
+    return pd.concat(tables, ignore_index=True)
+
+def grid_cells(sites: pd.DataFrame, pars, size="10km") -> pd.DataFrame:
+    """Find the DMI grid cell of all sites at once.
+
+    Args:
+        sites (pandas.DataFrame): Sites with the columns id, latitude and longitude.
+        pars (list of str): Parameters.
+        size (str): "10km" or "20km".
+
+    Returns:
+        pandas.DataFrame: A row per site and parameter with the columns site, par, id, dist, lat
+            and lon, where id is the cell id as from `DMIOpenDataClient.grid_name`, and dist, lat
+            and lon are the distance in km to the cell center and the position of the center.
+    """
+    if size not in DMIOpenDataClient.GRID_SIZES:
+        raise ValueError(f"Invalid grid size {size}. "
+                         f"Valid sizes are {', '.join(DMIOpenDataClient.GRID_SIZES)}")
+    resolution = DMIOpenDataClient.GRID_SIZES[size]
+    to_utm = Transformer.from_crs("EPSG:4326", "EPSG:25832", always_xy=True)
+    east, north = to_utm.transform(sites["longitude"].values, sites["latitude"].values)
+    # Cells are numbered in units of 10 km, as in `grid_name`
+    multiple = resolution // 10000
+    n = np.trunc(np.asarray(north) / resolution).astype(int) * multiple
+    e = np.trunc(np.asarray(east) / resolution).astype(int) * multiple
+    cell_id = [f"{size}_{ni}_{ei}" for ni, ei in zip(n, e)]
+    center_lon, center_lat = to_utm.transform(e * 10000 + resolution / 2,
+                                              n * 10000 + resolution / 2,
+                                              direction="INVERSE")
+    center_lat, center_lon = np.asarray(center_lat), np.asarray(center_lon)
+    dist = [distance(lat1, lon1, lat2, lon2) for lat1, lon1, lat2, lon2 in
+            zip(sites["latitude"].values, sites["longitude"].values, center_lat, center_lon)]
+    cells = pd.DataFrame({
+        "site": sites["id"].values,
+        "id": cell_id,
+        "dist": dist,
+        "lat": center_lat,
+        "lon": center_lon,
+    })
+    return pd.concat([cells.assign(par=par) for par in pars], ignore_index=True)[
+        ["site", "par", "id", "dist", "lat", "lon"]
+    ]
+
+def download_series(client, metadata: pd.DataFrame, *, timeres, startdate=None, enddate=None,
+                    workers: int = 4, grid: bool = False) -> dict:
+    """Download each unique station or grid cell and parameter series in `metadata` once.
+
+    Args:
+        client (DMIOpenDataClient): Client for the climateData API.
+        metadata (pandas.DataFrame): As returned by `nearest_stations` or `grid_cells`.
+        timeres (str): Time resolution.
+        startdate (datetime): Start of series.
+        enddate (datetime): End of series.
+        workers (int): Number of series downloaded at a time.
+        grid (bool): If True the ids in `metadata` are grid cells, otherwise stations.
+
+    Returns:
+        dict: ((station or cell id, parameter), pandas.Series) pairs.
+    """
+    pairs = list(metadata[["id", "par"]].drop_duplicates().itertuples(index=False, name=None))
+    print(f"Downloading {len(pairs)} series for {metadata['site'].nunique()} sites")
+
+    def fetch(pair):
+        data_id, par = pair
+        if grid:
+            return client.get_grid_cell_data_df(data_id, par, timeres=timeres,
+                                                startdate=startdate, enddate=enddate)
+        return client.get_series(par=par, station_id=data_id, timeres=timeres,
+                                 startdate=startdate, enddate=enddate)
+
+    with ThreadPoolExecutor(workers) as executor:
+        return dict(zip(pairs, executor.map(fetch, pairs)))
+
+def site_frames(metadata: pd.DataFrame, series: dict):
+    """Fan downloaded series out to sites.
+
+    Args:
+        metadata (pandas.DataFrame): As returned by `nearest_stations` or `grid_cells`.
+        series (dict): As returned by `download_series`.
+
+    Yields:
+        tuple: (site id, data, metadata) for each site in `metadata`, where data and metadata
+            are as returned by `DMIOpenDataClient.get_data`.
+    """
+    for site, rows in metadata.groupby("site", sort=False):
+        data = combine_series({row.par: series[(row.id, row.par)]
+                               for row in rows.itertuples(index=False)})
+        yield site, data, rows.drop(columns="site").reset_index(drop=True)
@@ -14,25 +14,17 @@ TIMERES = "hour"
 # Your API key
 DMI_API_KEY = ""
 
-import pandas as pd
-
 from daisy_tools.dmi import DMIOpenDataClient
 
 client = DMIOpenDataClient(api_key=DMI_API_KEY, api_name="climateData")
 
 # Call it
 def create_weatherfile():
-    [p, m] = client.get_data (latitude=LATITUDE, longitude=LONGITUDE, timeres=TIMERES,
-                   pars=PARS)
     # find the cell that contains the coordinate LATITUDE, LONGITUDE
     cell_id = client.grid_name (latitude=LATITUDE, longitude=LONGITUDE)
 
-    result = pd.DataFrame ()
-    for par in PARS:
-        result[par]=client.get_grid_cell_data_df(cell_id, par)
-
-    # Sorting
-    result.sort_index (inplace=True)
+    # All parameters are fetched concurrently, and the result is sorted by time
+    result = client.get_grid_cell_data (cell_id=cell_id, timeres=TIMERES, pars=PARS)
     file = cell_id + "_" + TIMERES + ".csv"
     result.to_csv (file)
     return 101
@@ -22,10 +22,7 @@ DMI_API_KEY = ""
 
 import numpy as np
 
-from daisy_tools.dmi import DMIOpenDataClient
-from daisy_tools.dmi import construct_datetime_argument, distance
-
-client = DMIOpenDataClient(api_key=DMI_API_KEY, api_name="climateData")
+from daisy_tools.dmi import fetch_data
 
 # Following creates a .csv file containing meassured values for each of the parameters 
 # in the list PARS. The values for each parameter are collected from the weather station
@@ -33,9 +30,10 @@ client = DMIOpenDataClient(api_key=DMI_API_KEY, api_name="climateData")
 # As such, the collected data may come from several weather stations.
 # Weather data is stored in OUTPUT_FILE and meta data for each parameter is stored in 
 # META_FILE
+# The parameters are fetched concurrently.
 def create_weatherfiles():
-    [p, m] = client.get_data (latitude=LATITUDE, longitude=LONGITUDE, timeres=TIMERES,
-                   pars=PARS)
+    [p, m] = fetch_data (api_key=DMI_API_KEY, latitude=LATITUDE, longitude=LONGITUDE,
+                         timeres=TIMERES, pars=PARS)
 
     # Sorting
     p.sort_index (inplace=True)
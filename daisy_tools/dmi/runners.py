@@ -0,0 +1,78 @@
+'''Entry points for executables'''
+import argparse
+import os
+from datetime import datetime
+from .DMIOpenDataClient import DMIOpenDataClient
+from .ObservationStore import ObservationStore
+from .bulk import read_sites, nearest_stations, grid_cells, download_series, site_frames
+
+def run_download_weather():
+    # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser('Download DMI weather data for many sites')
+    parser.add_argument('sites', type=str,
+                        help='Path to csv file with the columns id and latitude and longitude or '
+                        'x and y in EPSG:25832')
+    parser.add_argument('--pars', type=str, nargs='+', required=True,
+                        help='Parameters to download, e.g. acc_precip mean_temp')
+    parser.add_argument('--timeres', type=str, default='hour',
+                        help='Time resolution. Default is hour.')
+    parser.add_argument('--start', type=str, default=None,
+                        help='Start of period, e.g. 2020-01-01T00:00:00. Default is no limit.')
+    parser.add_argument('--end', type=str, default=None,
+                        help='End of period, e.g. 2020-12-31T23:00:00. Default is no limit.')
+    parser.add_argument('--outdir', type=str, default='.',
+                        help='Directory to write <site id>.csv and metadata.csv in')
+    parser.add_argument('--api-key', type=str, default=None,
+                        help='climateData API key. Default is the environment variable '
+                        'DMI_API_KEY.')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of series downloaded at a time. Default is 4.')
+    parser.add_argument('--window', type=str, default=None,
+                        help='Split long periods in windows that are fetched in parallel, e.g. '
+                        'YS for calendar years')
+    parser.add_argument('--grid', type=str, default=None, choices=['10km', '20km'],
+                        help='If set, download data for the DMI grid cell of each site instead '
+                        'of the closest station')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='Maximum requests per second. Default is no limit.')
+    parser.add_argument('--rate-burst', type=int, default=None,
+                        help='Requests that can be made at once. Default is one second worth.')
+    parser.add_argument('--rate-limit-file', type=str, default=None,
+                        help='File to share the rate limit in with other processes')
+    parser.add_argument('--station-cache', type=str, default=None,
+                        help='JSON file to cache the station list in')
+    parser.add_argument('--observation-store', type=str, default=None,
+                        help='SQLite file to store series in, so only missing data is fetched')
+    args = parser.parse_args()
+
+    api_key = args.api_key or os.environ.get('DMI_API_KEY')
+    store = None
+    try:
+        startdate = None if args.start is None else datetime.fromisoformat(args.start)
+        enddate = None if args.end is None else datetime.fromisoformat(args.end)
+        sites = read_sites(args.sites)
+        if args.observation_store is not None:
+            store = ObservationStore(args.observation_store)
+        with DMIOpenDataClient(api_key=api_key, api_name='climateData',
+                               pool_size=4 * args.workers, station_cache=args.station_cache,
+                               observation_store=store, window=args.window,
+                               rate_limit=args.rate_limit, rate_burst=args.rate_burst,
+                               rate_limit_file=args.rate_limit_file) as client:
+            if args.grid is not None:
+                metadata = grid_cells(sites, args.pars, args.grid)
+            else:
+                metadata = nearest_stations(client.station_catalog(), sites, args.pars)
+            series = download_series(client, metadata, timeres=args.timeres,
+                                     startdate=startdate, enddate=enddate, workers=args.workers,
+                                     grid=args.grid is not None)
+        os.makedirs(args.outdir, exist_ok=True)
+        for site, data, _ in site_frames(metadata, series):
+            data.to_csv(os.path.join(args.outdir, f'{site}.csv'))
+        metadata.to_csv(os.path.join(args.outdir, 'metadata.csv'), index=False)
+    except (IOError, ValueError) as e:
+        print(e)
+        return 1
+    finally:
+        if store is not None:
+            store.close()
+    return 0
@@ -1,9 +1,22 @@
 from math import cos, asin, sqrt, pi
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import json
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 __all__ = [
     'construct_datetime_argument',
+    'time_windows',
     'distance',
+    'loads',
+    'features_to_series',
+    'parse_utc_times',
+    'combine_series',
 ]
 
 def construct_datetime_argument(
@@ -12,12 +25,53 @@ def construct_datetime_argument(
 ) -> str | None:
     if from_time and to_time:
         return f"{format_datetime(from_time)}/{format_datetime(to_time)}"
+    # A single datetime only matches that instant, so half-open intervals use ".."
     if from_time:
-        return format_datetime(from_time)
+        return f"{format_datetime(from_time)}/.."
     if to_time:
-        return format_datetime(to_time)
+        return f"../{format_datetime(to_time)}"
     return None
 
+def time_windows(from_time: datetime = None, to_time: datetime = None, window="YS"):
+    """Split a time range into consecutive windows.
+
+    Windows do not overlap. Each window ends one second before the next starts, so no
+    observation is in two windows.
+
+    Args:
+        from_time (datetime): Start of range. If None the range is not split.
+        to_time (datetime): End of range. If None the last window is open.
+        window (str or timedelta): Window length as a pandas frequency, e.g. "YS" for calendar
+            years or "MS" for calendar months, or as a timedelta.
+
+    Returns:
+        list of tuple: (from_time, to_time) pairs to pass to `construct_datetime_argument`.
+    """
+    if from_time is None:
+        return [(from_time, to_time)]
+    if (from_time.utcoffset() is None) != (to_time is None or to_time.utcoffset() is None):
+        # Naive datetimes are UTC, as in `format_datetime`
+        from_time, to_time = [dt if dt is None or dt.utcoffset() is not None
+                              else dt.replace(tzinfo=timezone.utc)
+                              for dt in (from_time, to_time)]
+    if to_time is not None:
+        end = to_time
+    elif from_time.utcoffset() is None:
+        end = datetime.now(timezone.utc).replace(tzinfo=None)
+    else:
+        end = datetime.now(from_time.tzinfo)
+    # Anchor at midnight, so windows start at calendar boundaries whatever the start time is
+    anchor = pd.Timestamp(from_time).normalize()
+    boundaries = [from_time] + [
+        boundary.to_pydatetime() for boundary in pd.date_range(anchor, end, freq=window)
+        if boundary > from_time
+    ]
+    second = timedelta(seconds=1)
+    windows = [(start, next_start - second)
+               for start, next_start in zip(boundaries[:-1], boundaries[1:])]
+    windows.append((boundaries[-1], to_time))
+    return windows
+
 def format_datetime(dt):
     # We can use either ...+HH:mm or ...Z
     if dt.utcoffset() is None:
@@ -46,3 +100,50 @@ def distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     p = pi / 180.0
     a = 0.5 - cos((lat2 - lat1) * p) / 2.0 + cos(lat1 * p) * cos(lat2 * p) * (1.0 - cos((lon2 - lon1) * p)) / 2
     return CONST_EARTH_DIAMETER * asin(sqrt(a))  # 2*R*asin...
+
+
+def loads(content: bytes):
+    """Decode a JSON response body. Uses orjson if installed, which is several times faster than
+    the json module for large feature collections."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def features_to_series(features) -> pd.Series:
+    """Convert features with a value and an end time to a series.
+
+    Args:
+        features (list of dict): Features as returned by `DMIOpenDataClient.get_climate_data`.
+
+    Returns:
+        pandas.Series: `properties.value` as float, with missing values as NaN, indexed by
+            `properties.to` in UTC without time zone.
+    """
+    properties = [feature["properties"] for feature in features]
+    values = np.array([p["value"] for p in properties], dtype=float)
+    return pd.Series(values, index=parse_utc_times([p["to"] for p in properties]))
+
+def parse_utc_times(times) -> pd.DatetimeIndex:
+    """Parse ISO 8601 time stamps to UTC without time zone.
+
+    DMI time stamps look like 2020-01-01T00:00:00Z, which numpy parses in bulk. Other formats
+    are parsed by pandas.
+    """
+    strings = np.array(times, dtype="U")
+    if strings.dtype.itemsize // 4 == 20 and np.char.endswith(strings, "Z").all():
+        return pd.DatetimeIndex(strings.astype("U19").astype("datetime64[s]"))
+    return pd.to_datetime(strings, format="ISO8601", utc=True).tz_localize(None)
+
+def combine_series(series: dict) -> pd.DataFrame:
+    """Combine series into a frame with a column per series and the union of their indexes.
+
+    Args:
+        series (dict): (name, pandas.Series) pairs. Empty series are left out.
+
+    Returns:
+        pandas.DataFrame
+    """
+    series = {name: s for name, s in series.items() if len(s) > 0}
+    if not series:
+        return pd.DataFrame()
+    return pd.concat(series, axis=1, join="outer").sort_index()
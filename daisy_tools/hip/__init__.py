@@ -8,3 +8,8 @@ from .prepare_hip_data_for_daisy import *
 from .units import *
 from .util import *
 from .ddf import *
+from .aggregate import *
+from .interpolation import *
+from .shared import *
+from .cache import *
+from .batch import *
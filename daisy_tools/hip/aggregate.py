@@ -0,0 +1,374 @@
+'''Aggregate time series over days, months, years or day of year'''
+import warnings
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    'PERIODS',
+    'TemporalAggregator',
+    'OnlineStatistics',
+    'aggregate_time_series',
+    'period_labels',
+]
+
+PERIODS = ('day', 'month', 'year', 'doy')
+
+# numpy datetime units used to find the period of a time step
+_PERIOD_UNITS = { 'day' : 'D', 'month' : 'M', 'year' : 'Y' }
+
+class TemporalAggregator():
+    '''Aggregate a time series that is passed in chunks of time steps
+
+    Only the state of the current period is kept in memory, except for period='doy' where the state
+    of all days of the year is kept. Finished periods are returned from `update`, so they can be
+    written as soon as they are done.
+
+    Parameters
+    ----------
+    period : str
+      One of
+        'day', 'month', 'year' : Aggregate each day, month or year.
+        'doy' : Aggregate each day of year across all years, e.g. a climatology.
+
+    statistic : str
+      One of 'mean', 'min', 'max' or 'p<q>' for the q'th percentile, e.g. 'p10'. Percentiles need
+      all values in a period, so they are not supported for period='doy'. NaN values are ignored.
+    '''
+    def __init__(self, period, statistic='mean'):
+        if period not in PERIODS:
+            raise ValueError(f'Unknown period "{period}". Valid periods are {PERIODS}')
+        self.period = period
+        self.statistic = statistic
+        self._q = _parse_percentile(statistic)
+        if self._q is not None and period == 'doy':
+            raise ValueError('Percentiles are not supported for period "doy"')
+        self._key = None
+        self._state = None
+
+    def update(self, time, values):
+        '''Add a chunk of time steps
+
+        Parameters
+        ----------
+        time : array-like of datetime64
+          Time steps. Must be increasing and later than the time steps of previous chunks.
+
+        values : numpy.ndarray
+          Values with time as the first dimension
+
+        Returns
+        -------
+        labels, aggregated
+          Periods that were finished by this chunk. See `period_labels`
+        '''
+        time = np.asarray(time, dtype='datetime64[ns]')
+        values = np.asarray(values, dtype=float)
+        if self.period == 'doy':
+            self._update_doy(time, values)
+            return np.array([], dtype=int), np.empty((0,) + values.shape[1:])
+        keys = time.astype(f'datetime64[{_PERIOD_UNITS[self.period]}]')
+        if len(keys) > 0 and (np.any(keys[1:] < keys[:-1]) or
+                              (self._key is not None and keys[0] < self._key)):
+            raise ValueError('Time steps must be increasing')
+        labels, aggregated = [], []
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) > 0 else []
+        ends = np.r_[starts[1:], len(keys)] if len(keys) > 0 else []
+        for start, end in zip(starts, ends):
+            if self._key is not None and keys[start] != self._key:
+                labels.append(self._key)
+                aggregated.append(self._result())
+                self._state = None
+            self._key = keys[start]
+            self._accumulate(values[start:end])
+        if len(labels) == 0:
+            return np.array([], dtype='datetime64[ns]'), np.empty((0,) + values.shape[1:])
+        return np.array(labels, dtype='datetime64[ns]'), np.stack(aggregated)
+
+    def finish(self):
+        '''Finish the remaining periods
+
+        Returns
+        -------
+        labels, aggregated
+          See `period_labels`. (None, None) if no time steps have been added since the last
+          finished period.
+        '''
+        if self._state is None:
+            return None, None
+        if self.period == 'doy':
+            count = self._state['count']
+            present = np.flatnonzero(count.reshape(len(count), -1).any(axis=1))
+            result = self._result()[present]
+            labels = present + 1
+        else:
+            result = self._result()[None]
+            labels = np.array([self._key], dtype='datetime64[ns]')
+        self._key, self._state = None, None
+        return labels, result
+
+    def _accumulate(self, values):
+        if self._q is not None:
+            if self._state is None:
+                self._state = { 'values' : [] }
+            self._state['values'].append(values)
+            return
+        if self._state is None:
+            self._state = _init_state(self.statistic, values.shape[1:])
+        _accumulate(self._state, self.statistic, np.s_[...], values)
+
+    def _update_doy(self, time, values):
+        if self._state is None:
+            self._state = _init_state(self.statistic, (366,) + values.shape[1:])
+        doy = pd.DatetimeIndex(time).dayofyear.values - 1
+        for day in np.unique(doy):
+            _accumulate(self._state, self.statistic, day, values[doy == day])
+
+    def _result(self):
+        if self._q is not None:
+            with warnings.catch_warnings():
+                # Cells without values are NaN, which is what we want
+                warnings.simplefilter('ignore', RuntimeWarning)
+                return np.nanpercentile(np.concatenate(self._state['values']), self._q, axis=0)
+        if self.statistic == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(self._state['count'] > 0,
+                                self._state['sum'] / self._state['count'], np.nan)
+        return np.where(self._state['count'] > 0, self._state[self.statistic], np.nan)
+
+
+class OnlineStatistics():
+    # pylint: disable=too-many-instance-attributes
+    '''Statistics of each cell over all time steps of a series that is passed in chunks of time
+    steps
+
+    Mean and standard deviation are computed with Welford's algorithm, and min and max are exact.
+    Percentiles are estimated from a histogram per cell with `n_bins` bins of width `bin_width`
+    centered on the mean of the first values of the cell. The estimate lies in the same bin as the
+    true percentile, so it is accurate to one bin width when all values of the cell are within
+    `n_bins / 2` bin widths of that mean. Values outside the histogram are counted in the outermost
+    bins, so percentiles near them can be off by more, but are clipped to min and max. Memory use
+    is proportional to the number of cells times `n_bins` and does not depend on the number of time
+    steps.
+
+    Parameters
+    ----------
+    percentiles : sequence of float
+      Percentiles to estimate, e.g. (10, 50, 90)
+
+    bin_width : float
+      Width of histogram bins in the unit of the values
+
+    n_bins : int
+      Number of histogram bins for each cell. Ignored if `percentiles` is empty.
+    '''
+    def __init__(self, percentiles=(), bin_width=1.0, n_bins=400):
+        for q in percentiles:
+            if not 0 <= q <= 100:
+                raise ValueError(f'Percentile {q} is not between 0 and 100')
+        self.percentiles = tuple(percentiles)
+        self.bin_width = bin_width
+        self.n_bins = n_bins
+        # Running statistics of each cell, allocated by `_init` when the first chunk arrives
+        self._shape = None
+        self._count = None
+        self._mean = None
+        self._m2 = None
+        self._min = None
+        self._max = None
+        self._low = None
+        self._histogram = None
+
+    def update(self, values):
+        '''Add a chunk of time steps
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+          Values with time as the first dimension. NaN values are ignored.
+        '''
+        values = np.asarray(values, dtype=float)
+        if self._shape is None:
+            self._init(values.shape[1:])
+        values = values.reshape(len(values), -1)
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0)
+        with warnings.catch_warnings():
+            # Cells without values in this chunk are NaN and are not merged
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(values, axis=0)
+            m2 = np.nansum((values - mean)**2, axis=0)
+        has = count > 0
+        # Merge chunk statistics into the running statistics (Chan et al.)
+        total = self._count + count
+        delta = np.where(has, mean - self._mean, 0)
+        self._mean[has] += delta[has] * count[has] / total[has]
+        self._m2[has] += m2[has] + delta[has]**2 * self._count[has] * count[has] / total[has]
+        self._count = total
+        self._min = np.fmin(self._min, np.fmin.reduce(values, axis=0))
+        self._max = np.fmax(self._max, np.fmax.reduce(values, axis=0))
+        if len(self.percentiles) > 0:
+            self._update_histogram(values, valid, has, mean)
+
+    def result(self):
+        '''Get the statistics of the values added so far
+
+        Returns
+        -------
+        statistics : dict
+          Arrays with the shape of a time step for
+            'count' : Number of values that are not NaN
+            'mean', 'std', 'min', 'max' : NaN if count is 0. std is the population standard
+                                          deviation
+            'p<q>' : Estimated percentile for each q in `percentiles`, e.g. 'p10'
+        '''
+        count = self._count
+        has = count > 0
+        result = {
+            'count' : count,
+            'mean' : np.where(has, self._mean, np.nan),
+            'std' : np.sqrt(np.where(has, self._m2 / np.maximum(count, 1), np.nan)),
+            'min' : self._min,
+            'max' : self._max,
+        }
+        if len(self.percentiles) > 0:
+            cumulative = np.cumsum(self._histogram, axis=1)
+            for q in self.percentiles:
+                result[f'p{q:g}'] = np.clip(self._percentile(cumulative, q), self._min, self._max)
+        return { name : value.reshape(self._shape) for name, value in result.items() }
+
+    def _init(self, shape):
+        self._shape = shape
+        size = int(np.prod(shape))
+        self._count = np.zeros(size, dtype=np.int64)
+        self._mean = np.zeros(size)
+        self._m2 = np.zeros(size)
+        self._min = np.full(size, np.nan)
+        self._max = np.full(size, np.nan)
+        if len(self.percentiles) > 0:
+            self._low = np.full(size, np.nan)
+            self._histogram = np.zeros((size, self.n_bins), dtype=np.int32)
+
+    def _update_histogram(self, values, valid, has, mean):
+        # Place the histogram of a cell the first time the cell has values
+        new = has & np.isnan(self._low)
+        self._low[new] = (np.round(mean[new] / self.bin_width) - self.n_bins / 2) * self.bin_width
+        bins = np.floor((values - self._low) / self.bin_width)
+        bins = np.clip(np.where(valid, bins, 0), 0, self.n_bins - 1).astype(np.int64)
+        cells = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+        self._histogram += np.bincount(
+            (cells * self.n_bins + bins)[valid], minlength=self._histogram.size
+        ).reshape(self._histogram.shape)
+
+    def _percentile(self, cumulative, q):
+        # Same definition as numpy.percentile with linear interpolation between the two nearest
+        # values, where the values are estimated from the histogram
+        rank = q / 100 * np.maximum(self._count - 1, 0)
+        lower = self._order_statistic(cumulative, np.floor(rank))
+        upper = self._order_statistic(cumulative, np.ceil(rank))
+        value = lower + (rank - np.floor(rank)) * (upper - lower)
+        return np.where(self._count > 0, value, np.nan)
+
+    def _order_statistic(self, cumulative, k):
+        # Estimate the k'th smallest value (starting at 0) by assuming the values in a bin are
+        # evenly spread over the bin
+        idx = np.minimum(np.sum(cumulative <= k[:, None], axis=1), self.n_bins - 1)
+        cells = np.arange(len(idx))
+        in_bin = self._histogram[cells, idx]
+        below = cumulative[cells, idx] - in_bin
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.where(in_bin > 0, (k - below + 0.5) / in_bin, 0.5)
+        return self._low + (idx + fraction) * self.bin_width
+
+
+def aggregate_time_series(time, values, period, statistic='mean'):
+    '''Aggregate a time series that fits in memory. Unlike `TemporalAggregator` percentiles are
+    supported for period='doy'.
+
+    Parameters
+    ----------
+    time : array-like of datetime64
+
+    values : numpy.ndarray
+      Values with time as the first dimension
+
+    period, statistic : str
+      See `TemporalAggregator`
+
+    Returns
+    -------
+    labels, aggregated
+      See `period_labels`
+    '''
+    q = _parse_percentile(statistic)
+    if period == 'doy' and q is not None:
+        doy = pd.DatetimeIndex(np.asarray(time, dtype='datetime64[ns]')).dayofyear.values
+        labels = np.unique(doy)
+        values = np.asarray(values, dtype=float)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return labels, np.stack([np.nanpercentile(values[doy == day], q, axis=0)
+                                     for day in labels])
+    aggregator = TemporalAggregator(period, statistic)
+    first = aggregator.update(time, values)
+    last = aggregator.finish()
+    if last[0] is None:
+        return first
+    return np.concatenate([first[0], last[0]]), np.concatenate([first[1], last[1]])
+
+
+def period_labels(time, period):
+    '''Labels of the periods that a time series is aggregated to
+
+    Parameters
+    ----------
+    time : array-like of datetime64
+
+    period : str
+      See `TemporalAggregator`
+
+    Returns
+    -------
+    labels : numpy.ndarray
+      For 'day', 'month' and 'year' the start of each period as datetime64[ns].
+      For 'doy' the day of year starting at 1.
+    '''
+    if period not in PERIODS:
+        raise ValueError(f'Unknown period "{period}". Valid periods are {PERIODS}')
+    time = np.asarray(time, dtype='datetime64[ns]')
+    if period == 'doy':
+        return np.unique(pd.DatetimeIndex(time).dayofyear.values)
+    return np.unique(time.astype(f'datetime64[{_PERIOD_UNITS[period]}]')).astype('datetime64[ns]')
+
+
+def _parse_percentile(statistic):
+    if statistic in ('mean', 'min', 'max'):
+        return None
+    try:
+        if statistic.startswith('p'):
+            q = float(statistic[1:])
+            if 0 <= q <= 100:
+                return q
+    except ValueError:
+        pass
+    raise ValueError(f'Unknown statistic "{statistic}". Valid statistics are mean, min, max or '
+                     'p<q> with 0 <= q <= 100')
+
+
+def _init_state(statistic, shape):
+    state = { 'count' : np.zeros(shape, dtype=np.int64) }
+    if statistic == 'mean':
+        state['sum'] = np.zeros(shape)
+    else:
+        state[statistic] = np.full(shape, np.nan)
+    return state
+
+
+def _accumulate(state, statistic, idx, values):
+    state['count'][idx] += np.sum(~np.isnan(values), axis=0)
+    if statistic == 'mean':
+        state['sum'][idx] += np.nansum(values, axis=0)
+    elif statistic == 'min':
+        state['min'][idx] = np.fmin(state['min'][idx], np.fmin.reduce(values, axis=0))
+    else:
+        state['max'][idx] = np.fmax(state['max'][idx], np.fmax.reduce(values, axis=0))
+
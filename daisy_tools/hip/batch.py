@@ -0,0 +1,231 @@
+'''Extract Daisy relevant data from HIP data for many points'''
+import os
+import pandas as pd
+from .ddf import DDFPressure
+from .cache import ResultCache, cached_prepare_hip_data_for_daisy
+from .column_store import open_hs_model
+
+__all__ = [
+    'OpenDatasets',
+    'save_hip_data_for_daisy',
+    'prepare_hip_data_for_points',
+    'point_outdir',
+    'read_points',
+]
+
+class OpenDatasets():
+    '''Keep datasets open, so they can be reused across extractions
+
+    A dataset is reopened if the file has changed since it was opened.
+    '''
+    def __init__(self):
+        self._datasets = {}
+
+    def get(self, path):
+        '''Get an open dataset
+
+        Parameters
+        ----------
+        path : str
+          Path to NetCDF file or column store
+
+        Returns
+        -------
+        xarray.Dataset or column_store.ColumnStore
+        '''
+        fingerprint = ResultCache.fingerprint(path)
+        if fingerprint[0] in self._datasets:
+            old_fingerprint, ds = self._datasets[fingerprint[0]]
+            if old_fingerprint == fingerprint:
+                return ds
+            ds.close()
+        ds = open_hs_model(path)
+        self._datasets[fingerprint[0]] = (fingerprint, ds)
+        return ds
+
+    def close(self):
+        '''Close all open datasets'''
+        for _, ds in self._datasets.values():
+            ds.close()
+        self._datasets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def save_hip_data_for_daisy(outdir, soil_column, head_elevation, top2m_head_elevation,
+                            truncate=False):
+    '''Save the output of `prepare_hip_data_for_daisy` as csv and ddf files
+
+    Parameters
+    ----------
+    outdir : str
+      Directory to store files in. Created if it does not exist.
+
+    soil_column, head_elevation, top2m_head_elevation : pandas.DataFrame
+      See `prepare_hip_data_for_daisy`
+
+    truncate : bool
+      If True round values to 0 decimals.
+
+    Returns
+    -------
+    saved_paths : dict of (name, path) pairs of the saved files
+    '''
+    os.makedirs(outdir, exist_ok=True)
+    if truncate:
+        head_elevation['head_elevation'] = head_elevation['head_elevation'].round(0).astype(int)
+        cols = ['terrain_height', 'elevation', 'thickness']
+        soil_column[cols] = soil_column[cols].round(0).astype(int)
+
+    paths = {
+             'Soil column' : os.path.join(outdir, 'soil_column.csv'),
+             'Pressure' : os.path.join(outdir, 'pressure.csv'),
+             'DDF Pressure' : os.path.join(outdir, 'pressure_table.ddf'),
+             'Top 2m pressure' : os.path.join(outdir, 'top2m_pressure.csv'),
+             'DDF Top 2m pressure' : os.path.join(outdir, 'top2m_pressure_table.ddf'),
+             'Top aquitard' : os.path.join(outdir, 'top_aquitard.csv')
+    }
+    soil_column.to_csv(paths['Soil column'], index=False)
+    head_elevation.to_csv(paths['Pressure'], index=False)
+    DDFPressure(head_elevation).save(paths['DDF Pressure'])
+    top2m_head_elevation.to_csv(paths['Top 2m pressure'], index=False)
+    DDFPressure(top2m_head_elevation).save(paths['DDF Top 2m pressure'])
+    top_aquitard = soil_column.loc[soil_column['top_aquitard']]
+    top_aquitard[
+        ['dk_layer', 'elevation', 'thickness', 'unit', 'conductive_properties']
+    ].to_csv(paths['Top aquitard'], index=False)
+    return paths
+
+
+def point_outdir(outdir, x, y):
+    '''Output directory for a single point when extracting many points
+
+    Parameters
+    ----------
+    outdir : str
+
+    x, y : float
+
+    Returns
+    -------
+    path : str
+      <outdir>/x<x>_y<y>
+    '''
+    return os.path.join(outdir, f'x{x:.12g}_y{y:.12g}')
+
+
+def read_points(path):
+    '''Read points from a csv file with columns x and y. If there are no such columns the first
+    two columns are used.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    points : list of (float, float)
+    '''
+    df = pd.read_csv(path)
+    columns = { c.lower() : c for c in df.columns }
+    if 'x' in columns and 'y' in columns:
+        df = df[[columns['x'], columns['y']]]
+    return [(float(x), float(y)) for x, y in df.iloc[:, :2].itertuples(index=False)]
+
+
+def prepare_hip_data_for_points(hs_model_path, gw_potential_path, dk_model, points, unit, outdir,
+                                truncate=False, cache=None, datasets=None, progress=None,
+                                cancel=None, writer=None, start=None, end=None, period=None,
+                                statistic='mean', method='linear'):
+    # pylint: disable=too-many-arguments,too-many-locals
+    '''Run `prepare_hip_data_for_daisy` for each point and save the results in a directory per
+    point or with `writer`. An error in one point does not stop extraction of the remaining points.
+
+    Parameters
+    ----------
+    hs_model_path : str
+      Path to HIP hydrostratigraphic model or column store
+
+    gw_potential_path : str
+      Path to HIP ground water potential time series
+
+    dk_model : str
+      Name of DK-model HIP. Valid model names are {
+        'DK1', 'DK2', 'DK3', 'DK4', 'DK5', 'DK6', 'DK7'
+      }
+
+    points : sequence of (x, y)
+      Values along X and Y dimension.
+
+    unit : cfunits.Units
+      Express values in this unit
+
+    outdir : str
+      Results for point (x, y) are stored in `point_outdir(outdir, x, y)`. Ignored if `writer` is
+      not None.
+
+    truncate : bool
+      If True round values to 0 decimals.
+
+    cache : ResultCache
+      If not None, reuse cached results
+
+    datasets : OpenDatasets
+      If not None, reuse open datasets. Otherwise datasets are opened for this call only.
+
+    progress : callable
+      If not None, called as progress(n_done, n_points, (x, y)) after each point
+
+    cancel : threading.Event
+      If not None, stop before the next point when set
+
+    writer : parquet.ParquetWriter
+      If not None, add results to `writer` instead of saving them in a directory per point
+
+    start, end : str or datetime-like
+      Only extract head elevation between `start` and `end`, both included. See
+      `util.select_time`
+
+    period, statistic : str
+      If `period` is not None aggregate head elevation with `statistic` over each period. See
+      `extract_head_elevation`
+
+    method : str
+      'linear' or 'nearest'. See `prepare_hip_data_for_daisy`
+
+    Returns
+    -------
+    saved, errors
+      saved : dict of ((x, y), outdir) pairs for points that were saved. If `writer` is not None,
+              outdir is `writer.outdir`
+      errors : dict of ((x, y), str) pairs for points that failed
+    '''
+    saved, errors = {}, {}
+    with OpenDatasets() as own_datasets:
+        if datasets is None:
+            datasets = own_datasets
+        for i, (x, y) in enumerate(points):
+            if cancel is not None and cancel.is_set():
+                break
+            try:
+                result = cached_prepare_hip_data_for_daisy(
+                    hs_model_path, gw_potential_path, dk_model, x, y, unit, cache=cache,
+                    datasets=datasets, start=start, end=end, period=period, statistic=statistic,
+                    method=method
+                )
+                if writer is None:
+                    point_dir = point_outdir(outdir, x, y)
+                    save_hip_data_for_daisy(point_dir, *result, truncate=truncate)
+                    saved[(x, y)] = point_dir
+                else:
+                    writer.add(*result, truncate=truncate)
+                    saved[(x, y)] = writer.outdir
+            except Exception as e: # pylint: disable=broad-exception-caught
+                errors[(x, y)] = str(e)
+            if progress is not None:
+                progress(i + 1, len(points), (x, y))
+    return saved, errors
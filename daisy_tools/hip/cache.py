@@ -0,0 +1,196 @@
+'''On-disk cache of results from prepare_hip_data_for_daisy'''
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+import xarray as xr
+from .prepare_hip_data_for_daisy import prepare_hip_data_for_daisy
+from .column_store import open_hs_model
+
+__all__ = [
+    'ResultCache',
+    'cached_prepare_hip_data_for_daisy',
+]
+
+class ResultCache():
+    '''Size bounded on-disk cache with least recently used eviction
+
+    Entries are keyed on fingerprints of the input files, so the cache is invalidated when an input
+    file changes. Entries are stored as zlib compressed pickles.
+
+    Parameters
+    ----------
+    cache_dir : str
+      Directory to store cache entries in. Created if it does not exist.
+
+    max_size : int
+      Maximum size of the cache in bytes. When exceeded, the least recently used entries are
+      removed.
+    '''
+    SUFFIX = '.pkl.z'
+
+    def __init__(self, cache_dir, max_size=1024**3):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(path):
+        '''Fingerprint a file from its absolute path, size and modification time
+
+        Parameters
+        ----------
+        path : str
+
+        Returns
+        -------
+        fingerprint : tuple
+        '''
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    def key(self, paths, **params):
+        '''Make a cache key from input files and parameters
+
+        Parameters
+        ----------
+        paths : sequence of str
+          Input files. Only the fingerprint of each file is used, the files are not opened.
+
+        **params
+          Parameters that the result depends on. Values are converted with `repr`, so floats are
+          matched exactly.
+
+        Returns
+        -------
+        key : str
+        '''
+        h = hashlib.sha256()
+        for path in paths:
+            h.update(repr(self.fingerprint(path)).encode('utf-8'))
+        for name in sorted(params):
+            h.update(f'{name}={params[name]!r};'.encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        '''Get a cached value
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        value or None if key is not in the cache
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass # Evicted by another process after it was read
+        return value
+
+    def put(self, key, value):
+        '''Store a value in the cache and evict old entries if the cache is full
+
+        Parameters
+        ----------
+        key : str
+
+        value : picklable object
+        '''
+        path = self._path(key)
+        # A unique temporary file, so threads and processes writing the same key do not collide
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(self.SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue # Removed by another process
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        size = sum(e[1] for e in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass # Removed by another process
+            size -= entry_size
+
+
+def cached_prepare_hip_data_for_daisy(hs_model_path, gw_potential_path, dk_model, x, y, unit,
+                                      cache=None, datasets=None, method='linear', **kwargs):
+    # pylint: disable=too-many-arguments
+    '''Run `prepare_hip_data_for_daisy` on files, reusing results from `cache` if possible
+
+    On a cache hit the input files are not opened.
+
+    Parameters
+    ----------
+    hs_model_path : str
+      Path to HIP hydrostratigraphic model or column store. See `column_store.open_hs_model`
+
+    gw_potential_path : str
+      Path to HIP ground water potential time series
+
+    dk_model, x, y, unit
+      See `prepare_hip_data_for_daisy`
+
+    cache : ResultCache
+      If None the result is always computed
+
+    datasets : batch.OpenDatasets
+      If not None, get open datasets from `datasets` instead of opening the files
+
+    method : str
+      'linear' or 'nearest'. See `prepare_hip_data_for_daisy`
+
+    **kwargs
+      Passed on to `prepare_hip_data_for_daisy`
+
+    Returns
+    -------
+    soil_column, head_elevation, top2m_head_elevation
+      See `prepare_hip_data_for_daisy`
+    '''
+    if cache is not None:
+        key = cache.key([hs_model_path, gw_potential_path], dk_model=dk_model, x=float(x),
+                        y=float(y), unit=str(unit), method=method, **kwargs)
+        result = cache.get(key)
+        if result is not None:
+            return result
+    if datasets is not None:
+        result = prepare_hip_data_for_daisy(dk_model, datasets.get(hs_model_path),
+                                            datasets.get(gw_potential_path), x, y, unit,
+                                            method=method, **kwargs)
+    else:
+        with open_hs_model(hs_model_path) as hs_model, \
+             xr.open_dataset(gw_potential_path) as gw_potential:
+            result = prepare_hip_data_for_daisy(dk_model, hs_model, gw_potential, x, y, unit,
+                                                method=method, **kwargs)
+    if cache is not None:
+        cache.put(key, result)
+    return result
@@ -0,0 +1,265 @@
+'''Compact memory mapped store of the present layers in each column of a hydrostratigraphic model'''
+import json
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import cfunits
+from .units import unit_map
+from .util import bounds_check, is_missing_layer
+from .extract_top_aquifer_potential import _get_elevation
+
+__all__ = [
+    'ColumnStore',
+    'compile_column_store',
+    'open_hs_model',
+]
+
+META_FILE = 'meta.json'
+FORMAT_VERSION = 1
+
+class ColumnStore():
+    # pylint: disable=too-many-instance-attributes
+    '''Read only access to a column store made by `compile_column_store`
+
+    The store holds the terrain height and the layers that are present in each grid cell as a
+    ragged array with an offset per cell, so a column is read with two lookups. Arrays are memory
+    mapped, so opening is cheap and processes reading the same store share pages through the page
+    cache.
+
+    Parameters
+    ----------
+    path : str
+      Directory holding the store
+
+    Attributes
+    ----------
+    X, Y : numpy.ndarray
+      Grid coordinates
+
+    layer_names : list of str
+      Layers using HIP elevation naming style. Layer ids in the store index this list.
+
+    unit : cfunits.Units
+      Unit of terrain height and elevation
+
+    missing_layer_unit : cfunits.Units
+      Thickness of layers that were left out when the store was compiled
+    '''
+    def __init__(self, path):
+        self.path = path
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.isfile(meta_path):
+            raise ValueError(f'"{path}" is not a column store')
+        with open(meta_path, encoding='utf8') as f:
+            meta = json.load(f)
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError(f'Column store "{path}" has version {meta["version"]}, expected '
+                             f'{FORMAT_VERSION}')
+        self.attrs = meta['attrs']
+        self.layer_names = meta['layer_names']
+        self.unit = cfunits.Units(meta['unit'])
+        self.missing_layer_unit = cfunits.Units(meta['missing_layer_unit'])
+        self.X = np.load(os.path.join(path, 'X.npy'))
+        self.Y = np.load(os.path.join(path, 'Y.npy'))
+        self.terrain_height = self._open('terrain_height', np.float32, (len(self.X), len(self.Y)))
+        self.offsets = self._open('offsets', np.int64, (len(self.X) * len(self.Y) + 1,))
+        self.layer = self._open('layer', np.uint8, (meta['n_values'],))
+        self.elevation = self._open('elevation', np.float32, (meta['n_values'],))
+
+    def _open(self, name, dtype, shape):
+        if np.prod(shape) == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, f'{name}.bin'), dtype=dtype, mode='r',
+                         shape=shape)
+
+    def cell(self, x, y, method='linear'):
+        '''Find the grid cell of a point
+
+        Parameters
+        ----------
+        x, y : float
+          Values along X and Y dimension
+
+        method : str
+          'nearest' for the nearest grid cell. 'linear' is only supported at grid cell centers,
+          where it is the same as the grid cell, because the store does not hold the missing
+          layers needed to interpolate between columns.
+
+        Returns
+        -------
+        i, j : int
+          Index along X and Y
+
+        Raises
+        ------
+        IndexError
+          If the point is outside the grid
+
+        ValueError
+          If `method` is 'linear' and the point is not at a grid cell center
+        '''
+        bounds_check({ 'X' : self.X, 'Y' : self.Y }, x, y)
+        i = int(np.argmin(np.abs(self.X - x)))
+        j = int(np.argmin(np.abs(self.Y - y)))
+        if method == 'linear':
+            if self.X[i] != x or self.Y[j] != y:
+                raise ValueError(f'x={x}, y={y} is not a grid cell center. A column store only '
+                                 'supports linear interpolation at grid cell centers, use method '
+                                 '"nearest" instead')
+        elif method != 'nearest':
+            raise ValueError(f'Unknown method "{method}". Valid methods are linear and nearest')
+        return i, j
+
+    def column(self, i, j):
+        '''Get the present layers of a grid cell
+
+        Parameters
+        ----------
+        i, j : int
+          Index along X and Y
+
+        Returns
+        -------
+        layer_ids, elevation, terrain_height
+          layer_ids : numpy.ndarray
+            Index into `layer_names` of each present layer, ordered from the top
+          elevation : numpy.ndarray
+            Elevation of the bottom of each present layer
+          terrain_height : float
+        '''
+        cell = i * len(self.Y) + j
+        start, end = self.offsets[cell], self.offsets[cell + 1]
+        return self.layer[start:end], self.elevation[start:end], self.terrain_height[i, j]
+
+    def soil_column(self, x, y, base_unit=None, return_terrain_height=False, layers=None,
+                    method='linear'):
+        # pylint: disable=too-many-arguments
+        '''Extract the soil column at a single grid cell
+
+        Returns the same as `extract_soil_column`, except that elevations are stored as float32.
+        See `extract_soil_column` for a description of the parameters.
+        '''
+        layer_ids, elevation, terrain_height = self.column(*self.cell(x, y, method))
+        elevation = np.concatenate([[terrain_height], elevation]).astype(float)
+        if base_unit is None:
+            base_unit = self.unit
+        elif base_unit != self.unit:
+            elevation = cfunits.Units.conform(elevation, self.unit, base_unit)
+        df = pd.DataFrame({
+            'X' : x,
+            'Y' : y,
+            'layer' : np.array(self.layer_names, dtype=object)[layer_ids],
+            'unit' : base_unit,
+            'elevation' : elevation[1:],
+            'thickness' : elevation[:-1] - elevation[1:],
+        })
+        if layers is not None:
+            if isinstance(layers, str):
+                layers = [layers]
+            df = df[df['layer'].isin(layers)].reset_index(drop=True)
+        if return_terrain_height:
+            return df, elevation[0]
+        return df
+
+    def close(self):
+        '''Release the memory maps'''
+        for name in ('terrain_height', 'offsets', 'layer', 'elevation'):
+            setattr(self, name, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def compile_column_store(hs_model, path, missing_layer_unit=cfunits.Units('0.5m'),
+                         block_size=100):
+    # pylint: disable=too-many-locals
+    '''Compile a hydrostratigraphic model to a column store
+
+    Layers with thickness = missing_layer_thickness are left out, so only present layers are
+    stored. The model is read `block_size` rows along X at a time.
+
+    Parameters
+    ----------
+    hs_model : xarray.Dataset
+      A HIP hydrostratigraphic model. See `extract_soil_column`
+
+    path : str
+      Directory to store the column store in. Created if it does not exist.
+
+    missing_layer_unit : cfunits.Units
+      Thickness of layers that should be ignored expressed as a unit.
+
+    block_size : int
+      Number of rows along X to read at a time
+
+    Returns
+    -------
+    ColumnStore
+    '''
+    layer_names = list(hs_model.data_vars.keys())
+    if len(layer_names) - 1 > np.iinfo(np.uint8).max + 1:
+        raise ValueError(f'Column store supports at most 256 layers, got {len(layer_names) - 1}')
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, META_FILE)
+    if os.path.exists(meta_path):
+        # Invalidate the old store until the new one is complete
+        os.remove(meta_path)
+    n_x = hs_model.sizes['X']
+    unit = unit_map[hs_model[layer_names[0]].units]
+    np.save(os.path.join(path, 'X.npy'), hs_model['X'].values)
+    np.save(os.path.join(path, 'Y.npy'), hs_model['Y'].values)
+    missing_layer_thickness = cfunits.Units.conform(1, missing_layer_unit, unit)
+    # pylint: disable-next=consider-using-with
+    files = { name : open(os.path.join(path, f'{name}.bin'), 'wb')
+              for name in ('terrain_height', 'offsets', 'layer', 'elevation') }
+    try:
+        n_values = 0
+        files['offsets'].write(np.zeros(1, dtype=np.int64).tobytes())
+        for start in range(0, n_x, block_size):
+            block = hs_model.isel(X=slice(start, start + block_size))
+            elevation, _ = _get_elevation(block)
+            # (cells, layers) with cells in X major order, so np.nonzero keeps columns together
+            elevation = elevation.reshape(len(layer_names), -1).T
+            present = ~is_missing_layer(elevation[:, :-1] - elevation[:, 1:],
+                                        missing_layer_thickness)
+            cells, layer_ids = np.nonzero(present)
+            files['terrain_height'].write(elevation[:, 0].astype(np.float32).tobytes())
+            files['layer'].write(layer_ids.astype(np.uint8).tobytes())
+            files['elevation'].write(elevation[cells, layer_ids + 1].astype(np.float32).tobytes())
+            offsets = n_values + np.cumsum(present.sum(axis=1), dtype=np.int64)
+            files['offsets'].write(offsets.tobytes())
+            n_values += len(cells)
+    finally:
+        for f in files.values():
+            f.close()
+    with open(meta_path, 'w', encoding='utf8') as f:
+        json.dump({
+            'version' : FORMAT_VERSION,
+            'n_values' : int(n_values),
+            'layer_names' : layer_names[1:],
+            'unit' : str(unit),
+            'missing_layer_unit' : str(missing_layer_unit),
+            'attrs' : { k : str(v) for k, v in hs_model.attrs.items() },
+        }, f)
+    return ColumnStore(path)
+
+
+def open_hs_model(path):
+    '''Open a hydrostratigraphic model from a NetCDF file or a column store
+
+    Parameters
+    ----------
+    path : str
+      Path to NetCDF file or column store directory
+
+    Returns
+    -------
+    xarray.Dataset or ColumnStore
+    '''
+    if os.path.isdir(path):
+        return ColumnStore(path)
+    return xr.open_dataset(path)
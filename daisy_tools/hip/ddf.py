@@ -1,4 +1,7 @@
 '''DDF representations of HIP data'''
+import pandas as pd
+from .aggregate import aggregate_time_series
+
 __all__ = [
     'DDFPressure',
 ]
@@ -10,8 +13,28 @@ class DDFPressure():
     ----------
     head_elevation : pandas.DataFrame
       Extracted head elevation
+
+    period : str
+      If not None aggregate head elevation over each 'day', 'month' or 'year'. DDF files need
+      dates, so 'doy' is not supported. See `aggregate.TemporalAggregator`
+
+    statistic : str
+      Statistic to aggregate with. One of 'mean', 'min', 'max' or 'p<q>', e.g. 'p10'. Ignored if
+      `period` is None.
     '''
-    def __init__(self, head_elevation):        
+    def __init__(self, head_elevation, period=None, statistic='mean'):
+        if 'time' not in head_elevation or period == 'doy':
+            raise ValueError('DDF files need dates, so head elevation aggregated by day of year '
+                             'is not supported')
+        if period is not None:
+            time, values = aggregate_time_series(head_elevation['time'].values,
+                                                 head_elevation['head_elevation'].values,
+                                                 period, statistic)
+            head_elevation = pd.DataFrame({
+                'time' : time,
+                'head_elevation' : values,
+                'unit' : head_elevation['unit'].iloc[0],
+            })
         self.ddf = [
             ['ddf-0.0 --- pressure table with header'],
             ['---'],
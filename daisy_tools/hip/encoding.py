@@ -0,0 +1,134 @@
+'''NetCDF encoding of extracted rasters'''
+import numpy as np
+
+__all__ = [
+    'raster_encoding',
+    'check_encoding_range',
+    'mask_invalid',
+]
+
+DTYPES = ('float64', 'float32', 'int16', 'int32')
+COMPRESSIONS = ('zlib', 'zstd')
+CHUNK_LAYOUTS = ('map', 'point')
+
+# Chunk shapes for the two read patterns. A map read gets a single time step for a large area, a
+# point read gets the full time series for a single grid point.
+MAP_CHUNK = 512
+POINT_CHUNK = (366, 16)
+
+def raster_encoding(shape, dtype='float64', scale_factor=None, add_offset=None, compression=None,
+                    complevel=4, chunks=None):
+    # pylint: disable=too-many-arguments
+    '''Encoding of a raster with dimensions (time, y, x) for `xarray.DataArray.to_netcdf`
+
+    Integer types store values packed with `scale_factor` and `add_offset`, i.e. a stored value v
+    is read as v * scale_factor + add_offset, and values are rounded to the nearest multiple of
+    `scale_factor` when written. Missing values are stored as the smallest value of the type.
+
+    Parameters
+    ----------
+    shape : tuple of int
+      Shape of the raster (time, y, x)
+
+    dtype : str
+      One of 'float64', 'float32', 'int16', 'int32'
+
+    scale_factor, add_offset : float
+      Packing of integer types. scale_factor defaults to 1, which stores values with 0 decimals,
+      and add_offset defaults to 0. Must be None for float types.
+
+    compression : str
+      None, 'zlib' or 'zstd'. zstd requires that netCDF is built with zstd support.
+
+    complevel : int
+      Compression level. Ignored if `compression` is None.
+
+    chunks : str
+      None for the netCDF default, 'map' for chunks holding single time steps for large areas or
+      'point' for chunks holding long time series for small areas.
+
+    Returns
+    -------
+    encoding : dict
+
+    Raises
+    ------
+    ValueError
+      If the options are not valid
+    '''
+    if dtype not in DTYPES:
+        raise ValueError(f'Unknown dtype "{dtype}". Valid dtypes are {", ".join(DTYPES)}')
+    encoding = { 'dtype' : dtype }
+    if np.issubdtype(dtype, np.integer):
+        encoding['_FillValue'] = np.iinfo(dtype).min
+        encoding['scale_factor'] = 1.0 if scale_factor is None else float(scale_factor)
+        encoding['add_offset'] = 0.0 if add_offset is None else float(add_offset)
+    elif scale_factor is not None or add_offset is not None:
+        raise ValueError('scale_factor and add_offset are only supported for integer types')
+    else:
+        encoding['_FillValue'] = np.nan
+    if compression is not None:
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression "{compression}". Valid compressions are '
+                             f'{", ".join(COMPRESSIONS)}')
+        if compression == 'zlib':
+            encoding['zlib'] = True
+        else:
+            encoding['compression'] = compression
+        encoding['complevel'] = complevel
+        encoding['shuffle'] = True
+    if chunks is not None:
+        if chunks not in CHUNK_LAYOUTS:
+            raise ValueError(f'Unknown chunk layout "{chunks}". Valid layouts are '
+                             f'{", ".join(CHUNK_LAYOUTS)}')
+        n_time, n_y, n_x = shape
+        if chunks == 'map':
+            chunksizes = (1, min(n_y, MAP_CHUNK), min(n_x, MAP_CHUNK))
+        else:
+            chunksizes = (min(n_time, POINT_CHUNK[0]), min(n_y, POINT_CHUNK[1]),
+                          min(n_x, POINT_CHUNK[1]))
+        encoding['chunksizes'] = tuple(max(size, 1) for size in chunksizes)
+    return encoding
+
+
+def check_encoding_range(values, encoding):
+    '''Check that values can be stored with an encoding from `raster_encoding`
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+
+    encoding : dict
+
+    Raises
+    ------
+    ValueError
+      If a value is outside the range of the packed integer type
+    '''
+    if 'scale_factor' not in encoding or np.isnan(values).all():
+        return
+    info = np.iinfo(encoding['dtype'])
+    # The smallest value is the fill value
+    low = (info.min + 1) * encoding['scale_factor'] + encoding['add_offset']
+    high = info.max * encoding['scale_factor'] + encoding['add_offset']
+    if np.nanmin(values) < low or np.nanmax(values) > high:
+        raise ValueError(f'Values between {np.nanmin(values)} and {np.nanmax(values)} cannot be '
+                         f'stored as {encoding["dtype"]} with scale_factor '
+                         f'{encoding["scale_factor"]} and add_offset {encoding["add_offset"]}. '
+                         f'The range is {low} to {high}.')
+
+
+def mask_invalid(values):
+    '''Mask NaN, so netCDF4 stores it as the fill value when writing packed integer variables
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+
+    Returns
+    -------
+    numpy.ma.MaskedArray
+      Masked values are set to 0, so packing them does not cast NaN to an integer
+    '''
+    invalid = np.isnan(values)
+    return np.ma.array(np.where(invalid, 0, values), mask=invalid)
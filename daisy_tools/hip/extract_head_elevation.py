@@ -1,9 +1,10 @@
 '''See extract_head_elevation'''
 import pandas as pd
 import cfunits
-import xarray as xr
 from .units import unit_map
-from .util import bounds_check
+from .util import bounds_check, select_time
+from .aggregate import aggregate_time_series
+from .interpolation import GridWeights
 
 __all__ = [
     'extract_head_elevation'
@@ -11,7 +12,8 @@ __all__ = [
 
 HEAD_ELEVATION_LAYER = 'head elevation in saturated zone'
 
-def extract_head_elevation(gw_potential, x, y, layers=None, base_unit=None):
+def extract_head_elevation(gw_potential, x, y, layers=None, base_unit=None, start=None,
+                           end=None, period=None, statistic='mean', method='linear'):
     '''Extract the head elevation at a single grid cell
 
     Parameters
@@ -34,6 +36,21 @@ def extract_head_elevation(gw_potential, x, y, layers=None, base_unit=None):
       Convert head_elevation to `base_unit`.
       If None keep the original unit
 
+    start, end : str or datetime-like
+      Only extract time steps between `start` and `end`, both included. See `util.select_time`
+
+    period : str
+      If not None aggregate head elevation over each 'day', 'month' or 'year', or over each day of
+      year with 'doy'. See `aggregate.TemporalAggregator`
+
+    statistic : str
+      Statistic to aggregate with. One of 'mean', 'min', 'max' or 'p<q>', e.g. 'p10'. Ignored if
+      `period` is None.
+
+    method : str
+      'linear' for bilinear interpolation between the neighbouring grid cells or 'nearest' for the
+      nearest grid cell. See `interpolation.GridWeights`
+
     Returns
     -------
     head_elevation : pandas.DataFrame
@@ -41,34 +58,42 @@ def extract_head_elevation(gw_potential, x, y, layers=None, base_unit=None):
         X : x coordinate of grid cell
         Y : y coordinate of grid cell
         layer : Name of layer using HIP pressure naming style
-        time : Time coordinate of grid cell
+        time : Time coordinate of grid cell. Start of period if `period` is not None.
+        day_of_year : Day of year instead of time if `period` is 'doy'
         unit : Unit of head_elevation
         head_elevation : Head elevation in grid cell
     '''
-    # pylint: disable=duplicate-code, too-many-arguments
+    # pylint: disable=duplicate-code, too-many-arguments, too-many-locals
     bounds_check(gw_potential, x, y)
+    # Select time steps and layers before interpolating, so only the needed values are read
+    gw_potential = select_time(gw_potential, start, end)
     if layers is None:
         layers = gw_potential['layer'] # extract all layers
     elif isinstance(layers, int):
         layers = [layers]
-    head_elevation = gw_potential.isel(layer=layers).interp(X=x, Y=y).to_array()
+    weights = GridWeights.from_dataset(gw_potential, x, y, method)
+    head_elevation = weights.interp(gw_potential[HEAD_ELEVATION_LAYER].isel(layer=layers))
     unit = unit_map[gw_potential[HEAD_ELEVATION_LAYER].units]
     if base_unit is not None and base_unit != unit:
-        head_elevation = xr.DataArray(
-            cfunits.Units.conform(
-                head_elevation, unit, base_unit),
-            coords=head_elevation.coords
+        head_elevation = head_elevation.copy(
+            data=cfunits.Units.conform(head_elevation.values, unit, base_unit)
         )
     else:
         base_unit = unit
-    # TODO: Change to an xarray
-    return pd.concat([
-        pd.DataFrame({
+    time_column = 'day_of_year' if period == 'doy' else 'time'
+    frames = []
+    for layer in layers:
+        time = gw_potential['time'].values
+        values = head_elevation.sel(layer=layer).transpose('time').values
+        if period is not None:
+            time, values = aggregate_time_series(time, values, period, statistic)
+        # TODO: Change to an xarray
+        frames.append(pd.DataFrame({
             'X' : x,
             'Y' : y,
             'layer' : int(layer),
-            'time' : gw_potential['time'],
-            'head_elevation' : head_elevation.sel(layer=layer).values.squeeze(),
+            time_column : time,
+            'head_elevation' : values,
             'unit' : base_unit,
-        }) for layer in layers
-    ])
+        }))
+    return pd.concat(frames)
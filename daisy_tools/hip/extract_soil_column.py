@@ -3,7 +3,9 @@ import numpy as np
 import pandas as pd
 import cfunits
 from .units import unit_map
-from .util import bounds_check
+from .util import bounds_check, select_hs_layers, is_missing_layer
+from .interpolation import GridWeights
+from .column_store import ColumnStore
 
 __all__ = [
     'extract_soil_column'
@@ -13,7 +15,9 @@ __all__ = [
 def extract_soil_column(hs_model, x, y,
                         missing_layer_unit=cfunits.Units('0.5m'),
                         base_unit=None,
-                        return_terrain_height=False):
+                        return_terrain_height=False,
+                        layers=None,
+                        method='linear'):
     # pylint: disable=too-many-arguments
     '''Extract the soil column at a single grid cell
 
@@ -21,11 +25,13 @@ def extract_soil_column(hs_model, x, y,
 
     Parameters
     ----------
-    hs_model : xarray.Dataset
+    hs_model : xarray.Dataset or column_store.ColumnStore
       A HIP hydrostratigraphic model. It is assumed that layers are stored in order of elevation,
       with the first layer being the topmost layer, e.g.
       list(hs_model.data_vars.keys()) == \
           ['Topography', 'CompLayer_1', 'CompLayer_2', ..., 'CompLayer_N']
+      A column store only reads the column of a single grid cell, so `method` must be 'nearest'
+      unless (x, y) is a grid cell center.
 
     x : float
       Value along X dimension.
@@ -43,6 +49,14 @@ def extract_soil_column(hs_model, x, y,
     return_terrain_height : bool
       If True also return terrain height
 
+    layers : str or sequence of str
+      Only return these layers using HIP elevation naming style, e.g. 'CompLayer_3'. Layers below
+      the deepest of `layers` are not read. If None return all layers.
+
+    method : str
+      'linear' for bilinear interpolation between the neighbouring grid cells or 'nearest' for the
+      nearest grid cell. See `interpolation.GridWeights`
+
     Returns
     -------
     soil_column or (soil_column, terrain_height)
@@ -67,10 +81,19 @@ def extract_soil_column(hs_model, x, y,
     #       we define our own unit mapping. See `units.py`
     # TODO: Maybe return an xarray.Dataset instead?
     # pylint: disable=duplicate-code, too-many-locals
+    if isinstance(hs_model, ColumnStore):
+        if missing_layer_unit != hs_model.missing_layer_unit:
+            raise ValueError(f'Column store was compiled with missing layer thickness '
+                             f'{hs_model.missing_layer_unit}, not {missing_layer_unit}')
+        return hs_model.soil_column(x, y, base_unit=base_unit,
+                                    return_terrain_height=return_terrain_height, layers=layers,
+                                    method=method)
     bounds_check(hs_model, x, y)
+    hs_model = select_hs_layers(hs_model, layers)
     layer_names = np.array(list(hs_model.data_vars.keys()))
     units = [unit_map[hs_model[layer].units] for layer in layer_names]
-    elevation = hs_model.isel(time=0).interp(Y=y, X=x).to_array().values
+    weights = GridWeights.from_dataset(hs_model, x, y, method)
+    elevation = weights.interp(hs_model.isel(time=0)).to_array().values
     
     if base_unit is None:
         base_unit = units[0]
@@ -89,7 +112,7 @@ def extract_soil_column(hs_model, x, y,
                                  f'{base_unit}, {unit}')
             elevation[idx+1] = cfunits.Units.conform(elevation[idx+1], unit, base_unit)
     missing_layer_thickness = cfunits.Units.conform(1, missing_layer_unit, base_unit)
-    keep = elevation[:-1] - elevation[1:] != missing_layer_thickness
+    keep = ~is_missing_layer(elevation[:-1] - elevation[1:], missing_layer_thickness)
     layer_names = layer_names[np.pad(keep, (1,0), constant_values=0)]
     elevation = elevation[np.pad(keep, (1,0), constant_values=1)]
 
@@ -102,6 +125,10 @@ def extract_soil_column(hs_model, x, y,
         'elevation' : elevation[1:],
         'thickness' : elevation[:-1] - elevation[1:],
     })
+    if layers is not None:
+        if isinstance(layers, str):
+            layers = [layers]
+        df = df[df['layer'].isin(layers)].reset_index(drop=True)
     if return_terrain_height:
         return df, elevation[0]
     return df
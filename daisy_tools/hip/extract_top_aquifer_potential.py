@@ -1,19 +1,27 @@
 '''See extract_top_aquifer_potential'''
 import numpy as np
 import xarray as xr
+import netCDF4
 import cfunits
 from .units import unit_map
+from .util import select_time, is_missing_layer
+from .aggregate import TemporalAggregator
+from .encoding import check_encoding_range, mask_invalid
 from .layer_names import hip_elevation_to_hip_pressure, hip_pressure_to_dkm2019, \
     dkm2019_to_aquifer
 
 __all__ = [
-    'extract_top_aquifer_potential'
+    'extract_top_aquifer_potential',
+    'append_top_aquifer_potential',
 ]
 
 HEAD_ELEVATION_LAYER = 'head elevation in saturated zone'
 
 def extract_top_aquifer_potential(hs_model, gw_potential, dk_model, base_unit=None,
-                                  missing_layer_unit=cfunits.Units('0.5m')):
+                                  missing_layer_unit=cfunits.Units('0.5m'),
+                                  layer_selection=None, start=None, end=None, period=None,
+                                  statistic='mean', time_chunk=366):
+    # pylint: disable=too-many-arguments,too-many-locals
     '''Extract the potential at the topmost aquifer for all grid points
 
     Parameters
@@ -40,49 +48,164 @@ def extract_top_aquifer_potential(hs_model, gw_potential, dk_model, base_unit=No
     missing_layer_unit : cfunits.Units
       Thickness of layers that should be ignored expressed as a unit.
 
+    layer_selection : xarray.DataArray
+      Layer to use in each grid point using HIP pressure naming style with dimensions (y, x).
+      This is stored as the coordinate 'aquifer_layer' of a previously extracted potential.
+      If None the layers are found from `hs_model`.
+
+    start, end : str or datetime-like
+      Only extract time steps between `start` and `end`, both included. See `util.select_time`
+
+    period : str
+      If not None aggregate potential over each 'day', 'month' or 'year', or over each day of
+      year with 'doy'. See `aggregate.TemporalAggregator`
+
+    statistic : str
+      Statistic to aggregate with. One of 'mean', 'min', 'max' or 'p<q>', e.g. 'p10'. Ignored if
+      `period` is None.
+
+    time_chunk : int
+      Number of time steps to read at a time when aggregating. Ignored if `period` is None.
+
     Returns
     -------
     top_aquifer_potential : xarray.DataArray
+      Potential with dimensions (time, y, x) and the coordinate 'aquifer_layer' holding the layer
+      used in each grid point. If `period` is not None time is the start of each period, and if
+      `period` is 'doy' the dimensions are (day_of_year, y, x).
     '''
     # Figure out which layer to use in each pixel.
     # We first find all the aquifer layers in the specific DK model
     # Then we find which layers are present in each pixel 
     # Then we select the values from each of the relevant layers
+    gw_potential = select_time(gw_potential, start, end)
 
     # Find possible aquifers
     aq_layers_he = _get_possible_aquifers(hs_model, dk_model)
 
     # Find layers that are present in each pixel
-    use_for_pixel = _find_layers_to_use_for_each_pixel(hs_model, gw_potential, missing_layer_unit,
-                                                       aq_layers_he)
+    he_to_hp = hip_elevation_to_hip_pressure(dk_model)
+    if layer_selection is None:
+        use_for_pixel = _find_layers_to_use_for_each_pixel(hs_model, gw_potential,
+                                                           missing_layer_unit, aq_layers_he)
+    else:
+        layer_selection = layer_selection.transpose('x', 'y').values
+        use_for_pixel = { aq : layer_selection == he_to_hp[aq] for aq in aq_layers_he }
+
+    if base_unit is None:
+        base_unit = unit_map[gw_potential[HEAD_ELEVATION_LAYER].units]
 
     # Get the potential
-    potential = _get_potential_from_selected_layers(gw_potential, use_for_pixel, dk_model,
-                                                    aq_layers_he, base_unit)
+    if period is None:
+        time = gw_potential['time'].values
+        potential = _get_potential_from_selected_layers(gw_potential, use_for_pixel, dk_model,
+                                                        aq_layers_he, base_unit)
+    else:
+        # Aggregate a chunk of time steps at a time, so the full time series is never in memory
+        aggregator = TemporalAggregator(period, statistic)
+        time, potential = [], []
+        for t in range(0, gw_potential.sizes['time'], time_chunk):
+            chunk = gw_potential.isel(time=slice(t, t + time_chunk))
+            labels, aggregated = aggregator.update(
+                chunk['time'].values,
+                _get_potential_from_selected_layers(chunk, use_for_pixel, dk_model, aq_layers_he,
+                                                    base_unit)
+            )
+            time.append(labels)
+            potential.append(aggregated)
+        labels, aggregated = aggregator.finish()
+        if labels is not None:
+            time.append(labels)
+            potential.append(aggregated)
+        time, potential = np.concatenate(time), np.concatenate(potential)
+    time_dim = 'day_of_year' if period == 'doy' else 'time'
 
     # We need some tweaking to get raster2pgsql to work well
     # - rename X/Y to x/y
     # - transpose the dimensions so we get time, y, x
+    # - store the selected layers, so we can reuse them when appending new time steps
+    aquifer_layer = np.full(potential.shape[1:], he_to_hp[aq_layers_he[0]], dtype=np.int8)
+    for aq, use in use_for_pixel.items():
+        aquifer_layer[use] = he_to_hp[aq]
+    attrs = {
+        'units' : str(base_unit),
+        'dk_model' : dk_model,
+    }
+    if period is not None:
+        attrs['aggregation'] = f'{statistic} per {period}'
     potential = xr.DataArray(potential, 
-                                dims=['time', 'x', 'y'],
+                                dims=[time_dim, 'x', 'y'],
                                 coords={
                                     'x' : gw_potential.X.values,
                                     'y' : gw_potential.Y.values,
-                                    'time' : gw_potential.time,
+                                    time_dim : time,
+                                    'aquifer_layer' : (('x', 'y'), aquifer_layer, {
+                                        'long_name' : 'Aquifer layer using HIP pressure naming '
+                                                      'style',
+                                    }),
                                 },
-                                attrs={
-                                    'units' : str(base_unit),
-                                }).transpose('time', 'y', 'x')
-    potential['x'].attrs['axis'] = 'x'
-    potential['x'].attrs['long_name'] = 'Easting'
-    potential['x'].attrs['standard_name'] = 'projection_x_coordinates'
-    potential['y'].attrs['axis'] = 'y'
-    potential['y'].attrs['long_name'] = 'Northing'
-    potential['y'].attrs['standard_name'] = 'projection_y_coordinates'
+                                name='top_aquifer_potential',
+                                attrs=attrs).transpose(time_dim, 'y', 'x')
+    _set_xy_attrs(potential)
 
     return potential
 
 
+def append_top_aquifer_potential(path, potential):
+    '''Append new time steps to a NetCDF file created from the output of
+    `extract_top_aquifer_potential`
+
+    Parameters
+    ----------
+    path : str
+      Path to NetCDF file. The file must have been written with 'time' as an unlimited dimension.
+
+    potential : xarray.DataArray
+      Potential as returned by `extract_top_aquifer_potential`. All time steps must be later than
+      the last time step in `path`.
+
+    Raises
+    ------
+    ValueError
+      If the file cannot be appended to, `potential` does not match the file or `potential` is
+      outside the range of a packed integer variable
+    '''
+    with netCDF4.Dataset(path, 'a') as nc:
+        if not nc.dimensions['time'].isunlimited():
+            raise ValueError(f'Cannot append to "{path}", because time is not an unlimited '
+                             'dimension')
+        var = nc.variables[potential.name]
+        if var.dimensions != ('time', 'y', 'x') or \
+           var.shape[1:] != (potential.sizes['y'], potential.sizes['x']):
+            raise ValueError(f'Shape of "{potential.name}" in "{path}" does not match potential')
+        time = nc.variables['time']
+        calendar = getattr(time, 'calendar', 'standard')
+        new_time, *_ = xr.coding.times.encode_cf_datetime(potential['time'].values, time.units,
+                                                          calendar)
+        n = len(time)
+        if n > 0 and new_time[0] <= time[n-1]:
+            last = netCDF4.num2date(time[n-1], time.units, calendar)
+            raise ValueError(f'Potential must start after the last time step {last}')
+        values = potential.transpose('time', 'y', 'x').values
+        if hasattr(var, 'scale_factor'):
+            check_encoding_range(values, {
+                'dtype' : var.dtype,
+                'scale_factor' : var.scale_factor,
+                'add_offset' : getattr(var, 'add_offset', 0),
+            })
+        time[n:] = new_time
+        var[n:] = mask_invalid(values)
+
+
+def _set_xy_attrs(da):
+    da['x'].attrs['axis'] = 'x'
+    da['x'].attrs['long_name'] = 'Easting'
+    da['x'].attrs['standard_name'] = 'projection_x_coordinates'
+    da['y'].attrs['axis'] = 'y'
+    da['y'].attrs['long_name'] = 'Northing'
+    da['y'].attrs['standard_name'] = 'projection_y_coordinates'
+
+
 def _get_possible_aquifers(hs_model, dk_model):
     he_to_hp = hip_elevation_to_hip_pressure(dk_model)
     hp_to_dk = hip_pressure_to_dkm2019(dk_model)
@@ -90,10 +213,17 @@ def _get_possible_aquifers(hs_model, dk_model):
     aq_layers = [name for name in layer_names[1:] if hp_to_dk[he_to_hp[name]] in dkm2019_to_aquifer]
     return aq_layers
 
-def _get_elevation(hs_model, gw_potential):
+def _get_elevation(hs_model, gw_potential=None, layers=None):
+    # If gw_potential is None we use all grid points in hs_model
+    # If layers is not None we only read those layers
+    if layers is not None:
+        hs_model = hs_model[layers]
     layer_names = np.array(list(hs_model.data_vars.keys()))
     units = [unit_map[hs_model[layer].units] for layer in layer_names]
-    elevation = hs_model.isel(time=0).sel(X=gw_potential.X, Y=gw_potential.Y).to_array().values
+    hs_model = hs_model.isel(time=0)
+    if gw_potential is not None:
+        hs_model = hs_model.sel(X=gw_potential.X, Y=gw_potential.Y)
+    elevation = hs_model.to_array().values
     base_unit = units[0]
     # Check that all values are in the same unit. If not try to convert to the same unit
     for idx, (unit, layer) in enumerate(zip(units[1:], layer_names[1:])):
@@ -110,12 +240,17 @@ def _get_elevation(hs_model, gw_potential):
 
 
 def _find_layers_to_use_for_each_pixel(hs_model, gw_potential, missing_layer_unit, aq_layers_he):
-    elevation, elevation_unit = _get_elevation(hs_model, gw_potential)
+    # A layer is missing if the distance to the layer above is the missing layer thickness, so we
+    # only need to read the aquifer layers and the layers directly above them
+    layer_names = list(hs_model.data_vars.keys())
+    above = { aq : layer_names[layer_names.index(aq) - 1] for aq in aq_layers_he }
+    needed = [name for name in layer_names if name in aq_layers_he or name in above.values()]
+    elevation, elevation_unit = _get_elevation(hs_model, gw_potential, needed)
     missing_layer_thickness = cfunits.Units.conform(1, missing_layer_unit, elevation_unit)
-    layer_present = elevation[:-1] - elevation[1:] != missing_layer_thickness
-    layer_names = np.array(list(hs_model.data_vars.keys()))
     use_for_pixel = {
-        name : layer_present[i] for i, name in enumerate(layer_names[1:]) if name in aq_layers_he
+        aq : ~is_missing_layer(elevation[needed.index(above[aq])] - elevation[needed.index(aq)],
+                               missing_layer_thickness)
+        for aq in aq_layers_he
     }
     not_selected = ~use_for_pixel[aq_layers_he[0]]
     for i, aq in enumerate(aq_layers_he[1:]):
@@ -127,11 +262,11 @@ def _find_layers_to_use_for_each_pixel(hs_model, gw_potential, missing_layer_uni
 def _get_potential_from_selected_layers(gw_potential, use_for_pixel, dk_model, aq_layers_he,
                                         base_unit):
     he_to_hp = hip_elevation_to_hip_pressure(dk_model)
-    potential = gw_potential.sel(layer=he_to_hp[aq_layers_he[0]]).to_array().values.squeeze()
+    potential = gw_potential.sel(layer=he_to_hp[aq_layers_he[0]]).to_array().values[0]
     for aq, use in use_for_pixel.items():
         if aq == aq_layers_he[0]:
             continue
-        potential[:,use] = gw_potential.sel(layer=he_to_hp[aq]).to_array().squeeze().values[:,use]
+        potential[:,use] = gw_potential.sel(layer=he_to_hp[aq]).to_array().values[0][:,use]
     # Maybe change the unit
     gw_unit = unit_map[gw_potential[HEAD_ELEVATION_LAYER].units]
     if gw_unit != base_unit:
@@ -0,0 +1,109 @@
+'''See extract_top_aquifer_statistics'''
+import xarray as xr
+import cfunits
+from .units import unit_map
+from .util import select_time
+from .aggregate import OnlineStatistics
+from .extract_top_aquifer_potential import extract_top_aquifer_potential, HEAD_ELEVATION_LAYER, \
+    _set_xy_attrs
+
+__all__ = [
+    'extract_top_aquifer_statistics',
+]
+
+def extract_top_aquifer_statistics(hs_model, gw_potential, dk_model, base_unit=None,
+                                   percentiles=(10, 50, 90), bin_width_unit=cfunits.Units('5cm'),
+                                   n_bins=400, missing_layer_unit=cfunits.Units('0.5m'),
+                                   time_chunk=366, start=None, end=None):
+    # pylint: disable=too-many-arguments,too-many-locals
+    '''Statistics over time of the potential at the topmost aquifer relative to terrain for all
+    grid points
+
+    The potential is read `time_chunk` time steps at a time and added to online statistics, so the
+    full time series is never in memory. See `aggregate.OnlineStatistics` for the accuracy of the
+    percentiles.
+
+    Parameters
+    ----------
+    hs_model : xarray.Dataset
+      A HIP hydrostratigraphic model. See `extract_top_aquifer_potential`
+
+    gw_potential : xarray.Dataset
+      A HIP ground water potential time series. See `extract_top_aquifer_potential`
+
+    dk_model : str
+      Name of DK-model HIP. Valid model names are {
+        'DK1', 'DK2', 'DK3', 'DK4', 'DK5', 'DK6', 'DK7'
+      }
+
+    base_unit : cfunits.Units
+      Express statistics in `base_unit`. If None use the unit of the potential
+
+    percentiles : sequence of float
+      Percentiles to estimate
+
+    bin_width_unit : cfunits.Units
+      Width of the histogram bins used to estimate percentiles expressed as a unit.
+
+    n_bins : int
+      Number of histogram bins for each grid point. The histogram of a grid point is centered on
+      the mean of its first time steps.
+
+    missing_layer_unit : cfunits.Units
+      Thickness of layers that should be ignored expressed as a unit.
+
+    time_chunk : int
+      Number of time steps to read at a time
+
+    start, end : str or datetime-like
+      Only use time steps between `start` and `end`, both included. See `util.select_time`
+
+    Returns
+    -------
+    statistics : xarray.Dataset
+      Dataset with dimensions (y, x), the coordinate 'aquifer_layer' holding the layer used in each
+      grid point and variables
+        terrain_height : Terrain height
+        count : Number of time steps with a potential
+        mean, std, min, max : Statistics of potential minus terrain height. Negative values are
+                              below terrain.
+        p<q> : Estimated percentiles of potential minus terrain height, e.g. p10
+    '''
+    gw_potential = select_time(gw_potential, start, end)
+    if base_unit is None:
+        base_unit = unit_map[gw_potential[HEAD_ELEVATION_LAYER].units]
+    terrain_height = hs_model['Topography'].isel(time=0).sel(X=gw_potential.X, Y=gw_potential.Y)
+    terrain_height = cfunits.Units.conform(terrain_height.transpose('Y', 'X').values,
+                                           unit_map[hs_model['Topography'].units], base_unit)
+    statistics = OnlineStatistics(percentiles,
+                                  cfunits.Units.conform(1, bin_width_unit, base_unit), n_bins)
+    layer_selection = None
+    for t in range(0, gw_potential.sizes['time'], time_chunk):
+        potential = extract_top_aquifer_potential(
+            hs_model, gw_potential.isel(time=slice(t, t + time_chunk)), dk_model,
+            base_unit=base_unit, missing_layer_unit=missing_layer_unit,
+            layer_selection=layer_selection
+        )
+        # Reuse the layer selection, so the hydrostratigraphic model is only read once
+        layer_selection = potential['aquifer_layer']
+        statistics.update(potential.values - terrain_height)
+
+    data_vars = { 'terrain_height' : (('y', 'x'), terrain_height, {'units' : str(base_unit)}) }
+    for name, values in statistics.result().items():
+        attrs = {} if name == 'count' else {'units' : str(base_unit)}
+        data_vars[name] = (('y', 'x'), values, attrs)
+    ds = xr.Dataset(
+        data_vars,
+        coords={
+            'x' : gw_potential.X.values,
+            'y' : gw_potential.Y.values,
+            'aquifer_layer' : layer_selection,
+        },
+        attrs={
+            'dk_model' : dk_model,
+            'time_coverage_start' : str(gw_potential['time'].values[0]),
+            'time_coverage_end' : str(gw_potential['time'].values[-1]),
+        }
+    )
+    _set_xy_attrs(ds)
+    return ds
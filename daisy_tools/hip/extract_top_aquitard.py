@@ -0,0 +1,139 @@
+'''See extract_top_aquitard'''
+import numpy as np
+import xarray as xr
+import cfunits
+from .conductive_properties import get_conductive_properties
+from .layer_names import hip_elevation_to_dkm2019, dkm2019_aquitard
+from .util import is_missing_layer
+from .extract_top_aquifer_potential import _get_elevation, _set_xy_attrs
+
+__all__ = [
+    'extract_top_aquitard'
+]
+
+def extract_top_aquitard(hs_model, dk_model, base_unit=None, conductance_unit='cm h-1',
+                         missing_layer_unit=cfunits.Units('0.5m'), chunk_size=256):
+    # pylint: disable=too-many-arguments, too-many-locals
+    '''Extract geometry and conductance of the topmost aquitard for all grid points
+
+    This is the raster equivalent of the top aquitard found by `prepare_hip_data_for_daisy`.
+    The model is processed in chunks along the X dimension, so only `chunk_size` columns of the
+    hydrostratigraphic model are in memory at a time.
+
+    Parameters
+    ----------
+    hs_model : xarray.Dataset
+      A HIP hydrostratigraphic model. It is assumed that layers are stored in order of elevation,
+      with the first layer being the topmost layer, e.g.
+      list(hs_model.data_vars.keys()) == \\
+          ['Topography', 'CompLayer_1', 'CompLayer_2', ..., 'CompLayer_N']
+
+    dk_model : str
+      Name of DK-model HIP. Valid model names are {
+        'DK1', 'DK2', 'DK3', 'DK4', 'DK5', 'DK6', 'DK7'
+      }
+
+    base_unit : cfunits.Units
+      Convert elevation, thickness and terrain height to `base_unit`.
+      If None use the unit of the first layer as base unit.
+
+    conductance_unit : str
+      Unit of conductance. The string must be understood by cfunits.Units
+
+    missing_layer_unit : cfunits.Units
+      Thickness of layers that should be ignored expressed as a unit.
+
+    chunk_size : int
+      Number of grid points along the X dimension to process at a time
+
+    Returns
+    -------
+    top_aquitard : xarray.Dataset
+      Dataset with dimensions (y, x) and variables
+        layer : Number of the topmost aquitard using HIP elevation naming style, e.g. 3 for
+                'CompLayer_3'. 0 if there is no aquitard in the grid cell.
+        terrain_height : Terrain height of grid cell
+        elevation : Elevation of the topmost aquitard
+        thickness : Thickness of the topmost aquitard
+        conductance : Conductance of the topmost aquitard. NaN if it is not defined.
+    '''
+    layer_names = list(hs_model.data_vars.keys())
+    he_to_dk = hip_elevation_to_dkm2019(dk_model)
+
+    # Conductance only depends on the layer, so we can make a lookup table indexed by layer number
+    conductance_lut = np.full(len(layer_names), np.nan)
+    for i, name in enumerate(layer_names[1:]):
+        conductive_properties = get_conductive_properties(dk_model, he_to_dk[name],
+                                                          conductance_unit)
+        if conductive_properties is not None:
+            conductance_lut[i+1] = conductive_properties[0]
+
+    shape = (hs_model.sizes['X'], hs_model.sizes['Y'])
+    layer = np.zeros(shape, dtype=np.int8)
+    terrain_height = np.full(shape, np.nan)
+    elevation = np.full(shape, np.nan)
+    thickness = np.full(shape, np.nan)
+    for start in range(0, shape[0], chunk_size):
+        block = slice(start, min(start + chunk_size, shape[0]))
+        block_elevation, block_unit = _get_elevation(hs_model.isel(X=block))
+        # Find missing layers before changing unit, so the thickness comparison is exact
+        block_layer, block_aquitard_elevation, block_thickness = _find_top_aquitard(
+            block_elevation, layer_names, he_to_dk,
+            cfunits.Units.conform(1, missing_layer_unit, block_unit)
+        )
+        if base_unit is None:
+            base_unit = block_unit
+        layer[block] = block_layer
+        for out, values in ((terrain_height, block_elevation[0]),
+                            (elevation, block_aquitard_elevation),
+                            (thickness, block_thickness)):
+            if base_unit != block_unit:
+                values = cfunits.Units.conform(values, block_unit, base_unit)
+            out[block] = values
+
+    top_aquitard = xr.Dataset(
+        {
+            'layer' : (('x', 'y'), layer, {
+                'long_name' : 'Topmost aquitard layer using HIP elevation naming style',
+                'flag_values' : np.array([i for i, name in enumerate(layer_names) if i > 0 and
+                                          he_to_dk[name] in dkm2019_aquitard], dtype=np.int8),
+                'flag_meanings' : ' '.join([he_to_dk[name] for name in layer_names[1:]
+                                            if he_to_dk[name] in dkm2019_aquitard]),
+            }),
+            'terrain_height' : (('x', 'y'), terrain_height, { 'units' : str(base_unit) }),
+            'elevation' : (('x', 'y'), elevation, { 'units' : str(base_unit) }),
+            'thickness' : (('x', 'y'), thickness, { 'units' : str(base_unit) }),
+            'conductance' : (('x', 'y'), conductance_lut[layer], {
+                'units' : str(cfunits.Units(conductance_unit))
+            }),
+        },
+        coords={
+            'x' : hs_model.X.values,
+            'y' : hs_model.Y.values,
+        },
+        attrs={
+            'dk_model' : dk_model,
+        }).transpose('y', 'x')
+    _set_xy_attrs(top_aquitard)
+    return top_aquitard
+
+
+def _find_top_aquitard(elevation, layer_names, he_to_dk, missing_layer_thickness):
+    # Walk down through the layers keeping track of the bottom of the closest present layer above.
+    # This gives the same thickness as `extract_soil_column`, where missing layers are dropped
+    # before thickness is calculated.
+    layer_present = ~is_missing_layer(elevation[:-1] - elevation[1:], missing_layer_thickness)
+    above = elevation[0].copy()
+    found = np.zeros(above.shape, dtype=bool)
+    layer = np.zeros(above.shape, dtype=np.int8)
+    aquitard_elevation = np.full(above.shape, np.nan)
+    aquitard_thickness = np.full(above.shape, np.nan)
+    for i, name in enumerate(layer_names[1:]):
+        if he_to_dk[name] in dkm2019_aquitard:
+            use = np.logical_and(layer_present[i], ~found)
+            layer[use] = i + 1
+            aquitard_elevation[use] = elevation[i+1][use]
+            aquitard_thickness[use] = above[use] - elevation[i+1][use]
+            found = np.logical_or(found, use)
+        above = np.where(layer_present[i], elevation[i+1], above)
+    return layer, aquitard_elevation, aquitard_thickness
@@ -0,0 +1,395 @@
+'''Area weighted extraction of Daisy relevant data over fields'''
+import json
+import numpy as np
+import pandas as pd
+import xarray as xr
+import cfunits
+from .units import unit_map
+from .util import select_time, is_missing_layer
+from .conductive_properties import get_conductive_properties
+from .layer_names import hip_elevation_to_dkm2019, hip_elevation_to_hip_pressure, \
+    dkm2019_to_aquifer, dkm2019_aquitard
+from .extract_top_aquifer_potential import _get_elevation, HEAD_ELEVATION_LAYER
+
+__all__ = [
+    'FieldWeights',
+    'read_fields',
+    'extract_field',
+]
+
+class FieldWeights():
+    '''Grid cells covered by a field and the fraction of each cell that is covered
+
+    Only the bounding window of the covered cells is read when values are extracted.
+
+    Parameters
+    ----------
+    i, j : numpy.ndarray
+      Index along X and Y of the cells covered by the field
+
+    fraction : numpy.ndarray
+      Covered fraction of each cell. Cells with fraction 0 are not used.
+
+    cell_area : float
+      Area of a grid cell in the squared unit of X and Y
+
+    Attributes
+    ----------
+    area : float
+      Covered area in the squared unit of X and Y
+    '''
+    def __init__(self, i, j, fraction, cell_area):
+        fraction = np.asarray(fraction, dtype=float)
+        covered = fraction > 0
+        if not covered.any():
+            raise ValueError('Field does not cover any grid cells')
+        self.i, self.j = np.asarray(i)[covered], np.asarray(j)[covered]
+        self.fraction = fraction[covered]
+        self.area = self.fraction.sum() * cell_area
+        self._window = (slice(self.i.min(), self.i.max() + 1),
+                        slice(self.j.min(), self.j.max() + 1))
+
+    @classmethod
+    def from_polygon(cls, ds, polygon, supersample=10):
+        # pylint: disable=too-many-locals
+        '''Find the cells covered by a polygon
+
+        The covered fraction of a cell is estimated by testing `supersample` x `supersample`
+        points in the cell.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset
+          Must contain the coordinates 'X' and 'Y'
+
+        polygon : dict or sequence of (x, y)
+          GeoJSON Polygon or MultiPolygon geometry or a single ring, in the coordinate system of
+          `ds` (EPSG:25832 for HIP data). Holes are supported.
+
+        supersample : int
+          Number of points to test along each axis of a cell
+
+        Returns
+        -------
+        FieldWeights
+        '''
+        X, Y = ds['X'].values, ds['Y'].values
+        rings = _rings(polygon)
+        points = np.concatenate(rings)
+        # Only test cells in the bounding box of the polygon
+        dx, dy = abs(X[1] - X[0]), abs(Y[1] - Y[0])
+        i = np.flatnonzero((X + dx/2 >= points[:, 0].min()) & (X - dx/2 <= points[:, 0].max()))
+        j = np.flatnonzero((Y + dy/2 >= points[:, 1].min()) & (Y - dy/2 <= points[:, 1].max()))
+        offsets = (np.arange(supersample) + 0.5) / supersample - 0.5
+        px = (X[i, None] + offsets * dx).ravel()
+        py = (Y[j, None] + offsets * dy).ravel()
+        fraction = _inside(px, py, rings).reshape(
+            len(i), supersample, len(j), supersample
+        ).mean(axis=(1, 3))
+        i, j = np.meshgrid(i, j, indexing='ij')
+        return cls(i.ravel(), j.ravel(), fraction.ravel(), dx * dy)
+
+    @classmethod
+    def from_mask(cls, ds, mask):
+        '''Use a mask raster on the grid of `ds` as field
+
+        Parameters
+        ----------
+        ds : xarray.Dataset
+          Must contain the coordinates 'X' and 'Y'
+
+        mask : xarray.DataArray
+          Boolean mask or covered fraction with coordinates X and Y (or x and y) on the grid of
+          `ds`. Cells outside the mask are not covered.
+
+        Returns
+        -------
+        FieldWeights
+        '''
+        fraction = _on_grid(ds, mask.astype(float), 0)
+        i, j = np.nonzero(fraction)
+        return cls(i, j, fraction[i, j], _cell_area(ds))
+
+    @classmethod
+    def from_labels(cls, ds, labels):
+        '''Use a raster of field labels on the grid of `ds` as fields
+
+        The raster is only scanned once, so this is much faster than calling `from_mask` for each
+        field when there are many fields.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset
+          Must contain the coordinates 'X' and 'Y'
+
+        labels : xarray.DataArray
+          Integer field label of each cell with coordinates X and Y (or x and y) on the grid of
+          `ds`. Cells with label 0 are not part of any field.
+
+        Returns
+        -------
+        fields : dict
+          (label, FieldWeights) pairs
+        '''
+        labels = _on_grid(ds, labels.fillna(0).astype(np.int64), 0)
+        i, j = np.nonzero(labels)
+        order = np.argsort(labels[i, j], kind='stable')
+        i, j = i[order], j[order]
+        values, starts = np.unique(labels[i, j], return_index=True)
+        cell_area = _cell_area(ds)
+        return {
+            label.item() : cls(fi, fj, np.ones(len(fi)), cell_area)
+            for label, fi, fj in zip(values, np.split(i, starts[1:]), np.split(j, starts[1:]))
+        }
+
+    def cells(self, obj):
+        '''Read values of the covered cells
+
+        Parameters
+        ----------
+        obj : xarray.Dataset or xarray.DataArray
+          Must have the dimensions 'X' and 'Y' on the grid the weights were made for
+
+        Returns
+        -------
+        xarray.Dataset or xarray.DataArray
+          `obj` with the dimensions X and Y replaced by the dimension 'cell'
+        '''
+        window = obj.isel(X=self._window[0], Y=self._window[1])
+        return window.isel(
+            X=xr.DataArray(self.i - self._window[0].start, dims='cell'),
+            Y=xr.DataArray(self.j - self._window[1].start, dims='cell'),
+        ).drop_vars(['X', 'Y'])
+
+    def mean(self, values):
+        '''Area weighted mean over covered cells. NaN values are ignored.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+          Array with cells as the last dimension
+
+        Returns
+        -------
+        numpy.ndarray
+          Array without the last dimension. NaN where all cells are NaN.
+        '''
+        values = np.asarray(values, dtype=float)
+        weights = np.where(np.isnan(values), 0, self.fraction)
+        total = weights.sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(total > 0, np.nansum(values * weights, axis=-1) / total, np.nan)
+
+
+def read_fields(path, id_property=None, crs=None):
+    '''Read field polygons from a GeoJSON file
+
+    Parameters
+    ----------
+    path : str
+      Path to GeoJSON file with a FeatureCollection of Polygon or MultiPolygon features
+
+    id_property : str
+      Property to use as field id. If None use the feature id or the index of the feature.
+
+    crs : str
+      Coordinate system of the polygons, e.g. 'EPSG:4326'. Polygons are transformed to
+      EPSG:25832. If None the polygons must be in EPSG:25832.
+
+    Returns
+    -------
+    fields : dict
+      (field id, geometry) pairs
+    '''
+    with open(path, encoding='utf8') as f:
+        features = json.load(f)['features']
+    transformer = None
+    if crs is not None:
+        import pyproj # pylint: disable=import-outside-toplevel
+        transformer = pyproj.Transformer.from_crs(crs, 'EPSG:25832', always_xy=True)
+    fields = {}
+    for idx, feature in enumerate(features):
+        if id_property is not None:
+            field_id = feature['properties'][id_property]
+        else:
+            field_id = feature.get('id', idx)
+        geometry = feature['geometry']
+        if transformer is not None:
+            geometry = {
+                'type' : 'MultiPolygon',
+                'coordinates' : [
+                    [np.column_stack(transformer.transform(*np.asarray(ring)[:, :2].T)).tolist()
+                     for ring in polygon]
+                    for polygon in _polygons(geometry)
+                ]
+            }
+        fields[field_id] = geometry
+    return fields
+
+
+def extract_field(dk_model, hs_model, gw_potential, weights, unit,
+                  missing_layer_unit=cfunits.Units('0.5m'), start=None, end=None):
+    # pylint: disable=too-many-arguments,too-many-locals
+    '''Area weighted equivalent of `prepare_hip_data_for_daisy` for a field
+
+    The soil column, top aquifer and top aquitard are found in each covered grid cell, and the
+    results are averaged weighted by the covered fraction of each cell.
+
+    Parameters
+    ----------
+    dk_model : str
+      Name of DK-model HIP. Valid model names are {
+        'DK1', 'DK2', 'DK3', 'DK4', 'DK5', 'DK6', 'DK7'
+      }
+
+    hs_model : xarray.Dataset
+      A HIP hydrostratigraphic model. See `prepare_hip_data_for_daisy`
+
+    gw_potential : xarray.Dataset
+      A HIP ground water potential time series on the same grid as `hs_model`
+
+    weights : FieldWeights
+      Cells covered by the field
+
+    unit : cfunits.Units
+      Express values in this unit
+
+    missing_layer_unit : cfunits.Units
+      Thickness of layers that should be ignored expressed as a unit.
+
+    start, end : str or datetime-like
+      Only extract head elevation between `start` and `end`, both included. See
+      `util.select_time`
+
+    Returns
+    -------
+    soil_column, head_elevation, top2m_head_elevation
+      soil_column : pandas.DataFrame
+        Dataframe with a row for each layer that is present in at least one cell and columns
+          dk_model : Name of DK-model
+          area : Area of the field in squared meters
+          terrain_height : Mean terrain height
+          layer : Name of layer using HIP elevation naming style
+          fraction : Fraction of the field where the layer is present
+          top_aquifer : Fraction of the field where the layer is the topmost aquifer
+          top_aquitard : Fraction of the field where the layer is the topmost aquitard
+          elevation : Mean elevation of the bottom of the layer
+          thickness : Mean thickness of the layer. Thickness is 0 where the layer is not present.
+          unit : Unit of elevation and thickness
+          dk_layer : Name of layer using DKM2019 naming style
+          conductive_properties : See `conductive_properties.get_conductive_properties`
+
+      head_elevation : pandas.DataFrame
+        Mean head elevation in the topmost aquifer of each cell relative to terrain height, with
+        columns time, head_elevation and unit
+
+      top2m_head_elevation : pandas.DataFrame
+        Mean head elevation in the top 2 m layer relative to terrain height
+    '''
+    layer_names = list(hs_model.data_vars.keys())
+    he_to_dk = hip_elevation_to_dkm2019(dk_model)
+    he_to_hp = hip_elevation_to_hip_pressure(dk_model)
+
+    # Elevation of all layers in the covered cells with shape (layers, cells)
+    elevation, elevation_unit = _get_elevation(weights.cells(hs_model))
+    present = ~is_missing_layer(elevation[:-1] - elevation[1:],
+                                cfunits.Units.conform(1, missing_layer_unit, elevation_unit))
+    if elevation_unit != unit:
+        elevation = cfunits.Units.conform(elevation, elevation_unit, unit)
+    terrain_height = elevation[0]
+
+    # Thickness is measured from the bottom of the closest present layer above, like in
+    # extract_soil_column. Missing layers have thickness 0.
+    thickness = np.zeros(present.shape)
+    above = terrain_height.copy()
+    top_aquifer = np.zeros(present.shape, dtype=bool)
+    top_aquitard = np.zeros(present.shape, dtype=bool)
+    for k, name in enumerate(layer_names[1:]):
+        thickness[k] = np.where(present[k], above - elevation[k+1], 0)
+        above = np.where(present[k], elevation[k+1], above)
+        if he_to_dk[name] in dkm2019_to_aquifer:
+            top_aquifer[k] = present[k] & ~top_aquifer[:k].any(axis=0)
+        if he_to_dk[name] in dkm2019_aquitard:
+            top_aquitard[k] = present[k] & ~top_aquitard[:k].any(axis=0)
+
+    mean_terrain_height = weights.mean(terrain_height)
+    mean_thickness = weights.mean(thickness)
+    soil_column = pd.DataFrame({
+        'dk_model' : dk_model,
+        'area' : weights.area,
+        'terrain_height' : mean_terrain_height,
+        'layer' : layer_names[1:],
+        'fraction' : weights.mean(present),
+        'top_aquifer' : weights.mean(top_aquifer),
+        'top_aquitard' : weights.mean(top_aquitard),
+        'elevation' : mean_terrain_height - np.cumsum(mean_thickness),
+        'thickness' : mean_thickness,
+        'unit' : unit,
+    })
+    soil_column = soil_column[soil_column['fraction'] > 0].reset_index(drop=True)
+    soil_column['dk_layer'] = soil_column['layer'].replace(he_to_dk)
+    soil_column['conductive_properties'] = soil_column['dk_layer'].apply(
+        lambda layer: get_conductive_properties(dk_model, layer)
+    )
+
+    # Head elevation in the topmost aquifer of each cell. Cells without an aquifer are ignored.
+    aquifer_layer = np.array([he_to_hp[name] for name in layer_names[1:]])
+    cell_layer = np.where(top_aquifer.any(axis=0),
+                          aquifer_layer[np.argmax(top_aquifer, axis=0)], -1)
+    top2m_layer = he_to_hp['CompLayer_1']
+    read_layers = np.unique(np.append(cell_layer[cell_layer >= 0], top2m_layer))
+    gw_potential = select_time(gw_potential, start, end)
+    head = weights.cells(gw_potential[HEAD_ELEVATION_LAYER].sel(layer=read_layers))
+    head = head.transpose('time', 'layer', 'cell').values
+    gw_unit = unit_map[gw_potential[HEAD_ELEVATION_LAYER].units]
+    if gw_unit != unit:
+        head = cfunits.Units.conform(head, gw_unit, unit)
+    cells = np.arange(len(cell_layer))
+    aquifer_head = np.where(cell_layer >= 0,
+                            head[:, np.searchsorted(read_layers, cell_layer), cells], np.nan)
+    top2m_head = head[:, np.searchsorted(read_layers, top2m_layer), :]
+    time = gw_potential['time'].values
+    head_elevation, top2m_head_elevation = [
+        pd.DataFrame({
+            'time' : time,
+            'head_elevation' : weights.mean(values - terrain_height),
+            'unit' : unit,
+        }) for values in (aquifer_head, top2m_head)
+    ]
+    return soil_column, head_elevation, top2m_head_elevation
+
+
+def _cell_area(ds):
+    return abs(ds['X'].values[1] - ds['X'].values[0]) * abs(ds['Y'].values[1] - ds['Y'].values[0])
+
+
+def _on_grid(ds, da, fill_value):
+    da = da.rename({ name : name.upper() for name in ('x', 'y') if name in da.dims })
+    return da.reindex(X=ds['X'], Y=ds['Y'], fill_value=fill_value).transpose('X', 'Y').values
+
+
+def _polygons(geometry):
+    if isinstance(geometry, dict):
+        if geometry['type'] == 'Polygon':
+            return [geometry['coordinates']]
+        if geometry['type'] == 'MultiPolygon':
+            return geometry['coordinates']
+        raise ValueError(f'Unsupported geometry type {geometry["type"]}')
+    return [[geometry]]
+
+
+def _rings(polygon):
+    return [np.asarray(ring, dtype=float)[:, :2] for p in _polygons(polygon) for ring in p]
+
+
+def _inside(px, py, rings):
+    # Even-odd rule on the grid of points px x py. This handles holes and multi polygons.
+    inside = np.zeros((len(px), len(py)), dtype=bool)
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, np.roll(ring, -1, axis=0)):
+            crosses = (y1 > py) != (y2 > py)
+            if not crosses.any():
+                continue
+            x_cross = x1 + (py[crosses] - y1) * (x2 - x1) / (y2 - y1)
+            inside[:, crosses] ^= px[:, None] < x_cross[None, :]
+    return inside
@@ -1,11 +1,13 @@
 '''GUI for prepare_hip_data_for_daisy'''
 import os
+import queue
+import threading
 import tkinter as tk
 from tkinter.filedialog import askopenfilename, askdirectory
 from tkinter import ttk
-import xarray as xr
 import cfunits
-from daisy_tools.hip import prepare_hip_data_for_daisy, DDFPressure
+from daisy_tools.hip import ResultCache, cached_prepare_hip_data_for_daisy, OpenDatasets, \
+    save_hip_data_for_daisy, prepare_hip_data_for_points, read_points
 
 def main():
     '''Entry point'''
@@ -14,7 +16,7 @@ def main():
     app.mainloop()
 
 class UI(ttk.Frame):
-    # pylint: disable=too-many-ancestors
+    # pylint: disable=too-many-ancestors,too-many-instance-attributes
     '''Class for all GUI stuff'''
     
     def __init__(self, parent, *args, **kwargs):
@@ -24,18 +26,33 @@ class UI(ttk.Frame):
         parent : tk.Frame
         '''
         super().__init__(parent, *args, **kwargs)
+        self.parent = parent
         parent.title('Prepare HIP files for Daisy')
         parent.geometry('800x600')
+        parent.protocol('WM_DELETE_WINDOW', self.quit_app)
         self.grid()
 
+        # Extraction runs in a worker thread that reports back through a queue. Open datasets are
+        # kept between runs, so we only pay for opening the files once.
+        self.worker = None
+        self.cancel_event = threading.Event()
+        self.messages = queue.Queue()
+        self.datasets = OpenDatasets()
+
         self.buttons = []
         row_offset = self._setup_path_entries(row_offset=0)
         row_offset = self._setup_coords(row_offset)
         row_offset = self._setup_extra_params(row_offset)
+        row_offset = self._setup_points(row_offset)
+        row_offset = self._setup_progress(row_offset)
         row_offset = self._setup_status_area(row_offset)
         
-        self.buttons.append(ttk.Button(self, text="Run", command=self.run))
-        self.buttons.append(ttk.Button(self, text="Quit", command=parent.destroy))
+        self.run_button = ttk.Button(self, text="Run", command=self.run)
+        self.cancel_button = ttk.Button(self, text="Cancel", command=self.cancel,
+                                        state='disabled')
+        self.buttons.append(self.run_button)
+        self.buttons.append(self.cancel_button)
+        self.buttons.append(ttk.Button(self, text="Quit", command=self.quit_app))
 
         for i,button in enumerate(self.buttons):
             button.grid(column=0, row=i, padx=5, pady=2, sticky=tk.E)
@@ -43,7 +60,7 @@ class UI(ttk.Frame):
     def _setup_path_entries(self, row_offset):
         self.path_entries = {
             k : ( ttk.Entry(self, width=80), tk.StringVar() ) for k in
-            [ 'hs_model_path', 'gw_potential_path', 'outdir']
+            [ 'hs_model_path', 'gw_potential_path', 'outdir', 'cache_dir']
         }
         for i, (entry, value) in enumerate(self.path_entries.values()):
             entry.grid(column=1, row=row_offset + i, sticky=tk.W)
@@ -54,6 +71,8 @@ class UI(ttk.Frame):
         self.buttons.append(ttk.Button(self, text="Select groundwater potential",
                                        command=self._set_gw_potential_path))
         self.buttons.append(ttk.Button(self, text="Select out directory", command=self._set_outdir))
+        self.buttons.append(ttk.Button(self, text="Select cache directory (optional)",
+                                       command=self._set_cache_dir))
         return row_offset + len(self.path_entries)
         
     def _setup_coords(self, row_offset):
@@ -78,6 +97,9 @@ class UI(ttk.Frame):
             'truncate' : ( ttk.Checkbutton(self, onvalue=True, offvalue=False,
                                            text="Round values to 0 decimals"),
                            tk.BooleanVar() ),
+            'method' : ( ttk.Combobox(self, width=8, values=['linear', 'nearest'],
+                                      state='readonly'),
+                         tk.StringVar() ),
         }
         entry, value = self.extra_params['dk_model']
         entry.grid(column=1, row=row_offset, sticky=tk.W)
@@ -97,12 +119,34 @@ class UI(ttk.Frame):
         entry["variable"] = value
         self.buttons.append(ttk.Label(self, text="Truncate"))
 
+        entry, value = self.extra_params['method']
+        entry.grid(column=1, row=row_offset+3, sticky=tk.W)
+        value.set('linear')
+        entry["textvariable"] = value
+        self.buttons.append(ttk.Label(self, text="Interpolation"))
+
         return row_offset + len(self.extra_params)
     
+    def _setup_points(self, row_offset):
+        self.points_text = tk.Text(self, width=40, height=6)
+        self.points_text.grid(column=1, row=row_offset, sticky=tk.W)
+        self.buttons.append(ttk.Button(self, text="Load points from CSV",
+                                       command=self._load_points))
+        return row_offset + 1
+
+    def _setup_progress(self, row_offset):
+        self.progress_value = tk.DoubleVar()
+        self.progress_bar = ttk.Progressbar(self, length=300, mode='determinate',
+                                            variable=self.progress_value)
+        self.progress_bar.grid(column=1, row=row_offset, sticky=tk.W)
+        self.buttons.append(ttk.Label(self, text="Progress"))
+        return row_offset + 1
+
     def _setup_status_area(self, row_offset):
         rowspan = 10
         self.status_area_text = tk.StringVar()
-        self.status_area_text.set("")
+        self.status_area_text.set("Enter one 'x,y' pair per line to extract many points.\n"
+                                  "Leave it empty to use the x and y coordinates.")
         status_area = ttk.Label(self)
         status_area.grid(column=1, row=row_offset, rowspan=rowspan, sticky=tk.W)
         status_area["textvariable"] = self.status_area_text
@@ -117,6 +161,22 @@ class UI(ttk.Frame):
     def _set_outdir(self):
         self.path_entries['outdir'][1].set(askdirectory(mustexist=False))
 
+    def _set_cache_dir(self):
+        self.path_entries['cache_dir'][1].set(askdirectory(mustexist=False))
+
+    def _load_points(self):
+        path = askopenfilename(filetypes=[('CSV', '*.csv'), ('All files', '*')])
+        if not path:
+            return
+        try:
+            points = read_points(path)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            self.status_message(f'Error\n{str(e)}')
+            return
+        self.points_text.delete('1.0', tk.END)
+        self.points_text.insert('1.0', '\n'.join(f'{x},{y}' for x, y in points))
+        self.status_message(f'Loaded {len(points)} points')
+
     def get_paths(self):
         '''Get paths as dict of (path_name, path) pairs'''
         return { name : value.get() for name, (_, value) in self.path_entries.items() }
@@ -128,6 +188,10 @@ class UI(ttk.Frame):
     def get_extra_params(self):
         '''Get extra_params as dict of (param name, param value) pairs'''
         return { name : value.get() for name, (_, value) in self.extra_params.items() }
+
+    def get_points(self):
+        '''Get points as list of (x, y) pairs. Empty if no points are entered'''
+        return parse_points(self.points_text.get('1.0', tk.END))
         
     def check_paths(self, paths):
         '''Sanity check paths'''
@@ -138,6 +202,8 @@ class UI(ttk.Frame):
             errors.append('Missing groundwater potential path')
         if os.path.exists(paths['outdir']) and not os.path.isdir(paths['outdir']):
             errors.append('Output directory exists and is not a directory')
+        if os.path.exists(paths['cache_dir']) and not os.path.isdir(paths['cache_dir']):
+            errors.append('Cache directory exists and is not a directory')
         return errors
 
     def check_coords(self, coords):
@@ -154,36 +220,141 @@ class UI(ttk.Frame):
         self.status_area_text.set(text)
         
     def run(self):
-        '''Get parameters from UI, check them and pass to run_prepare_hip_fata_for_daisy'''
-        self.status_message('Running')
+        '''Get parameters from UI, check them and start extraction in a worker thread'''
+        if self.worker is not None and self.worker.is_alive():
+            return
         try:
             paths = self.get_paths()
             path_errors = self.check_paths(paths)
             if len(path_errors) > 0:
                 raise RuntimeError('\n'.join(path_errors))
 
-            coords = self.get_coords()
-            coords_errors = self.check_coords(coords)
-            if len(coords_errors) > 0:
-                raise RuntimeError('\n'.join(coords_errors))
+            points = self.get_points()
+            if len(points) == 0:
+                coords = self.get_coords()
+                coords_errors = self.check_coords(coords)
+                if len(coords_errors) > 0:
+                    raise RuntimeError('\n'.join(coords_errors))
 
             extra_params = self.get_extra_params()
+        except Exception as e: # pylint: disable=broad-exception-caught
+            self.status_message(f'Error\n{str(e)}')
+            return
 
-            saved_paths = run_prepare_hip_data_for_daisy(
-                **paths,
-                **coords,
-                **extra_params,
-            )
-            
-            self.status_message('\n'.join(['Success'] + [
+        self.cancel_event.clear()
+        if len(points) == 0:
+            self.progress_bar.configure(mode='indeterminate')
+            self.progress_bar.start()
+            target, kwargs = self._work_single, { **paths, **coords, **extra_params }
+        else:
+            self.progress_bar.configure(mode='determinate', maximum=len(points))
+            self.progress_value.set(0)
+            target, kwargs = self._work_points, { **paths, 'points' : points, **extra_params }
+        self.status_message('Running')
+        self.run_button.configure(state='disabled')
+        self.cancel_button.configure(state='normal')
+        self.worker = threading.Thread(target=target, kwargs=kwargs, daemon=True)
+        self.worker.start()
+        self.after(100, self._poll)
+
+    def cancel(self):
+        '''Stop extraction after the current point'''
+        self.cancel_event.set()
+        self.status_message('Cancelling after the current point')
+
+    def quit_app(self):
+        '''Stop extraction and close the window'''
+        self.cancel_event.set()
+        if self.worker is None or not self.worker.is_alive():
+            self.datasets.close()
+        self.parent.destroy()
+
+    def _work_single(self, **kwargs):
+        # Runs in the worker thread. Do not touch tk widgets here.
+        try:
+            saved_paths = run_prepare_hip_data_for_daisy(**kwargs, datasets=self.datasets)
+            self.messages.put(('done', '\n'.join(['Success'] + [
                 f'Saved "{k}" to "{v}"' for k,v in saved_paths.items()
-            ]))
+            ])))
         except Exception as e: # pylint: disable=broad-exception-caught
-            self.status_message(f'Error\n{str(e)}')
+            self.messages.put(('done', f'Error\n{str(e)}'))
+
+    def _work_points(self, **kwargs):
+        # Runs in the worker thread. Do not touch tk widgets here.
+        try:
+            saved, errors = run_prepare_hip_data_for_points(
+                **kwargs, datasets=self.datasets, cancel=self.cancel_event,
+                progress=lambda n, total, point: self.messages.put(('progress', (n, total, point)))
+            )
+            n_points = len(kwargs['points'])
+            status = 'Cancelled' if len(saved) + len(errors) < n_points else 'Done'
+            self.messages.put(('done', '\n'.join(
+                [f'{status}. Saved {len(saved)} of {n_points} points to "{kwargs["outdir"]}"'] +
+                [f'Error in x={x}, y={y}: {error}' for (x, y), error in list(errors.items())[:10]]
+            )))
+        except Exception as e: # pylint: disable=broad-exception-caught
+            self.messages.put(('done', f'Error\n{str(e)}'))
+
+    def _poll(self):
+        done = False
+        try:
+            while True:
+                kind, payload = self.messages.get_nowait()
+                if kind == 'progress':
+                    n, total, (x, y) = payload
+                    self.progress_value.set(n)
+                    self.status_message(f'Running {n}/{total}\nLast point x={x}, y={y}')
+                elif kind == 'done':
+                    done = True
+                    self.status_message(payload)
+        except queue.Empty:
+            pass
+        if done:
+            self.progress_bar.stop()
+            self.run_button.configure(state='normal')
+            self.cancel_button.configure(state='disabled')
+        else:
+            self.after(100, self._poll)
+
+
+def parse_points(text):
+    '''Parse points from text with one point per line
+
+    Parameters
+    ----------
+    text : str
+      Lines of the form "x,y", "x;y" or "x y". Empty lines are ignored. The first line is ignored
+      if it cannot be parsed, so a csv header is allowed.
+
+    Returns
+    -------
+    points : list of (float, float)
+    '''
+    points = []
+    for i, line in enumerate(text.splitlines()):
+        fields = line.replace(';', ',').replace(',', ' ').split()
+        if len(fields) == 0:
+            continue
+        try:
+            x, y = map(float, fields[:2])
+        except ValueError as e:
+            if i == 0:
+                continue
+            raise ValueError(f'Could not parse point in line {i+1}: "{line}"') from e
+        points.append((x, y))
+    return points
+
+
+def _parse_unit_and_dk_model(hs_model_path, unit, dk_model):
+    unit = cfunits.Units(unit)
+    if dk_model == 'auto':
+        dk_model = int(os.path.basename(hs_model_path)[2])
+    return unit, f'DK{dk_model}'
 
 
 def run_prepare_hip_data_for_daisy(hs_model_path, gw_potential_path, x, y, outdir, unit, 
-                                   dk_model, truncate):
+                                   dk_model, truncate, cache_dir='', datasets=None,
+                                   method='linear'):
     '''
     Parameters
     ----------
@@ -208,42 +379,56 @@ def run_prepare_hip_data_for_daisy(hs_model_path, gw_potential_path, x, y, outdi
     truncate : bool
       If True round values to 0 decimals.
 
+    cache_dir : str
+      If not empty, cache results in this directory
+
+    datasets : OpenDatasets
+      If not None, reuse open datasets
+
+    method : str
+      'linear' or 'nearest'. Use 'nearest' with a column store. See
+      `prepare_hip_data_for_daisy`
+
     Returns
     -------
     saved_paths : dict of (name, path) pairs of the saved files
     '''
     # pylint: disable=too-many-arguments
-    if outdir is not None:
-        os.makedirs(outdir, exist_ok=True)
+    unit, dk_model = _parse_unit_and_dk_model(hs_model_path, unit, dk_model)
+    cache = ResultCache(cache_dir) if cache_dir else None
+    result = cached_prepare_hip_data_for_daisy(
+        hs_model_path, gw_potential_path, dk_model, x, y, unit, cache=cache, datasets=datasets,
+        method=method
+    )
+    return save_hip_data_for_daisy(outdir, *result, truncate=truncate)
 
-    unit = cfunits.Units(unit)
-    if dk_model == 'auto':
-        dk_model = int(os.path.basename(hs_model_path)[2])
-    dk_model = f'DK{dk_model}'
-    with xr.open_dataset(hs_model_path) as hs_model, \
-         xr.open_dataset(gw_potential_path) as gw_potential:
-        soil_column, head_elevation = \
-            prepare_hip_data_for_daisy(dk_model, hs_model, gw_potential, x, y, unit)
-
-    if truncate:
-        head_elevation['head_elevation'] = head_elevation['head_elevation'].round(0).astype(int)
-        cols = ['terrain_height', 'elevation', 'thickness']
-        soil_column[cols] = soil_column[cols].round(0).astype(int)
-
-    paths = {
-             'Soil column' : os.path.join(outdir, 'soil_column.csv'),
-             'Pressure' : os.path.join(outdir, 'pressure.csv'),
-             'DDF Pressure' : os.path.join(outdir, 'pressure_table.ddf'),
-             'Top aquitard' : os.path.join(outdir, 'top_aquitard.csv')
-    }
-    soil_column.to_csv(paths['Soil column'], index=False)
-    head_elevation.to_csv(paths['Pressure'], index=False)
-    DDFPressure(head_elevation).save(paths['DDF Pressure'])
-    top_aquitard = soil_column.loc[soil_column['top_aquitard']]
-    top_aquitard[
-        ['dk_layer', 'elevation', 'thickness', 'unit', 'conductive_properties']
-    ].to_csv(paths['Top aquitard'], index=False)
-    return paths
+
+def run_prepare_hip_data_for_points(hs_model_path, gw_potential_path, points, outdir, unit,
+                                    dk_model, truncate, cache_dir='', datasets=None,
+                                    progress=None, cancel=None, method='linear'):
+    '''
+    Parameters
+    ----------
+    points : sequence of (x, y)
+      Values along X and Y dimension. Results for each point are stored in a subdirectory of
+      `outdir` named x<x>_y<y>
+
+    progress, cancel
+      See `prepare_hip_data_for_points`
+
+    Other parameters are as for `run_prepare_hip_data_for_daisy`
+
+    Returns
+    -------
+    saved, errors
+      See `prepare_hip_data_for_points`
+    '''
+    # pylint: disable=too-many-arguments
+    unit, dk_model = _parse_unit_and_dk_model(hs_model_path, unit, dk_model)
+    cache = ResultCache(cache_dir) if cache_dir else None
+    return prepare_hip_data_for_points(hs_model_path, gw_potential_path, dk_model, points, unit,
+                                       outdir, truncate=truncate, cache=cache, datasets=datasets,
+                                       progress=progress, cancel=cancel, method=method)
 
 
 
@@ -0,0 +1,116 @@
+'''Interpolation of HIP grids at points with precomputed weights'''
+import numpy as np
+import xarray as xr
+
+__all__ = [
+    'GridWeights',
+]
+
+class GridWeights():
+    '''Bilinear or nearest neighbour weights of points on a regular grid
+
+    The neighbouring grid cells and their weights are computed once, and can then be applied to any
+    number of variables, layers and time steps. Only the neighbouring grid cells are read when the
+    weights are applied to a lazily loaded dataset.
+
+    Linear interpolation gives the same result as `xarray.Dataset.interp`, except that neighbours
+    with zero weight are ignored, so a point on a grid cell center only depends on that cell.
+
+    Parameters
+    ----------
+    X, Y : numpy.ndarray
+      Increasing grid coordinates
+
+    x, y : float or array-like
+      Points to interpolate at. Must be inside the grid.
+
+    method : str
+      'linear' for bilinear interpolation or 'nearest' for the nearest grid cell
+    '''
+    def __init__(self, X, Y, x, y, method='linear'):
+        if method not in ('linear', 'nearest'):
+            raise ValueError(f'Unknown method "{method}". Valid methods are linear and nearest')
+        self.scalar = np.ndim(x) == 0 and np.ndim(y) == 0
+        x, y = np.atleast_1d(np.asarray(x, dtype=float)), np.atleast_1d(np.asarray(y, dtype=float))
+        ix, wx = _axis_weights(np.asarray(X, dtype=float), x, method)
+        iy, wy = _axis_weights(np.asarray(Y, dtype=float), y, method)
+        # Combine into the 4 corners (1 for nearest) of each point
+        self.i = np.repeat(ix, iy.shape[1], axis=1)
+        self.j = np.tile(iy, (1, ix.shape[1]))
+        self.weights = np.repeat(wx, wy.shape[1], axis=1) * np.tile(wy, (1, wx.shape[1]))
+
+    @classmethod
+    def from_dataset(cls, ds, x, y, method='linear'):
+        '''Make weights for the grid of a HIP dataset
+
+        Parameters
+        ----------
+        ds : xarray.Dataset or xarray.DataArray
+          Must contain the coordinates 'X' and 'Y'
+
+        x, y, method
+          See `GridWeights`
+
+        Returns
+        -------
+        GridWeights
+        '''
+        return cls(ds['X'].values, ds['Y'].values, x, y, method)
+
+    def apply(self, values):
+        '''Apply the weights to an array
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+          Array with X and Y as the last two dimensions
+
+        Returns
+        -------
+        numpy.ndarray
+          Array with the last two dimensions replaced by a point dimension, or removed if the
+          weights were made for a single point
+        '''
+        return self._apply(values, self.i, self.j)
+
+    def interp(self, obj):
+        '''Interpolate a dataset or data array, only reading the neighbouring grid cells
+
+        Parameters
+        ----------
+        obj : xarray.Dataset or xarray.DataArray
+          Must have the dimensions 'X' and 'Y'
+
+        Returns
+        -------
+        xarray.Dataset or xarray.DataArray
+          `obj` without the dimensions X and Y. If the weights were made for more than one point
+          the dimension 'point' is added.
+        '''
+        if isinstance(obj, xr.Dataset):
+            return obj.map(self.interp)
+        ux, i = np.unique(self.i, return_inverse=True)
+        uy, j = np.unique(self.j, return_inverse=True)
+        obj = obj.isel(X=ux, Y=uy).transpose(..., 'X', 'Y')
+        values = self._apply(obj.values, i.reshape(self.i.shape), j.reshape(self.j.shape))
+        dims = obj.dims[:-2] + (() if self.scalar else ('point',))
+        coords = { name : coord for name, coord in obj.coords.items()
+                   if not set(coord.dims) & {'X', 'Y'} }
+        return xr.DataArray(values, dims=dims, coords=coords, attrs=obj.attrs, name=obj.name)
+
+    def _apply(self, values, i, j):
+        gathered = values[..., i, j]
+        # Skip neighbours with zero weight, so NaN in those do not propagate
+        result = np.sum(np.where(self.weights > 0, gathered, 0) * self.weights, axis=-1)
+        return result[..., 0] if self.scalar else result
+
+
+def _axis_weights(coords, points, method):
+    n = len(coords)
+    if method == 'nearest':
+        idx = np.clip(np.searchsorted(coords, points), 1, n - 1)
+        idx = np.where(points - coords[idx - 1] <= coords[idx] - points, idx - 1, idx)
+        return idx[:, None], np.ones((len(points), 1))
+    lower = np.clip(np.searchsorted(coords, points, side='right') - 1, 0, n - 2)
+    weight = (points - coords[lower]) / (coords[lower + 1] - coords[lower])
+    return np.stack([lower, lower + 1], axis=1), np.stack([1 - weight, weight], axis=1)
@@ -4,15 +4,19 @@ inserting the potential in an already created table.
 The queries need to be run manually, e.g.
     sudo -u <db-user> psql -d <db-name> -f <outdir>/create.sql
     sudo -u <db-user> psql -d <db-name> -f <outdir>/insert.sql
+
+If the nc file has been updated with `extract_top_aquifer_potential --append`, use `--after` to only
+insert the new time steps in an existing table.
 '''
 import argparse
 import os
 import subprocess
 import sys
+import numpy as np
 import xarray as xr
 
 def main():
-    # pylint: disable=missing-function-docstring
+    # pylint: disable=missing-function-docstring, too-many-locals
     parser = argparse.ArgumentParser(
         'Create SQL queries for inserting the contents of a raster file into postgres'
     )
@@ -21,12 +25,24 @@ def main():
     parser.add_argument('--table', type=str, help='Table name', default="top_aquifer_potential")
     parser.add_argument('--srid', type=int, help='SRID of coordinate system used in nc_file',
                         default=25832)
+    parser.add_argument('--after', type=str, default=None,
+                        help='Only insert time steps after this time, e.g. "2024-01-01T00:00". '
+                        'The index is not created, because it is assumed to exist.')
 
     args = parser.parse_args()
     try:
         os.makedirs(args.outdir, exist_ok=True)
+        # We need to add the timestamp manually
+        with xr.open_dataarray(args.nc_file) as da:
+            timepoints = da['time'].values
+            units = da.attrs['units']
+            name = da.name
+        # The file can contain more than one variable, e.g. the aquifer layer used in each pixel,
+        # so we tell raster2pgsql which variable to use
+        raster = f'NETCDF:"{args.nc_file}":{name}'
+
         # First create the SQL for creating the table
-        cmd = ["raster2pgsql", "-I", "-n", "time", "-s", str(args.srid), args.nc_file, args.table]
+        cmd = ["raster2pgsql", "-I", "-n", "time", "-s", str(args.srid), raster, args.table]
         result = subprocess.run(cmd + ["-p"], capture_output=True, encoding='utf-8', check=True)
         with open(os.path.join(args.outdir, 'create.sql'), 'w', encoding='utf-8') as out:
             for n, line in enumerate(result.stdout.split('\n')):
@@ -36,13 +52,12 @@ def main():
 
         # Then create insert query.
         cmd += ["-a", "-b"]
-        # We need to add the timestamp manually
-        with xr.open_dataarray(args.nc_file) as da:
-            timepoints = da['time'].values
-            units = da.attrs['units']
+        after = None if args.after is None else np.datetime64(args.after)
         with open(os.path.join(args.outdir, 'insert.sql'), 'w', encoding='utf-8') as out:
             print('BEGIN;', file=out)
             for i, timepoint in enumerate(timepoints):
+                if after is not None and timepoint <= after:
+                    continue
                 result = subprocess.run(cmd + [str(i+1)], capture_output=True, encoding='utf-8',
                                         check=True)
                 line = result.stdout.split('\n')[1]
@@ -52,9 +67,10 @@ def main():
                 idx = line.rfind(",") + 1
                 line = line[:idx] + f"'{timepoint}','{units}');"
                 print(line, file=out)
-            print('CREATE INDEX ON "top_aquifer_potential" USING gist (st_convexhull("rast"));',
-                  'ANALYZE "top_aquifer_potential";',
-                  'END;', file=out, sep='\n')
+            if after is None:
+                print(f'CREATE INDEX ON "{args.table}" USING gist (st_convexhull("rast"));',
+                      file=out)
+            print(f'ANALYZE "{args.table}";', 'END;', file=out, sep='\n')
     except subprocess.CalledProcessError as e:
         print(e)
         return 1
@@ -0,0 +1,435 @@
+'''Treat a directory of HIP ground water potential tiles as a single dataset'''
+import collections
+import concurrent.futures
+import glob
+import os
+import re
+import numpy as np
+import pandas as pd
+import xarray as xr
+import netCDF4
+import cfunits
+from .units import unit_map
+from .layer_names import hip_elevation_to_hip_pressure
+from .extract_top_aquifer_potential import extract_top_aquifer_potential, HEAD_ELEVATION_LAYER, \
+    _get_possible_aquifers, _find_layers_to_use_for_each_pixel
+from .aggregate import TemporalAggregator, period_labels
+from .shared import SharedArray
+from .encoding import check_encoding_range, mask_invalid
+
+__all__ = [
+    'GwPotentialMosaic',
+    'extract_top_aquifer_potential_from_mosaic',
+]
+
+# HIP tiles are named like dk6_2020_100m_head_10km_630_54.nc, where 630 and 54 are northing and
+# easting of the lower left corner in units of the tile size.
+TILE_NAME_PATTERN = re.compile(r'_(\d+)km_(\d+)_(\d+)\.nc$')
+
+class GwPotentialMosaic():
+    # pylint: disable=too-many-instance-attributes
+    '''A directory of HIP ground water potential tiles presented as a single grid
+
+    Tiles are located from their filenames, so a tile is only opened when a block that overlaps it
+    is read. Files that do not follow the HIP naming scheme are opened once to read their extent.
+    At most `max_open` tiles are kept open at a time.
+
+    Parameters
+    ----------
+    paths : str or sequence of str
+      Directory with tiles or paths to the tiles. All tiles must have the same time steps, layers,
+      unit and resolution.
+
+    max_open : int
+      Maximum number of tiles to keep open. The least recently used tile is closed when the limit
+      is reached.
+
+    Attributes
+    ----------
+    X, Y : numpy.ndarray
+      Cell centers of the grid covering all tiles
+
+    time, layer : numpy.ndarray
+      Time steps and layers of the tiles
+
+    units : str
+      Unit of the potential as stored in the tiles
+    '''
+    def __init__(self, paths, max_open=16):
+        if isinstance(paths, str):
+            paths = sorted(glob.glob(os.path.join(paths, '*.nc')))
+        if len(paths) == 0:
+            raise ValueError('No ground water potential tiles found')
+        self.max_open = max_open
+        self._open = collections.OrderedDict()
+        with xr.open_dataset(paths[0]) as ds:
+            self.time = ds['time'].values
+            self.layer = ds['layer'].values
+            self.units = ds[HEAD_ELEVATION_LAYER].units
+            self.resolution = float(ds['X'].values[1] - ds['X'].values[0])
+        self._tiles = {}
+        for path in paths:
+            self._tiles[path] = self._tile_extent(path)
+        x_min = min(e[0] for e in self._tiles.values())
+        x_max = max(e[1] for e in self._tiles.values())
+        y_min = min(e[2] for e in self._tiles.values())
+        y_max = max(e[3] for e in self._tiles.values())
+        res = self.resolution
+        self.X = x_min + res/2 + res*np.arange(round((x_max - x_min)/res))
+        self.Y = y_min + res/2 + res*np.arange(round((y_max - y_min)/res))
+
+    def __getstate__(self):
+        # Open datasets cannot be pickled, so each process opens its own
+        state = self.__dict__.copy()
+        state['_open'] = collections.OrderedDict()
+        return state
+
+    def tiles(self, x_min, x_max, y_min, y_max):
+        '''Find tiles that overlap a bounding box
+
+        Parameters
+        ----------
+        x_min, x_max, y_min, y_max : float
+
+        Returns
+        -------
+        paths : list of str
+        '''
+        return [
+            path for path, (tx_min, tx_max, ty_min, ty_max) in self._tiles.items()
+            if tx_min < x_max and x_min < tx_max and ty_min < y_max and y_min < ty_max
+        ]
+
+    def read(self, X, Y, time=slice(None), layer=None):
+        # pylint: disable=too-many-locals
+        '''Read a block of the mosaic. Cells that are not covered by a tile are NaN.
+
+        Parameters
+        ----------
+        X, Y : numpy.ndarray
+          Cell centers to read. Must be on the grid of the mosaic and increasing.
+
+        time : slice
+          Time steps to read as a positional slice
+
+        layer : sequence of int
+          Layers to read. If None read all layers.
+
+        Returns
+        -------
+        gw_potential : xarray.Dataset
+          Dataset with the same structure as a single tile
+        '''
+        time_values = self.time[time]
+        layer_values = self.layer if layer is None else np.asarray(layer)
+        block = np.full((len(time_values), len(layer_values), len(X), len(Y)), np.nan)
+        res = self.resolution
+        for path in self.tiles(X[0] - res/2, X[-1] + res/2, Y[0] - res/2, Y[-1] + res/2):
+            ds = self._get(path)
+            tile_x = np.rint((ds['X'].values - X[0]) / res).astype(int)
+            tile_y = np.rint((ds['Y'].values - Y[0]) / res).astype(int)
+            use_x = (tile_x >= 0) & (tile_x < len(X))
+            use_y = (tile_y >= 0) & (tile_y < len(Y))
+            values = ds[HEAD_ELEVATION_LAYER].isel(
+                time=time, X=np.flatnonzero(use_x), Y=np.flatnonzero(use_y)
+            ).sel(layer=layer_values).transpose('time', 'layer', 'X', 'Y').values
+            block[:, :, tile_x[use_x][:, None], tile_y[use_y][None, :]] = values
+        return xr.Dataset(
+            { HEAD_ELEVATION_LAYER : (('time', 'layer', 'X', 'Y'), block, {'units' : self.units}) },
+            coords={ 'time' : time_values, 'layer' : layer_values, 'X' : X, 'Y' : Y }
+        )
+
+    def close(self):
+        '''Close all open tiles'''
+        for ds in self._open.values():
+            ds.close()
+        self._open.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get(self, path):
+        if path in self._open:
+            self._open.move_to_end(path)
+            return self._open[path]
+        while len(self._open) >= self.max_open:
+            _, ds = self._open.popitem(last=False)
+            ds.close()
+        ds = xr.open_dataset(path)
+        if len(ds['time']) != len(self.time) or np.any(ds['time'].values != self.time):
+            ds.close()
+            raise ValueError(f'Time steps in "{path}" do not match the other tiles')
+        self._open[path] = ds
+        return ds
+
+    def _tile_extent(self, path):
+        match = TILE_NAME_PATTERN.search(os.path.basename(path))
+        if match is not None:
+            size, north, east = (int(g) for g in match.groups())
+            size *= 1000
+            return (east * size, (east + 1) * size, north * size, (north + 1) * size)
+        res = self.resolution
+        with xr.open_dataset(path) as ds:
+            X, Y = ds['X'].values, ds['Y'].values
+            return (X.min() - res/2, X.max() + res/2, Y.min() - res/2, Y.max() + res/2)
+
+
+def extract_top_aquifer_potential_from_mosaic(hs_model_path, mosaic, dk_model, outpath,
+                                              base_unit=None,
+                                              missing_layer_unit=cfunits.Units('0.5m'),
+                                              block_size=100, time_chunk=366, workers=1,
+                                              start=None, end=None, period=None,
+                                              statistic='mean', encoding=None, truncate=False):
+    # pylint: disable=too-many-arguments,too-many-locals
+    '''Extract the potential at the topmost aquifer for all grid points covered by a mosaic of
+    ground water potential tiles and write the result to a single NetCDF file
+
+    The grid is processed in blocks of `block_size` x `block_size` cells and `time_chunk` time
+    steps, so memory use is bounded by the block size and not the size of the mosaic. Blocks can
+    be processed in parallel. The aquifer layer of each grid point is found once and shared with
+    worker processes through shared memory, so workers do not read the hydrostratigraphic model.
+    The output has the same structure as the output of
+    `extract_top_aquifer_potential`, with time as an unlimited dimension, so it can be appended to
+    with `append_top_aquifer_potential`.
+
+    Parameters
+    ----------
+    hs_model_path : str
+      Path to HIP hydrostratigraphic model. Must cover the mosaic.
+
+    mosaic : GwPotentialMosaic
+
+    dk_model : str
+      Name of DK-model HIP. Valid model names are {
+        'DK1', 'DK2', 'DK3', 'DK4', 'DK5', 'DK6', 'DK7'
+      }
+
+    outpath : str
+      Path to NetCDF file to create
+
+    base_unit : cfunits.Units
+      Convert potential to `base_unit`. If None keep the original unit
+
+    missing_layer_unit : cfunits.Units
+      Thickness of layers that should be ignored expressed as a unit.
+
+    block_size : int
+      Number of cells along X and Y in each block
+
+    time_chunk : int
+      Number of time steps in each block
+
+    workers : int
+      Number of processes to use. If 1 everything is done in the calling process.
+
+    start, end : str or datetime-like
+      Only extract time steps between `start` and `end`, both included. See `util.select_time`
+
+    period, statistic : str
+      If `period` is not None aggregate potential with `statistic` over each period. Each block
+      then covers all time steps, which are read `time_chunk` at a time. See
+      `extract_top_aquifer_potential`
+
+    encoding : dict
+      Encoding of the potential as returned by `encoding.raster_encoding`. If None store float64
+      in chunks of a single time step and block.
+
+    truncate : bool
+      If True round the potential to 0 decimals
+    '''
+    if base_unit is None:
+        base_unit = unit_map[mosaic.units]
+    # Use the coordinates of hs_model, so the output has the same coordinates as the output of
+    # extract_top_aquifer_potential
+    with xr.open_dataset(hs_model_path) as hs_model:
+        X, Y = hs_model['X'].values, hs_model['Y'].values
+        X, Y = X[np.isin(X, mosaic.X)], Y[np.isin(Y, mosaic.Y)]
+        layer_selection = _find_layer_selection(hs_model, dk_model, X, Y, missing_layer_unit,
+                                                block_size)
+    time = pd.DatetimeIndex(mosaic.time).slice_indexer(start, end)
+    t_start, t_end = time.start or 0, len(mosaic.time) if time.stop is None else time.stop
+    if t_start >= t_end:
+        raise ValueError(f'No time steps between {start} and {end}')
+    # When aggregating, each block covers all time steps, so the aggregation can be streamed
+    block_time = time_chunk if period is None else t_end - t_start
+    blocks = [
+        (slice(t, min(t + block_time, t_end)), slice(i, min(i + block_size, len(X))),
+         slice(j, min(j + block_size, len(Y))))
+        for t in range(t_start, t_end, block_time)
+        for i in range(0, len(X), block_size)
+        for j in range(0, len(Y), block_size)
+    ]
+    time = mosaic.time[t_start:t_end]
+    if period is not None:
+        time = period_labels(time, period)
+    # Units are passed as strings, so they can be sent to worker processes
+    params = [hs_model_path, mosaic, dk_model, X, Y, layer_selection, str(base_unit),
+              period, statistic, time_chunk]
+    with netCDF4.Dataset(outpath, 'w') as nc:
+        potential_var, aquifer_layer_var = _create_output(nc, time, X, Y, dk_model, base_unit,
+                                                          block_size, period, statistic,
+                                                          encoding)
+        def write(block, potential, aquifer_layer):
+            t, i, j = block
+            if truncate:
+                potential = np.round(potential)
+            if encoding is not None:
+                check_encoding_range(potential, encoding)
+            potential_var[t.start - t_start:t.start - t_start + len(potential), j, i] = \
+                mask_invalid(potential)
+            if t.start == t_start:
+                aquifer_layer_var[j, i] = aquifer_layer
+
+        if workers == 1:
+            _init_worker(*params)
+            try:
+                for block in blocks:
+                    write(*_extract_block(block))
+            finally:
+                _close_worker()
+            return
+        # Workers attach to the layer selection instead of receiving a copy each
+        params[5] = SharedArray.create(layer_selection)
+        with params[5], \
+             concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                    initargs=params) as executor:
+            # Limit the number of blocks in flight, so finished blocks do not pile up in memory
+            pending = set()
+            for block in blocks:
+                if len(pending) >= 2*workers:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        write(*future.result())
+                pending.add(executor.submit(_extract_block, block))
+            for future in concurrent.futures.as_completed(pending):
+                write(*future.result())
+
+
+def _create_output(nc, time, X, Y, dk_model, base_unit, block_size, period, statistic,
+                   encoding=None):
+    # pylint: disable=too-many-arguments,too-many-locals
+    # Match the layout xarray writes for the output of extract_top_aquifer_potential
+    time_dim = 'day_of_year' if period == 'doy' else 'time'
+    nc.createDimension(time_dim, None)
+    nc.createDimension('y', len(Y))
+    nc.createDimension('x', len(X))
+    for name, values, long_name in (('x', X, 'Easting'), ('y', Y, 'Northing')):
+        var = nc.createVariable(name, values.dtype, (name,))
+        var.axis = name
+        var.long_name = long_name
+        var.standard_name = 'projection_x_coordinates' if name == 'x' else \
+            'projection_y_coordinates'
+        var[:] = values
+    if period == 'doy':
+        time_var = nc.createVariable(time_dim, time.dtype, (time_dim,))
+        time_var[:] = time
+    else:
+        time_values, time_units, calendar = xr.coding.times.encode_cf_datetime(time)
+        time_var = nc.createVariable('time', time_values.dtype, ('time',))
+        time_var.units = time_units
+        time_var.calendar = calendar
+        time_var[:] = time_values
+    aquifer_layer = nc.createVariable('aquifer_layer', np.int8, ('y', 'x'))
+    aquifer_layer.long_name = 'Aquifer layer using HIP pressure naming style'
+    if encoding is None:
+        encoding = { 'dtype' : 'float64', '_FillValue' : np.nan }
+    potential = nc.createVariable(
+        'top_aquifer_potential', encoding['dtype'], (time_dim, 'y', 'x'),
+        fill_value=encoding['_FillValue'],
+        chunksizes=encoding.get('chunksizes',
+                                (1, min(block_size, len(Y)), min(block_size, len(X)))),
+        zlib=encoding.get('zlib', False), compression=encoding.get('compression'),
+        complevel=encoding.get('complevel', 4), shuffle=encoding.get('shuffle', True)
+    )
+    if 'scale_factor' in encoding:
+        potential.scale_factor = encoding['scale_factor']
+        potential.add_offset = encoding['add_offset']
+    potential.units = str(base_unit)
+    potential.dk_model = dk_model
+    if period is not None:
+        potential.aggregation = f'{statistic} per {period}'
+    potential.coordinates = 'aquifer_layer'
+    return potential, aquifer_layer
+
+
+# State of a worker process. Set by _init_worker
+_worker = {}
+
+def _find_layer_selection(hs_model, dk_model, X, Y, missing_layer_unit, block_size):
+    # pylint: disable=too-many-arguments
+    # Aquifer layer of each grid point using HIP pressure naming style with dimensions (y, x).
+    # Rows along X are processed in blocks, so only a block of the model is in memory at a time.
+    aq_layers_he = _get_possible_aquifers(hs_model, dk_model)
+    he_to_hp = hip_elevation_to_hip_pressure(dk_model)
+    layer_selection = np.full((len(Y), len(X)), he_to_hp[aq_layers_he[0]], dtype=np.int8)
+    for i in range(0, len(X), block_size):
+        grid = xr.Dataset(coords={ 'X' : X[i:i + block_size], 'Y' : Y })
+        use_for_pixel = _find_layers_to_use_for_each_pixel(hs_model, grid, missing_layer_unit,
+                                                           aq_layers_he)
+        for aq, use in use_for_pixel.items():
+            layer_selection[:, i:i + block_size][use.T] = he_to_hp[aq]
+    return layer_selection
+
+
+def _init_worker(hs_model_path, mosaic, dk_model, X, Y, layer_selection, base_unit, period,
+                 statistic, time_chunk):
+    # pylint: disable=too-many-arguments
+    # The model is only opened to get the names of the layers. Data is never read from it.
+    hs_model = xr.open_dataset(hs_model_path)
+    shared = None
+    if isinstance(layer_selection, SharedArray):
+        shared, layer_selection = layer_selection, layer_selection.attach()
+    he_to_hp = hip_elevation_to_hip_pressure(dk_model)
+    _worker.update({
+        'hs_model' : hs_model,
+        'mosaic' : mosaic,
+        'dk_model' : dk_model,
+        'X' : X,
+        'Y' : Y,
+        'layer_selection' : layer_selection,
+        'shared' : shared,
+        'base_unit' : cfunits.Units(base_unit),
+        'layers' : [he_to_hp[aq] for aq in _get_possible_aquifers(hs_model, dk_model)],
+        'period' : period,
+        'statistic' : statistic,
+        'time_chunk' : time_chunk,
+    })
+
+
+def _close_worker():
+    _worker['hs_model'].close()
+    _worker['mosaic'].close()
+    if _worker['shared'] is not None:
+        _worker['shared'].close()
+    _worker.clear()
+
+
+def _extract_block(block):
+    t, i, j = block
+    if _worker['period'] is None:
+        potential = _extract_chunk(t, i, j)
+        return block, potential.values, potential['aquifer_layer'].values
+    aggregator = TemporalAggregator(_worker['period'], _worker['statistic'])
+    aggregated = []
+    for t_chunk in range(t.start, t.stop, _worker['time_chunk']):
+        potential = _extract_chunk(slice(t_chunk, min(t_chunk + _worker['time_chunk'], t.stop)),
+                                   i, j)
+        aggregated.append(aggregator.update(potential['time'].values, potential.values)[1])
+    labels, last = aggregator.finish()
+    if labels is not None:
+        aggregated.append(last)
+    return block, np.concatenate(aggregated), potential['aquifer_layer'].values
+
+
+def _extract_chunk(t, i, j):
+    gw_potential = _worker['mosaic'].read(_worker['X'][i], _worker['Y'][j], time=t,
+                                          layer=_worker['layers'])
+    layer_selection = xr.DataArray(_worker['layer_selection'][j, i], dims=('y', 'x'))
+    return extract_top_aquifer_potential(_worker['hs_model'], gw_potential, _worker['dk_model'],
+                                         base_unit=_worker['base_unit'],
+                                         layer_selection=layer_selection)
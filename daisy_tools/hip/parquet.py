@@ -0,0 +1,172 @@
+'''Columnar output of prepare_hip_data_for_daisy for many points'''
+import os
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    'ParquetWriter',
+    'spatial_order',
+]
+
+class ParquetWriter():
+    # pylint: disable=too-many-instance-attributes
+    '''Write the output of `prepare_hip_data_for_daisy` for many points to one Parquet dataset per
+    product. Requires pyarrow.
+
+    The datasets are stored as
+      <outdir>/soil_column/part-<N>.parquet
+      <outdir>/pressure/part-<N>.parquet
+      <outdir>/top2m_pressure/part-<N>.parquet
+      <outdir>/top_aquitard/part-<N>.parquet
+
+    Names of layers, models and units are dictionary encoded and measurements are stored as float32
+    (int32 if truncated). Each row group holds `points_per_row_group` points, so readers can use the
+    row group statistics of X and Y to skip points they do not need. This works best if points that
+    are close to each other are added after each other, see `spatial_order`.
+
+    Parameters
+    ----------
+    outdir : str
+      Directory to store the datasets in. Created if it does not exist.
+
+    points_per_row_group : int
+      Number of points in each row group
+
+    points_per_file : int
+      Number of points in each file. Should be a multiple of `points_per_row_group`.
+    '''
+    PRODUCTS = ('soil_column', 'pressure', 'top2m_pressure', 'top_aquitard')
+    DICTIONARY_COLUMNS = ('dk_model', 'layer', 'dk_layer', 'unit', 'conductance_unit')
+
+    def __init__(self, outdir, points_per_row_group=100, points_per_file=10000):
+        try:
+            import pyarrow # pylint: disable=import-outside-toplevel
+            import pyarrow.parquet # pylint: disable=import-outside-toplevel,unused-import
+        except ImportError as e:
+            raise ImportError('Parquet output requires pyarrow. Install it with '
+                              '`pip install pyarrow`') from e
+        self._pa = pyarrow
+        self.outdir = outdir
+        self.points_per_row_group = points_per_row_group
+        self.points_per_file = points_per_file
+        self._buffers = { product : [] for product in self.PRODUCTS }
+        self._writers = { product : None for product in self.PRODUCTS }
+        self._n_points = 0
+        self._n_files = 0
+        for product in self.PRODUCTS:
+            os.makedirs(os.path.join(outdir, product), exist_ok=True)
+
+    def add(self, soil_column, head_elevation, top2m_head_elevation, truncate=False):
+        '''Add the output of `prepare_hip_data_for_daisy` for a single point
+
+        Parameters
+        ----------
+        soil_column, head_elevation, top2m_head_elevation : pandas.DataFrame
+          See `prepare_hip_data_for_daisy`
+
+        truncate : bool
+          If True round values to 0 decimals.
+        '''
+        soil_column = soil_column.copy()
+        conductive_properties = soil_column.pop('conductive_properties')
+        soil_column['conductance'] = [np.nan if cp is None else cp[0]
+                                      for cp in conductive_properties]
+        soil_column['conductance_unit'] = [None if cp is None else cp[1]
+                                           for cp in conductive_properties]
+        top_aquitard = soil_column.loc[
+            soil_column['top_aquitard'],
+            ['dk_model', 'X', 'Y', 'dk_layer', 'elevation', 'thickness', 'unit', 'conductance',
+             'conductance_unit']
+        ]
+        frames = {
+            'soil_column' : (soil_column, ['terrain_height', 'elevation', 'thickness']),
+            'pressure' : (head_elevation, ['head_elevation']),
+            'top2m_pressure' : (top2m_head_elevation, ['head_elevation']),
+            'top_aquitard' : (top_aquitard, ['elevation', 'thickness']),
+        }
+        for product, (df, value_columns) in frames.items():
+            self._buffers[product].append(self._encode(df, value_columns, truncate))
+        self._n_points += 1
+        if self._n_points % self.points_per_row_group == 0:
+            self._flush()
+        if self._n_points % self.points_per_file == 0:
+            self._close_files()
+
+    def close(self):
+        '''Write buffered points and close all files'''
+        self._flush()
+        self._close_files()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @staticmethod
+    def _encode(df, value_columns, truncate):
+        df = df.copy()
+        for col in value_columns:
+            if truncate:
+                df[col] = df[col].round(0).astype(np.int32)
+            else:
+                df[col] = df[col].astype(np.float32)
+        for col in ParquetWriter.DICTIONARY_COLUMNS:
+            if col in df:
+                # layer is an int in head elevation frames and a str in soil columns
+                df[col] = df[col].map(lambda v: None if pd.isna(v) else str(v)).astype(object)
+        return df
+
+    def _schema(self, df):
+        # The schema must be the same for all row groups, so we do not let pyarrow infer it
+        pa = self._pa
+        fields = []
+        for col, dtype in df.dtypes.items():
+            if col in self.DICTIONARY_COLUMNS:
+                pa_type = pa.dictionary(pa.int32(), pa.string())
+            elif col == 'conductance':
+                pa_type = pa.float32()
+            else:
+                pa_type = pa.from_numpy_dtype(dtype)
+            fields.append(pa.field(col, pa_type))
+        return pa.schema(fields)
+
+    def _flush(self):
+        pa = self._pa
+        for product, buffer in self._buffers.items():
+            if len(buffer) == 0:
+                continue
+            df = pd.concat(buffer, ignore_index=True)
+            if self._writers[product] is None:
+                path = os.path.join(self.outdir, product, f'part-{self._n_files:05d}.parquet')
+                self._writers[product] = pa.parquet.ParquetWriter(path, self._schema(df),
+                                                                  compression='zstd')
+            writer = self._writers[product]
+            table = pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+            writer.write_table(table, row_group_size=len(df))
+            self._buffers[product] = []
+
+    def _close_files(self):
+        if any(writer is not None for writer in self._writers.values()):
+            for product, writer in self._writers.items():
+                if writer is not None:
+                    writer.close()
+                self._writers[product] = None
+            self._n_files += 1
+
+
+def spatial_order(points, tile_size=10000):
+    '''Order points so points in the same tile are next to each other
+
+    Parameters
+    ----------
+    points : sequence of (x, y)
+
+    tile_size : float
+      Size of tiles in the unit of x and y. Default matches the 10 km tiles used by HIP.
+
+    Returns
+    -------
+    points : list of (x, y)
+    '''
+    return sorted(points, key=lambda p: (p[1] // tile_size, p[0] // tile_size, p[1], p[0]))
@@ -9,8 +9,9 @@ __all__ = [
     'prepare_hip_data_for_daisy'
 ]
 
-def prepare_hip_data_for_daisy(dk_model, hs_model, gw_potential, x, y, unit):
-    # pylint: disable=too-many-arguments
+def prepare_hip_data_for_daisy(dk_model, hs_model, gw_potential, x, y, unit, start=None,
+                               end=None, period=None, statistic='mean', method='linear'):
+    # pylint: disable=too-many-arguments,too-many-locals
     '''
     Parameters
     ----------
@@ -36,6 +37,20 @@ def prepare_hip_data_for_daisy(dk_model, hs_model, gw_potential, x, y, unit):
     unit : cfunits.Units
       Express values in this unit
 
+    start, end : str or datetime-like
+      Only extract head elevation between `start` and `end`, both included. See
+      `util.select_time`
+
+    period, statistic : str
+      If `period` is not None aggregate head elevation with `statistic` over each period. See
+      `extract_head_elevation`
+
+    method : str
+      'linear' for bilinear interpolation between the neighbouring grid cells or 'nearest' for the
+      nearest grid cell. Used for both soil column and head elevation. A column store as
+      `hs_model` requires 'nearest' unless (x, y) is a grid cell center. See
+      `extract_soil_column`
+
     Returns
     -------
     soil_column, head_elevation
@@ -48,7 +63,7 @@ def prepare_hip_data_for_daisy(dk_model, hs_model, gw_potential, x, y, unit):
     '''
     soil_column, terrain_height = extract_soil_column(hs_model, x=x, y=y,
                                                       return_terrain_height=True,
-                                                      base_unit=unit)
+                                                      base_unit=unit, method=method)
     top_aquifer = find_topmost_aquifer(dk_model, soil_column)
     top_aquitard = find_topmost_aquitard(dk_model, soil_column)
     soil_column['dk_model'] = dk_model
@@ -65,7 +80,8 @@ def prepare_hip_data_for_daisy(dk_model, hs_model, gw_potential, x, y, unit):
     )
     head_elevation = extract_head_elevation(gw_potential, x=x, y=y,
                                             layers=top_aquifer['head_elevation'],
-                                            base_unit=unit)
+                                            base_unit=unit, start=start, end=end,
+                                            period=period, statistic=statistic, method=method)
     head_elevation['dk_layer'] = head_elevation['layer'].replace(hip_pressure_to_dkm2019(dk_model))
     head_elevation['head_elevation'] = head_elevation['head_elevation'] - terrain_height
 
@@ -73,7 +89,9 @@ def prepare_hip_data_for_daisy(dk_model, hs_model, gw_potential, x, y, unit):
     # The hip elevation name of top2m is always CompLayer_1
     top2m_head_elevation = extract_head_elevation(gw_potential, x=x, y=y,
                                                   layers=hip_elevation_to_hip_pressure(dk_model)['CompLayer_1'],
-                                                  base_unit=unit)
+                                                  base_unit=unit, start=start, end=end,
+                                                  period=period, statistic=statistic,
+                                                  method=method)
     top2m_head_elevation['dk_layer'] = top2m_head_elevation['layer'].replace(hip_pressure_to_dkm2019(dk_model))
     top2m_head_elevation['head_elevation'] = top2m_head_elevation['head_elevation'] - terrain_height
     return soil_column, head_elevation, top2m_head_elevation
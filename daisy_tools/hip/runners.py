@@ -1,13 +1,23 @@
 '''Entry points for executables'''
 import argparse
 import os
+import numpy as np
 import xarray as xr
 import cfunits
 from .extract_head_elevation import extract_head_elevation
 from .extract_soil_column import extract_soil_column
 from .fix_hip_for_qgis import fix_hip_for_qgis
-from .prepare_hip_data_for_daisy import prepare_hip_data_for_daisy
-from .extract_top_aquifer_potential import extract_top_aquifer_potential
+from .cache import ResultCache, cached_prepare_hip_data_for_daisy
+from .batch import prepare_hip_data_for_points, read_points, save_hip_data_for_daisy
+from .parquet import ParquetWriter, spatial_order
+from .extract_top_aquifer_potential import extract_top_aquifer_potential, \
+    append_top_aquifer_potential
+from .extract_top_aquitard import extract_top_aquitard
+from .extract_top_aquifer_statistics import extract_top_aquifer_statistics
+from .mosaic import GwPotentialMosaic, extract_top_aquifer_potential_from_mosaic
+from .field import FieldWeights, read_fields, extract_field
+from .column_store import compile_column_store
+from .encoding import raster_encoding, check_encoding_range
 from .ddf import DDFPressure
 
 def run_fix_hip_for_qgis():
@@ -35,13 +45,32 @@ def run_extract_head_elevation():
     parser.add_argument('--x', type=float, default=None)
     parser.add_argument('--y', type=float, default=None)
     parser.add_argument('--base-unit', type=str, default=None)
+    parser.add_argument('--layers', type=int, nargs='+', default=None,
+                        help='Layers to extract using HIP pressure naming style, e.g. 0 7. '
+                        'Default is all layers.')
+    parser.add_argument('--start', type=str, default=None,
+                        help='First time step to extract, e.g. 2020-01-01. Default is the first '
+                        'time step in the file.')
+    parser.add_argument('--end', type=str, default=None,
+                        help='Last time step to extract, e.g. 2020-12-31. Partial dates include '
+                        'the whole period, e.g. 2020-12 includes all of December. Default is the '
+                        'last time step in the file.')
+    parser.add_argument('--period', type=str, choices=('day', 'month', 'year', 'doy'), default=None,
+                        help='If set, aggregate head elevation over each period. doy aggregates '
+                        'each day of year across years.')
+    parser.add_argument('--statistic', type=str, default='mean',
+                        help='Statistic to aggregate with. One of mean, min, max or p<q> for the '
+                        'q\'th percentile, e.g. p10. Default is mean.')
     args = parser.parse_args()
 
     with xr.open_dataset(args.inpath) as ds:
         params = {}
         if args.base_unit is not None:
             params['base_unit'] = cfunits.Units(args.base_unit)
-        head_elevation = extract_head_elevation(ds, args.x, args.y, **params)
+        head_elevation = extract_head_elevation(ds, args.x, args.y, layers=args.layers,
+                                                start=args.start, end=args.end,
+                                                period=args.period, statistic=args.statistic,
+                                                **params)
         if args.outpath is None:
             print(head_elevation)
         else:
@@ -55,13 +84,16 @@ def run_extract_soil_column():
     parser.add_argument('--x', type=float, default=None)
     parser.add_argument('--y', type=float, default=None)
     parser.add_argument('--base-unit', type=str, default=None)
+    parser.add_argument('--layers', type=str, nargs='+', default=None,
+                        help='Layers to extract using HIP elevation naming style, e.g. '
+                        'CompLayer_1 CompLayer_5. Default is all layers.')
     args = parser.parse_args()
 
     with xr.open_dataset(args.inpath) as ds:
         params = {}
         if args.base_unit is not None:
             params['base_unit'] = cfunits.Units(args.base_unit)
-        soil_column = extract_soil_column(ds, args.x, args.y, **params)
+        soil_column = extract_soil_column(ds, args.x, args.y, layers=args.layers, **params)
         if args.outpath is None:
             print(soil_column)
         else:
@@ -69,21 +101,56 @@ def run_extract_soil_column():
 
 
 def run_prepare_hip_data_for_daisy():
-    # pylint: disable=missing-function-docstring
+    # pylint: disable=missing-function-docstring,too-many-locals,too-many-branches
+    # pylint: disable=too-many-statements
     parser = argparse.ArgumentParser('Prepare HIP data for Daisy')
-    parser.add_argument('hs_model', type=str, help='Path to hydrostratigraphic model file')
+    parser.add_argument('hs_model', type=str,
+                        help='Path to hydrostratigraphic model file or column store made with '
+                        'compile_column_store')
     parser.add_argument('gw_potential', type=str, help='Path to ground water potential file')
-    parser.add_argument('--x', type=float, required=True, help='x coordinate to extract')
-    parser.add_argument('--y', type=float, required=True, help='y coordinate to extract')
+    parser.add_argument('--x', type=float, default=None, help='x coordinate to extract')
+    parser.add_argument('--y', type=float, default=None, help='y coordinate to extract')
+    parser.add_argument('--points', type=str, default=None,
+                        help='Path to csv file with points to extract. Uses columns x and y if '
+                        'present, otherwise the first two columns. Requires --outdir.')
     parser.add_argument('--dk-model', type=int, choices=(1,2,3,4,5,6,7), default=None,
                         help='Which DK model the data is from. If None, try to guess from '
                         'hs_model filename')
     parser.add_argument('--outdir', type=str, default=None)
+    parser.add_argument('--format', type=str, choices=('csv', 'parquet'), default='csv',
+                        help='Output format. csv stores csv and ddf files in a directory per '
+                        'point. parquet stores all points in one Parquet dataset per product and '
+                        'requires pyarrow. Default is csv.')
     parser.add_argument('--unit', type=str, default='cm',
                         help='Unit of measurements. Default is cm.')
     parser.add_argument('--truncate', action='store_true',
                         help='If set, truncate measurements to 0 decimals')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='If set, cache results in this directory and reuse them when the '
+                        'same point is extracted from the same files')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='Maximum size of the cache in MB. Default is 1024.')
+    parser.add_argument('--start', type=str, default=None,
+                        help='First time step to extract, e.g. 2020-01-01. Default is the first '
+                        'time step in the file.')
+    parser.add_argument('--end', type=str, default=None,
+                        help='Last time step to extract, e.g. 2020-12-31. Partial dates include '
+                        'the whole period, e.g. 2020-12 includes all of December. Default is the '
+                        'last time step in the file.')
+    parser.add_argument('--period', type=str, choices=('day', 'month', 'year'), default=None,
+                        help='If set, aggregate head elevation over each period')
+    parser.add_argument('--statistic', type=str, default='mean',
+                        help='Statistic to aggregate with. One of mean, min, max or p<q> for the '
+                        'q\'th percentile, e.g. p10. Default is mean.')
+    parser.add_argument('--method', type=str, choices=('linear', 'nearest'), default='linear',
+                        help='linear interpolates between the neighbouring grid cells, nearest '
+                        'uses the nearest grid cell. A column store as hs_model requires nearest '
+                        'unless the points are grid cell centers. Default is linear.')
     args = parser.parse_args()
+    if args.points is None and (args.x is None or args.y is None):
+        parser.error('Either --points or both --x and --y are required')
+    if (args.points is not None or args.format == 'parquet') and args.outdir is None:
+        parser.error('--outdir is required with --points and --format parquet')
 
     try:
         if args.outdir is not None:
@@ -94,32 +161,53 @@ def run_prepare_hip_data_for_daisy():
             args.dk_model = int(os.path.basename(args.hs_model)[2])
             assert 1 <= args.dk_model <= 7
         dk_model = f'DK{args.dk_model}'
-        with xr.open_dataset(args.hs_model) as hs_model, \
-             xr.open_dataset(args.gw_potential) as gw_potential:
-            soil_column, head_elevation, top2m_head_elevation = \
-                prepare_hip_data_for_daisy(dk_model, hs_model, gw_potential, args.x, args.y, unit)
+        cache = None
+        if args.cache_dir is not None:
+            cache = ResultCache(args.cache_dir, args.cache_size * 1024**2)
 
-        if args.truncate:
-            head_elevation['head_elevation'] = head_elevation['head_elevation'].round(0).astype(int)
-            cols = ['terrain_height', 'elevation', 'thickness']
-            soil_column[cols] = soil_column[cols].round(0).astype(int)
-        
-        if args.outdir is None:
+        if args.points is not None or args.format == 'parquet':
+            if args.points is not None:
+                points = read_points(args.points)
+            else:
+                points = [(args.x, args.y)]
+            writer = None
+            if args.format == 'parquet':
+                writer = ParquetWriter(args.outdir)
+                points = spatial_order(points)
+            try:
+                _, errors = prepare_hip_data_for_points(
+                    args.hs_model, args.gw_potential, dk_model, points, unit, args.outdir,
+                    truncate=args.truncate, cache=cache, writer=writer, start=args.start,
+                    end=args.end, period=args.period, statistic=args.statistic,
+                    method=args.method
+                )
+            finally:
+                if writer is not None:
+                    writer.close()
+            for (x, y), error in errors.items():
+                print(f'x={x}, y={y}: {error}')
+            return 1 if len(errors) > 0 else 0
+
+        soil_column, head_elevation, top2m_head_elevation = cached_prepare_hip_data_for_daisy(
+            args.hs_model, args.gw_potential, dk_model, args.x, args.y, unit, cache=cache,
+            start=args.start, end=args.end, period=args.period, statistic=args.statistic,
+            method=args.method
+        )
+
+        if args.outdir is not None:
+            save_hip_data_for_daisy(args.outdir, soil_column, head_elevation,
+                                    top2m_head_elevation, truncate=args.truncate)
+        else:
+            if args.truncate:
+                head_elevation['head_elevation'] = \
+                    head_elevation['head_elevation'].round(0).astype(int)
+                cols = ['terrain_height', 'elevation', 'thickness']
+                soil_column[cols] = soil_column[cols].round(0).astype(int)
             line = '============================= {0:^20s} ============================='
             print(line.format('Soil column'))
             print(soil_column, '\n')
             print(line.format('Head elevation'))
             print(head_elevation, '\n')
-        else:
-            soil_column.to_csv(os.path.join(args.outdir, 'soil_column.csv'), index=False)
-            head_elevation.to_csv(os.path.join(args.outdir, 'pressure.csv'), index=False)
-            DDFPressure(head_elevation).save(os.path.join(args.outdir, 'pressure_table.ddf'))
-            top2m_head_elevation.to_csv(os.path.join(args.outdir, 'top2m_pressure.csv'), index=False)
-            DDFPressure(top2m_head_elevation).save(os.path.join(args.outdir, 'top2m_pressure_table.ddf'))
-            top_aquitard = soil_column.loc[soil_column['top_aquitard']]
-            top_aquitard[
-                ['dk_layer', 'elevation', 'thickness', 'unit', 'conductive_properties']
-            ].to_csv(os.path.join(args.outdir, 'top_aquitard.csv'), index=False)
     except Exception as e: # pylint: disable=broad-exception-caught
         print(e)
         return 1
@@ -127,10 +215,12 @@ def run_prepare_hip_data_for_daisy():
 
 
 def run_extract_top_aquifer_potential():
-    # pylint: disable=missing-function-docstring
+    # pylint: disable=missing-function-docstring,too-many-statements
     parser = argparse.ArgumentParser('Prepare HIP data for postgis')
     parser.add_argument('hs_model', type=str, help='Path to hydrostratigraphic model file')
-    parser.add_argument('gw_potential', type=str, help='Path to ground water potential file')
+    parser.add_argument('gw_potential', type=str,
+                        help='Path to ground water potential file or a directory of ground water '
+                        'potential tiles')
     parser.add_argument('outpath', type=str)
     parser.add_argument('--dk-model', type=int, choices=(1,2,3,4,5,6,7), default=None,
                         help='Which DK model the data is from. If None, try to guess from '
@@ -139,7 +229,57 @@ def run_extract_top_aquifer_potential():
                         help='Unit of measurements. Default is cm.')    
     parser.add_argument('--truncate', action='store_true',
                         help='If set, truncate measurements to 0 decimals')
+    parser.add_argument('--append', action='store_true',
+                        help='If set and outpath exists, only extract time steps that are later '
+                        'than the last time step in outpath and append them to outpath. The layer '
+                        'selection and unit stored in outpath are reused.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes to use when gw_potential is a directory. '
+                        'Default is 1.')
+    parser.add_argument('--block-size', type=int, default=100,
+                        help='Number of grid points along X and Y to process at a time when '
+                        'gw_potential is a directory. Default is 100.')
+    parser.add_argument('--time-chunk', type=int, default=366,
+                        help='Number of time steps to process at a time when gw_potential is a '
+                        'directory or --period is set. Default is 366.')
+    parser.add_argument('--max-open-files', type=int, default=16,
+                        help='Maximum number of tiles to keep open in each process when '
+                        'gw_potential is a directory. Default is 16.')
+    parser.add_argument('--start', type=str, default=None,
+                        help='First time step to extract, e.g. 2020-01-01. Default is the first '
+                        'time step in the file.')
+    parser.add_argument('--end', type=str, default=None,
+                        help='Last time step to extract, e.g. 2020-12-31. Partial dates include '
+                        'the whole period, e.g. 2020-12 includes all of December. Default is the '
+                        'last time step in the file.')
+    parser.add_argument('--period', type=str, choices=('day', 'month', 'year', 'doy'), default=None,
+                        help='If set, aggregate potential over each period. doy aggregates '
+                        'each day of year across years.')
+    parser.add_argument('--statistic', type=str, default='mean',
+                        help='Statistic to aggregate with. One of mean, min, max or p<q> for the '
+                        'q\'th percentile, e.g. p10. Default is mean.')
+    parser.add_argument('--dtype', type=str, choices=('float64', 'float32', 'int16', 'int32'),
+                        default='float64',
+                        help='Type to store the potential as. Integer types are packed with '
+                        '--scale-factor and --add-offset. Default is float64.')
+    parser.add_argument('--scale-factor', type=float, default=None,
+                        help='Resolution of integer types in --unit. Default is 1, which stores '
+                        '0 decimals.')
+    parser.add_argument('--add-offset', type=float, default=None,
+                        help='Offset of integer types in --unit. Default is 0.')
+    parser.add_argument('--compression', type=str, choices=('zlib', 'zstd'), default=None,
+                        help='Compress the output. Default is no compression.')
+    parser.add_argument('--complevel', type=int, default=4, choices=range(1, 10),
+                        help='Compression level. Default is 4.')
+    parser.add_argument('--chunks', type=str, choices=('map', 'point'), default=None,
+                        help='Chunk the output for reading maps of single time steps or for '
+                        'reading time series of single grid points. Default is the netCDF default '
+                        'or a chunk per block when gw_potential is a directory.')
     args = parser.parse_args()
+    if args.append and os.path.isdir(args.gw_potential):
+        parser.error('--append is not supported when gw_potential is a directory')
+    if args.append and args.period is not None:
+        parser.error('--append is not supported with --period')
 
     try:
         unit = cfunits.Units(args.unit)
@@ -147,12 +287,262 @@ def run_extract_top_aquifer_potential():
             args.dk_model = int(os.path.basename(args.hs_model)[2])
             assert 1 <= args.dk_model <= 7
         dk_model = f'DK{args.dk_model}'
+        def encoding(shape):
+            return raster_encoding(shape, args.dtype, args.scale_factor, args.add_offset,
+                                   args.compression, args.complevel, args.chunks)
+        # Check the encoding options before extracting
+        encoding((1, 1, 1))
+        if os.path.isdir(args.gw_potential):
+            mosaic = GwPotentialMosaic(args.gw_potential, max_open=args.max_open_files)
+            # The number of time steps is only used for point chunks, where it is capped anyway
+            extract_top_aquifer_potential_from_mosaic(
+                args.hs_model, mosaic, dk_model, args.outpath, base_unit=unit,
+                block_size=args.block_size, time_chunk=args.time_chunk, workers=args.workers,
+                start=args.start, end=args.end, period=args.period, statistic=args.statistic,
+                encoding=encoding((len(mosaic.time), len(mosaic.Y), len(mosaic.X))),
+                truncate=args.truncate
+            )
+            return 0
+        append = args.append and os.path.exists(args.outpath)
+        params = {}
+        if append:
+            with xr.open_dataset(args.outpath) as existing:
+                # Files written before aquifer_layer was stored cannot be continued
+                if 'aquifer_layer' not in existing.variables or \
+                   'time' not in existing.encoding.get('unlimited_dims', ()):
+                    raise ValueError(f'Cannot append to "{args.outpath}", because it has no '
+                                     'aquifer_layer or time is not an unlimited dimension. '
+                                     'Regenerate the file without --append.')
+                existing = existing[list(existing.data_vars)[0]]
+                last_time = existing['time'].values[-1]
+                params['layer_selection'] = existing['aquifer_layer'].load()
+                unit = cfunits.Units(existing.attrs['units'])
         with xr.open_dataset(args.hs_model) as hs_model, \
              xr.open_dataset(args.gw_potential) as gw_potential:
+            if append:
+                gw_potential = gw_potential.sel(time=gw_potential['time'] > last_time)
+                if gw_potential.sizes['time'] == 0:
+                    print(f'No time steps after {last_time}')
+                    return 0
             ta_potential = extract_top_aquifer_potential(hs_model, gw_potential, dk_model,
-                                                         base_unit=unit)
-        ta_potential.to_netcdf(args.outpath)
-    except IOError as e: #Exception as e: # pylint: disable=broad-exception-caught
+                                                         base_unit=unit, start=args.start,
+                                                         end=args.end, period=args.period,
+                                                         statistic=args.statistic,
+                                                         time_chunk=args.time_chunk, **params)
+        if args.truncate:
+            ta_potential = ta_potential.copy(data=np.round(ta_potential.values))
+        if append:
+            # The encoding of the existing file is used
+            append_top_aquifer_potential(args.outpath, ta_potential)
+        else:
+            potential_encoding = encoding(ta_potential.shape)
+            check_encoding_range(ta_potential.values, potential_encoding)
+            ta_potential.to_netcdf(args.outpath, unlimited_dims=[ta_potential.dims[0]],
+                                   encoding={ ta_potential.name : potential_encoding })
+    except (IOError, ValueError) as e:
+        print(e)
+        return 1
+    return 0
+
+
+def run_extract_top_aquitard():
+    # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser('Extract topmost aquitard for all grid points')
+    parser.add_argument('hs_model', type=str, help='Path to hydrostratigraphic model file')
+    parser.add_argument('outpath', type=str)
+    parser.add_argument('--dk-model', type=int, choices=(1,2,3,4,5,6,7), default=None,
+                        help='Which DK model the data is from. If None, try to guess from '
+                        'hs_model filename')
+    parser.add_argument('--unit', type=str, default='cm',
+                        help='Unit of elevation and thickness. Default is cm.')
+    parser.add_argument('--conductance-unit', type=str, default='cm h-1',
+                        help='Unit of conductance. Default is "cm h-1".')
+    parser.add_argument('--truncate', action='store_true',
+                        help='If set, truncate elevation and thickness to 0 decimals')
+    parser.add_argument('--chunk-size', type=int, default=256,
+                        help='Number of grid points along X to process at a time. Default is 256.')
+    parser.add_argument('--complevel', type=int, default=4, choices=range(10),
+                        help='zlib compression level of the output. Default is 4.')
+    args = parser.parse_args()
+
+    try:
+        unit = cfunits.Units(args.unit)
+        if args.dk_model is None:
+            args.dk_model = int(os.path.basename(args.hs_model)[2])
+            assert 1 <= args.dk_model <= 7
+        dk_model = f'DK{args.dk_model}'
+        with xr.open_dataset(args.hs_model) as hs_model:
+            top_aquitard = extract_top_aquitard(hs_model, dk_model, base_unit=unit,
+                                                conductance_unit=args.conductance_unit,
+                                                chunk_size=args.chunk_size)
+        if args.truncate:
+            for var in ['terrain_height', 'elevation', 'thickness']:
+                top_aquitard[var] = top_aquitard[var].round(0)
+        top_aquitard.to_netcdf(args.outpath, encoding={
+            var : { 'zlib' : args.complevel > 0, 'complevel' : args.complevel }
+            for var in top_aquitard.data_vars
+        })
+    except IOError as e:
+        print(e)
+        return 1
+    return 0
+
+
+def run_extract_top_aquifer_statistics():
+    # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser('Statistics of top aquifer potential relative to terrain')
+    parser.add_argument('hs_model', type=str, help='Path to hydrostratigraphic model file')
+    parser.add_argument('gw_potential', type=str, help='Path to ground water potential file')
+    parser.add_argument('outpath', type=str)
+    parser.add_argument('--dk-model', type=int, choices=(1,2,3,4,5,6,7), default=None,
+                        help='Which DK model the data is from. If None, try to guess from '
+                        'hs_model filename')
+    parser.add_argument('--unit', type=str, default='cm',
+                        help='Unit of statistics. Default is cm.')
+    parser.add_argument('--percentiles', type=float, nargs='*', default=[10, 50, 90],
+                        help='Percentiles to estimate. Default is 10 50 90.')
+    parser.add_argument('--bin-width', type=str, default='5cm',
+                        help='Width of histogram bins used to estimate percentiles. Percentiles '
+                        'are accurate to half a bin width. Default is 5cm.')
+    parser.add_argument('--n-bins', type=int, default=400,
+                        help='Number of histogram bins for each grid point. Default is 400.')
+    parser.add_argument('--time-chunk', type=int, default=366,
+                        help='Number of time steps to process at a time. Default is 366.')
+    parser.add_argument('--start', type=str, default=None,
+                        help='First time step to use, e.g. 2020-01-01. Default is the first '
+                        'time step in the file.')
+    parser.add_argument('--end', type=str, default=None,
+                        help='Last time step to use, e.g. 2020-12-31. Default is the last time '
+                        'step in the file.')
+    parser.add_argument('--complevel', type=int, default=4, choices=range(10),
+                        help='zlib compression level of the output. Default is 4.')
+    args = parser.parse_args()
+
+    try:
+        unit = cfunits.Units(args.unit)
+        if args.dk_model is None:
+            args.dk_model = int(os.path.basename(args.hs_model)[2])
+            assert 1 <= args.dk_model <= 7
+        dk_model = f'DK{args.dk_model}'
+        with xr.open_dataset(args.hs_model) as hs_model, \
+             xr.open_dataset(args.gw_potential) as gw_potential:
+            statistics = extract_top_aquifer_statistics(
+                hs_model, gw_potential, dk_model, base_unit=unit, percentiles=args.percentiles,
+                bin_width_unit=cfunits.Units(args.bin_width), n_bins=args.n_bins,
+                time_chunk=args.time_chunk, start=args.start, end=args.end
+            )
+        encoding = {
+            var : { 'zlib' : args.complevel > 0, 'complevel' : args.complevel,
+                    'dtype' : 'int32' if var == 'count' else 'float32' }
+            for var in statistics.data_vars
+        }
+        statistics.to_netcdf(args.outpath, encoding=encoding)
+    except (IOError, ValueError) as e:
+        print(e)
+        return 1
+    return 0
+
+
+def run_extract_fields():
+    # pylint: disable=missing-function-docstring,too-many-locals
+    parser = argparse.ArgumentParser('Prepare area weighted HIP data for Daisy for fields')
+    parser.add_argument('hs_model', type=str, help='Path to hydrostratigraphic model file')
+    parser.add_argument('gw_potential', type=str, help='Path to ground water potential file')
+    parser.add_argument('fields', type=str,
+                        help='Path to GeoJSON file with field polygons or NetCDF file with a '
+                        'raster of integer field labels on the HIP grid, where 0 is no field')
+    parser.add_argument('outdir', type=str, help='Results are stored in a directory per field')
+    parser.add_argument('--dk-model', type=int, choices=(1,2,3,4,5,6,7), default=None,
+                        help='Which DK model the data is from. If None, try to guess from '
+                        'hs_model filename')
+    parser.add_argument('--unit', type=str, default='cm',
+                        help='Unit of measurements. Default is cm.')
+    parser.add_argument('--truncate', action='store_true',
+                        help='If set, truncate measurements to 0 decimals')
+    parser.add_argument('--crs', type=str, default=None,
+                        help='Coordinate system of field polygons, e.g. EPSG:4326. Default is '
+                        'EPSG:25832.')
+    parser.add_argument('--id-property', type=str, default=None,
+                        help='Feature property to use as field id. Default is the feature id or '
+                        'the index of the feature.')
+    parser.add_argument('--variable', type=str, default=None,
+                        help='Variable holding field labels in a NetCDF file. Default is the first '
+                        'variable.')
+    parser.add_argument('--supersample', type=int, default=10,
+                        help='Number of points to test along each axis of a cell, when finding '
+                        'the covered fraction of cells. Default is 10.')
+    parser.add_argument('--start', type=str, default=None,
+                        help='First time step to extract, e.g. 2020-01-01. Default is the first '
+                        'time step in the file.')
+    parser.add_argument('--end', type=str, default=None,
+                        help='Last time step to extract, e.g. 2020-12-31. Default is the last '
+                        'time step in the file.')
+    args = parser.parse_args()
+
+    errors = {}
+    try:
+        unit = cfunits.Units(args.unit)
+        if args.dk_model is None:
+            args.dk_model = int(os.path.basename(args.hs_model)[2])
+            assert 1 <= args.dk_model <= 7
+        dk_model = f'DK{args.dk_model}'
+        with xr.open_dataset(args.hs_model) as hs_model, \
+             xr.open_dataset(args.gw_potential) as gw_potential:
+            if args.fields.endswith('.nc'):
+                with xr.open_dataset(args.fields) as labels:
+                    variable = args.variable or list(labels.data_vars)[0]
+                    fields = FieldWeights.from_labels(hs_model, labels[variable].squeeze())
+            else:
+                fields = read_fields(args.fields, args.id_property, args.crs)
+            for field_id, field in fields.items():
+                try:
+                    if not isinstance(field, FieldWeights):
+                        field = FieldWeights.from_polygon(hs_model, field, args.supersample)
+                    soil_column, head_elevation, top2m_head_elevation = extract_field(
+                        dk_model, hs_model, gw_potential, field, unit, start=args.start,
+                        end=args.end
+                    )
+                    if args.truncate:
+                        for df in (head_elevation, top2m_head_elevation):
+                            df['head_elevation'] = df['head_elevation'].round(0)
+                        cols = ['terrain_height', 'elevation', 'thickness']
+                        soil_column[cols] = soil_column[cols].round(0)
+                    outdir = os.path.join(args.outdir, str(field_id))
+                    os.makedirs(outdir, exist_ok=True)
+                    soil_column.to_csv(os.path.join(outdir, 'soil_column.csv'), index=False)
+                    head_elevation.to_csv(os.path.join(outdir, 'pressure.csv'), index=False)
+                    DDFPressure(head_elevation).save(os.path.join(outdir, 'pressure_table.ddf'))
+                    top2m_head_elevation.to_csv(os.path.join(outdir, 'top2m_pressure.csv'),
+                                                index=False)
+                    DDFPressure(top2m_head_elevation).save(
+                        os.path.join(outdir, 'top2m_pressure_table.ddf')
+                    )
+                except (IOError, ValueError) as e:
+                    errors[field_id] = e
+    except Exception as e: # pylint: disable=broad-exception-caught
+        print(e)
+        return 1
+    for field_id, error in errors.items():
+        print(f'{field_id}: {error}')
+    return 1 if len(errors) > 0 else 0
+
+
+def run_compile_column_store():
+    # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser('Compile a hydrostratigraphic model to a column store')
+    parser.add_argument('hs_model', type=str, help='Path to hydrostratigraphic model file')
+    parser.add_argument('outpath', type=str, help='Directory to store the column store in')
+    parser.add_argument('--missing-layer-thickness', type=str, default='0.5m',
+                        help='Layers with this thickness are left out. Default is 0.5m.')
+    parser.add_argument('--block-size', type=int, default=100,
+                        help='Number of rows along X to process at a time. Default is 100.')
+    args = parser.parse_args()
+
+    try:
+        with xr.open_dataset(args.hs_model) as hs_model:
+            compile_column_store(hs_model, args.outpath,
+                                 cfunits.Units(args.missing_layer_thickness), args.block_size)
+    except (IOError, ValueError) as e:
         print(e)
         return 1
     return 0
@@ -0,0 +1,92 @@
+'''Share arrays between processes without copying'''
+from multiprocessing import shared_memory
+import numpy as np
+
+__all__ = [
+    'SharedArray',
+]
+
+class SharedArray():
+    '''A numpy array in shared memory
+
+    Pickling a SharedArray only pickles the name, shape and dtype of the shared memory block, so
+    it is cheap to send to worker processes, e.g. as `initargs` of a process pool. Workers call
+    `attach` to get a read only view of the array.
+
+    The process that creates the array owns it and must call `unlink` when all processes are done
+    with it. Using the array as a context manager does this.
+
+    Parameters
+    ----------
+    name : str
+      Name of the shared memory block
+
+    shape : tuple of int
+
+    dtype : numpy.dtype
+    '''
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._shm = None
+
+    @classmethod
+    def create(cls, array):
+        '''Copy an array to a new shared memory block
+
+        Parameters
+        ----------
+        array : array-like
+
+        Returns
+        -------
+        SharedArray
+        '''
+        array = np.asarray(array)
+        # A shared memory block cannot be empty
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = cls(shm.name, array.shape, array.dtype)
+        shared._shm = shm
+        np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+        return shared
+
+    def attach(self):
+        '''Get a read only view of the shared array. Nothing is copied.
+
+        Returns
+        -------
+        numpy.ndarray
+        '''
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(name=self.name)
+        view = np.ndarray(self.shape, self.dtype, buffer=self._shm.buf)
+        view.flags.writeable = False
+        return view
+
+    def close(self):
+        '''Detach from the shared memory block. Views returned by `attach` must not be used
+        afterwards.'''
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        '''Close and free the shared memory block. Only call this from the owning process.'''
+        shm = self._shm or shared_memory.SharedMemory(name=self.name)
+        self._shm = None
+        shm.close()
+        shm.unlink()
+
+    def __getstate__(self):
+        # Only send the handle, never the mapping
+        return { 'name' : self.name, 'shape' : self.shape, 'dtype' : self.dtype }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.unlink()
@@ -1,5 +1,6 @@
 '''Utility functions for HIP data extraction and transformation'''
 import warnings
+import numpy as np
 from .layer_names import hip_elevation_to_hip_pressure, hip_pressure_to_dkm2019, \
     dkm2019_to_aquifer, dkm2019_aquitard
 
@@ -8,6 +9,9 @@ __all__ = [
     'find_topmost_aquitard',
     'get_idx_and_coord',
     'bounds_check',
+    'select_time',
+    'select_hs_layers',
+    'is_missing_layer',
 ]
 
 def find_topmost_aquifer(dk_model, soil_column):
@@ -111,6 +115,92 @@ def bounds_check(ds, x, y):
     if y > ds['Y'].max() or y < ds['Y'].min():
         raise IndexError(f'y={y} is outside the bounds {ds["Y"].min():f}, {ds["Y"].max():f}')
 
+def is_missing_layer(thickness, missing_layer_thickness):
+    '''Check which layers have the thickness used for missing layers
+
+    Thickness is compared with a relative tolerance, so the result does not depend on the unit the
+    elevations are expressed in or on float32 rounding of the elevations.
+
+    Parameters
+    ----------
+    thickness : numpy.ndarray
+      Layer thickness
+
+    missing_layer_thickness : float
+      Thickness of missing layers in the unit of `thickness`
+
+    Returns
+    -------
+    numpy.ndarray of bool
+    '''
+    return np.isclose(thickness, missing_layer_thickness, rtol=1e-3, atol=0)
+
+
+def select_time(ds, start=None, end=None):
+    '''Select time steps between start and end, both included. Nothing is read from disk.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+      Must contain the coordinate 'time'
+
+    start, end : str or datetime-like
+      First and last time step to select. Strings can be partial dates, e.g. end='2020-01' selects
+      until the end of January 2020. If None there is no bound.
+
+    Returns
+    -------
+    xarray.Dataset
+
+    Raises
+    ------
+    ValueError
+      If there are no time steps between start and end
+    '''
+    if start is None and end is None:
+        return ds
+    ds = ds.sel(time=slice(start, end))
+    if ds.sizes['time'] == 0:
+        raise ValueError(f'No time steps between {start} and {end}')
+    return ds
+
+
+def select_hs_layers(hs_model, layers=None):
+    '''Select the layers of a hydrostratigraphic model needed to find the thickness of `layers`.
+    Nothing is read from disk.
+
+    The thickness of a layer depends on the layers above it, so all layers from the topography
+    down to the deepest of `layers` are selected.
+
+    Parameters
+    ----------
+    hs_model : xarray.Dataset
+      A HIP hydrostratigraphic model with layers stored in order of elevation
+
+    layers : str or sequence of str
+      Layers using HIP elevation naming style, e.g. 'CompLayer_3'. If None select all layers.
+
+    Returns
+    -------
+    xarray.Dataset
+
+    Raises
+    ------
+    KeyError
+      If a layer is not in `hs_model`
+    '''
+    if layers is None:
+        return hs_model
+    if isinstance(layers, str):
+        layers = [layers]
+    layer_names = list(hs_model.data_vars.keys())
+    for layer in layers:
+        if layer not in layer_names:
+            raise KeyError(f'{layer} is not in the hydrostratigraphic model')
+    deepest = max(layer_names.index(layer) for layer in layers)
+    return hs_model[layer_names[:deepest+1]]
+
+
 def get_idx_and_coord(ds, i=None, j=None, x=None, y=None):
     '''Extract the head elevation at a single grid cell
 
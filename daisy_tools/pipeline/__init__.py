@@ -0,0 +1,4 @@
+'''Run the HIP and DMI steps for many Daisy sites as a resumable dependency graph'''
+from .journal import *
+from .graph import *
+from .sites import *
@@ -0,0 +1,292 @@
+'''Run a dependency graph of tasks with worker pools and a journal'''
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
+__all__ = [
+    'Task',
+    'StageReport',
+    'run_tasks',
+]
+
+class Task():
+    '''A unit of work in a pipeline
+
+    Parameters
+    ----------
+    task_id : str
+      Unique id of the task, e.g. 'hip/site_1'
+
+    stage : str
+      Name of the stage the task belongs to. Throughput is reported per stage.
+
+    func : callable
+      Function to run as func(*args). Must be defined at module level, so it can be sent to a
+      worker process.
+
+    args : tuple
+      Arguments of `func`. Must be picklable and JSON serializable with `str` as fallback, since
+      they make up the key of the task in the journal.
+
+    deps : sequence of str
+      Ids of tasks that must succeed before this task runs
+
+    outputs : sequence of str
+      Paths written by the task. A task that is done in the journal is rerun if an output is
+      missing.
+
+    pool : str
+      'process' for work that uses the CPU or reads large files, 'thread' for work that waits on
+      the network
+    '''
+    def __init__(self, task_id, stage, func, args=(), deps=(), outputs=(), pool='process'):
+        # pylint: disable=too-many-arguments
+        if pool not in ('process', 'thread'):
+            raise ValueError(f'Unknown pool "{pool}". Valid pools are process and thread')
+        self.task_id = task_id
+        self.stage = stage
+        self.func = func
+        self.args = tuple(args)
+        self.deps = tuple(deps)
+        self.outputs = tuple(outputs)
+        self.pool = pool
+
+    @property
+    def key(self):
+        '''Hash of the function, arguments and dependencies of the task'''
+        description = json.dumps([self.func.__module__, self.func.__qualname__, self.args,
+                                  sorted(self.deps)], sort_keys=True, default=str)
+        return hashlib.sha256(description.encode('utf8')).hexdigest()
+
+
+class StageReport():
+    '''Counts and timing of the tasks in a stage
+
+    Attributes
+    ----------
+    done : int
+      Tasks that ran and succeeded
+
+    skipped : int
+      Tasks that were already done according to the journal
+
+    failed : int
+      Tasks that raised an exception
+
+    blocked : int
+      Tasks that did not run, because a dependency failed
+
+    busy : float
+      Sum of the run time of tasks in seconds
+
+    first_start, last_finish : float
+      Time stamps of the first task start and the last task finish
+    '''
+    def __init__(self):
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.blocked = 0
+        self.busy = 0.0
+        self.first_start = None
+        self.last_finish = None
+
+    def add_run(self, started, finished, ok):
+        '''Add a task that ran'''
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        self.busy += finished - started
+        self.first_start = started if self.first_start is None else min(self.first_start, started)
+        self.last_finish = finished if self.last_finish is None else \
+            max(self.last_finish, finished)
+
+    @property
+    def wall(self):
+        '''Seconds from the first task started to the last task finished'''
+        if self.first_start is None:
+            return 0.0
+        return self.last_finish - self.first_start
+
+    def __str__(self):
+        text = (f'{self.done} done, {self.skipped} skipped, {self.failed} failed, '
+                f'{self.blocked} blocked')
+        if self.done + self.failed > 0:
+            text += f', {self.wall:.1f} s wall, {self.busy:.1f} s busy'
+            if self.wall > 0:
+                text += f', {self.done / self.wall:.2f} tasks/s'
+        return text
+
+
+def run_tasks(tasks, journal=None, workers=1, threads=4, progress=None, force=False):
+    # pylint: disable=too-many-arguments,too-many-locals,too-many-branches,too-many-statements
+    '''Run tasks in dependency order
+
+    Tasks run as soon as their dependencies have succeeded. A task is skipped if it is done in the
+    journal, its outputs exist and none of its dependencies ran. Tasks with pool 'process' run in
+    `workers` processes, and tasks with pool 'thread' run in `threads` threads, so network bound
+    tasks do not hold up processes. A failing task does not stop the pipeline, but tasks that
+    depend on it are blocked.
+
+    Parameters
+    ----------
+    tasks : sequence of Task
+
+    journal : journal.Journal
+      If not None, skip tasks that are done in the journal and record the outcome of tasks that
+      run
+
+    workers : int
+      Number of processes for tasks with pool 'process'. If 1 these tasks run in a thread of the
+      calling process, so nothing needs to be picklable.
+
+    threads : int
+      Number of threads for tasks with pool 'thread'
+
+    progress : callable
+      If not None, called as progress(task, status, error) when a task finishes, where status
+      is one of 'done', 'skipped', 'failed' or 'blocked'
+
+    force : bool
+      If True run all tasks, even if they are done in the journal. Outcomes are still recorded.
+
+    Returns
+    -------
+    reports : dict of (stage, StageReport) pairs
+
+    Raises
+    ------
+    ValueError
+      If task ids are not unique, a dependency does not exist or the dependencies have a cycle
+    '''
+    by_id = {}
+    for task in tasks:
+        if task.task_id in by_id:
+            raise ValueError(f'Task id "{task.task_id}" is not unique')
+        by_id[task.task_id] = task
+    dependents = { task_id : [] for task_id in by_id }
+    waiting = {}
+    for task in tasks:
+        for dep in task.deps:
+            if dep not in by_id:
+                raise ValueError(f'Task "{task.task_id}" depends on unknown task "{dep}"')
+            dependents[dep].append(task.task_id)
+        waiting[task.task_id] = len(task.deps)
+    _check_cycles(by_id)
+
+    reports = { task.stage : StageReport() for task in tasks }
+    ready = [task_id for task_id, n in waiting.items() if n == 0]
+    # Tasks that ran in this run. Their dependents must run too, since their inputs changed.
+    ran = set()
+
+    def finish(task, status, error=None):
+        if progress is not None:
+            progress(task, status, error)
+        if status in ('done', 'skipped'):
+            for dependent in dependents[task.task_id]:
+                if dependent not in waiting:
+                    # Blocked by another dependency
+                    continue
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        else:
+            # Block everything downstream
+            stack = list(dependents[task.task_id])
+            while stack:
+                blocked = by_id[stack.pop()]
+                if waiting.pop(blocked.task_id, None) is not None:
+                    reports[blocked.stage].blocked += 1
+                    if progress is not None:
+                        progress(blocked, 'blocked', f'Depends on failed task {task.task_id}')
+                    stack.extend(dependents[blocked.task_id])
+
+    if workers == 1:
+        processes = concurrent.futures.ThreadPoolExecutor(1)
+    else:
+        # Thread tasks may already run when a process is started, and forking a process with
+        # running threads can deadlock the child, so processes are spawned
+        processes = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('spawn')
+        )
+    with processes, concurrent.futures.ThreadPoolExecutor(threads) as thread_pool:
+        pools = { 'process' : processes, 'thread' : thread_pool }
+        running = {}
+        while ready or running:
+            while ready:
+                task = by_id[ready.pop()]
+                del waiting[task.task_id]
+                if not force and journal is not None and ran.isdisjoint(task.deps) and \
+                   journal.is_done(task.task_id, task.key) and \
+                   all(os.path.exists(path) for path in task.outputs):
+                    reports[task.stage].skipped += 1
+                    finish(task, 'skipped')
+                    continue
+                future = pools[task.pool].submit(_run, task.func, task.args)
+                running[future] = task
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(running,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    started, finished = future.result()
+                    error = None
+                except _TaskError as e:
+                    started, finished, error = e.started, e.finished, e.message
+                except Exception as e: # pylint: disable=broad-exception-caught
+                    # E.g. a worker process died
+                    started = finished = time.time()
+                    error = f'{type(e).__name__}: {e}'
+                status = 'done' if error is None else 'failed'
+                ran.add(task.task_id)
+                reports[task.stage].add_run(started, finished, error is None)
+                if journal is not None:
+                    journal.record(task.task_id, task.stage, task.key, status, started, finished,
+                                   error)
+                finish(task, status, error)
+    return reports
+
+
+class _TaskError(Exception):
+    # Carries the timing of a failed task back from a worker
+    def __init__(self, message, started, finished):
+        super().__init__(message, started, finished)
+        self.message = message
+        self.started = started
+        self.finished = finished
+
+
+def _run(func, args):
+    started = time.time()
+    try:
+        func(*args)
+    except Exception as e:
+        raise _TaskError(f'{type(e).__name__}: {e}', started, time.time()) from None
+    return started, time.time()
+
+
+def _check_cycles(by_id):
+    # Depth first search with colors. Iterative, so long chains do not hit the recursion limit.
+    state = {}
+    for root in by_id:
+        if root in state:
+            continue
+        stack = [(root, iter(by_id[root].deps))]
+        state[root] = 'visiting'
+        while stack:
+            task_id, deps = stack[-1]
+            dep = next(deps, None)
+            if dep is None:
+                state[task_id] = 'done'
+                stack.pop()
+            elif state.get(dep) == 'visiting':
+                raise ValueError(f'Dependency cycle through task "{dep}"')
+            elif dep not in state:
+                state[dep] = 'visiting'
+                stack.append((dep, iter(by_id[dep].deps)))
@@ -0,0 +1,96 @@
+'''SQLite journal of finished pipeline tasks'''
+import sqlite3
+import time
+
+__all__ = [
+    'Journal',
+]
+
+class Journal():
+    '''Record the outcome of pipeline tasks, so a rerun can skip tasks that are already done
+
+    Each task is stored with a key describing its inputs and parameters. A task only counts as
+    done if it succeeded with the same key, so changing the inputs of a task reruns it.
+
+    The journal is only written from the process running the pipeline, so SQLite locking is not
+    a concern.
+
+    Parameters
+    ----------
+    path : str
+      Path to SQLite database. Created if it does not exist.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    stage TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    error TEXT
+                )
+            ''')
+
+    def is_done(self, task_id, key):
+        '''Check if a task has succeeded with the same key
+
+        Parameters
+        ----------
+        task_id, key : str
+
+        Returns
+        -------
+        bool
+        '''
+        row = self._db.execute('SELECT key, status FROM tasks WHERE task_id = ?',
+                               (task_id,)).fetchone()
+        return row is not None and row[0] == key and row[1] == 'done'
+
+    def record(self, task_id, stage, key, status, started=None, finished=None, error=None):
+        # pylint: disable=too-many-arguments
+        '''Record the outcome of a task, replacing any earlier outcome
+
+        Parameters
+        ----------
+        task_id, stage, key : str
+
+        status : str
+          'done' or 'failed'
+
+        started, finished : float
+          Time stamps as returned by `time.time`. finished defaults to now.
+
+        error : str
+          Error message of a failed task
+        '''
+        if finished is None:
+            finished = time.time()
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (task_id, stage, key, status, started, finished, error)
+            )
+
+    def failed(self):
+        '''Get the tasks that failed in the latest run of each task
+
+        Returns
+        -------
+        failed : dict of (task_id, error) pairs
+        '''
+        return dict(self._db.execute("SELECT task_id, error FROM tasks WHERE status = 'failed'"))
+
+    def close(self):
+        '''Close the database'''
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,49 @@
+'''Entry points for executables'''
+import argparse
+import os
+import time
+from .journal import Journal
+from .graph import run_tasks
+from .sites import read_manifest, site_tasks
+
+def run_pipeline():
+    # pylint: disable=missing-function-docstring
+    parser = argparse.ArgumentParser('Produce Daisy site bundles from a manifest')
+    parser.add_argument('manifest', type=str,
+                        help='Path to JSON manifest. See daisy_tools.pipeline.read_manifest')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes for HIP steps. Default is 1.')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='Number of threads for DMI downloads. Default is 4.')
+    parser.add_argument('--journal', type=str, default=None,
+                        help='Path to SQLite journal of finished tasks. Default is journal.sqlite '
+                        'in the output directory.')
+    parser.add_argument('--force', action='store_true',
+                        help='If set, rerun tasks that are done according to the journal')
+    parser.add_argument('--quiet', action='store_true',
+                        help='If set, only print failed tasks and the final report')
+    args = parser.parse_args()
+
+    try:
+        manifest = read_manifest(args.manifest)
+        tasks = site_tasks(manifest)
+        os.makedirs(manifest['outdir'], exist_ok=True)
+        journal_path = args.journal or os.path.join(manifest['outdir'], 'journal.sqlite')
+        n_finished = [0]
+        def progress(task, status, error):
+            n_finished[0] += 1
+            if error is not None:
+                print(f'[{n_finished[0]}/{len(tasks)}] {task.task_id} {status}: {error}')
+            elif not args.quiet:
+                print(f'[{n_finished[0]}/{len(tasks)}] {task.task_id} {status}')
+        start = time.time()
+        with Journal(journal_path) as journal:
+            reports = run_tasks(tasks, journal, workers=args.workers, threads=args.threads,
+                                progress=progress, force=args.force)
+    except (IOError, ValueError) as e:
+        print(e)
+        return 1
+    print(f'Finished {len(tasks)} tasks in {time.time() - start:.1f} s')
+    for stage, report in reports.items():
+        print(f'  {stage}: {report}')
+    return 1 if any(report.failed + report.blocked > 0 for report in reports.values()) else 0
@@ -0,0 +1,315 @@
+'''Tasks producing Daisy site bundles from HIP and DMI data'''
+import json
+import os
+from datetime import datetime
+import pandas as pd
+import xarray as xr
+import cfunits
+import pyproj
+from ..hip.batch import OpenDatasets, save_hip_data_for_daisy
+from ..hip.cache import ResultCache, cached_prepare_hip_data_for_daisy
+from ..hip.extract_top_aquifer_potential import extract_top_aquifer_potential
+from ..hip.mosaic import GwPotentialMosaic, extract_top_aquifer_potential_from_mosaic
+from ..dmi import DMIOpenDataClient, ObservationStore
+from .graph import Task
+
+__all__ = [
+    'read_manifest',
+    'site_tasks',
+    'prepare_site_hip',
+    'fetch_site_weather',
+    'extract_site_potential',
+    'write_site_bundle',
+]
+
+HIP_FILES = ('soil_column.csv', 'pressure.csv', 'pressure_table.ddf', 'top2m_pressure.csv',
+             'top2m_pressure_table.ddf', 'top_aquitard.csv')
+DMI_FILES = ('weather.csv', 'weather_meta.csv')
+
+def read_manifest(path):
+    '''Read a pipeline manifest
+
+    The manifest is a JSON file like
+      {
+        "outdir" : "sites",
+        "hip" : {
+          "hs_model" : "DK6_2020_100m_layers.nc",
+          "gw_potential" : "dk6_2020_100m_head_10km_630_54.nc",
+          "dk_model" : 6,
+          "unit" : "cm",
+          "start" : "2020-01-01", "end" : "2020-12-31",
+          "truncate" : false,
+          "cache_dir" : "cache"
+        },
+        "top_aquifer_potential" : { "outpath" : "top_aquifer_potential.nc", "unit" : "cm" },
+        "dmi" : {
+          "api_key" : "...",
+          "pars" : ["acc_precip", "mean_temp"],
+          "timeres" : "hour",
+          "start" : "2020-01-01T00:00:00", "end" : "2020-12-31T23:00:00"
+        },
+        "sites" : [ { "id" : "field_1", "x" : 540250, "y" : 6300350 } ]
+      }
+    "hip", "top_aquifer_potential" and "dmi" are optional, and only the configured steps are run.
+    In "hip" only "hs_model" and "gw_potential" are required, and "dk_model" is guessed from the
+    name of hs_model if missing. "method" in "hip" is "linear" (default) or "nearest", see
+    `prepare_hip_data_for_daisy`, and must be "nearest" if hs_model is a column store. In "dmi" the
+    API key can be left out and read from the
+    environment variable DMI_API_KEY instead. The DMI station list is cached in "station_cache",
+    which defaults to dmi_stations.json in outdir. If "observation_store" is the path to a SQLite
+    file, downloaded series are kept there and only missing data is fetched on later runs. If
+    "window" is a pandas frequency like "YS", long periods are downloaded in parallel windows.
+    "rate_limit" is the maximum number of DMI requests per second, which is shared by all sites
+    and with "rate_limit_file" also by other processes, and "rate_burst" is the number of
+    requests that can be made at once.
+
+    Site coordinates x and y are in EPSG:25832. "latitude" and "longitude" are used for DMI data if
+    present, otherwise they are computed from x and y. "sites" can also be the path to a csv file
+    with the columns id, x and y, and optionally latitude and longitude.
+
+    Relative paths are relative to the directory of the manifest.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    manifest : dict
+      The manifest with absolute paths and "sites" as a list of dicts with the keys id, x, y,
+      latitude and longitude
+    '''
+    with open(path, encoding='utf8') as f:
+        manifest = json.load(f)
+    root = os.path.dirname(os.path.abspath(path))
+    def resolve(p):
+        return os.path.join(root, p)
+    manifest['outdir'] = resolve(manifest.get('outdir', 'sites'))
+    if 'hip' in manifest:
+        hip = manifest['hip']
+        for key in ('hs_model', 'gw_potential', 'cache_dir'):
+            if key in hip:
+                hip[key] = resolve(hip[key])
+        if 'dk_model' not in hip:
+            hip['dk_model'] = int(os.path.basename(hip['hs_model'])[2])
+        if not 1 <= int(hip['dk_model']) <= 7:
+            raise ValueError(f'Invalid DK model {hip["dk_model"]}')
+    if 'top_aquifer_potential' in manifest:
+        if 'hip' not in manifest:
+            raise ValueError('top_aquifer_potential requires hip')
+        potential = manifest['top_aquifer_potential']
+        potential['outpath'] = resolve(potential.get('outpath', 'top_aquifer_potential.nc'))
+    if 'dmi' in manifest:
+        dmi = manifest['dmi']
+        dmi['station_cache'] = resolve(dmi.get('station_cache',
+                                               os.path.join(manifest['outdir'],
+                                                            'dmi_stations.json')))
+        if 'observation_store' in dmi:
+            dmi['observation_store'] = resolve(dmi['observation_store'])
+        if 'rate_limit_file' in dmi:
+            dmi['rate_limit_file'] = resolve(dmi['rate_limit_file'])
+    sites = manifest.get('sites', [])
+    if isinstance(sites, str):
+        sites = pd.read_csv(resolve(sites), dtype={'id' : str}).to_dict('records')
+    manifest['sites'] = _complete_sites(sites)
+    return manifest
+
+
+def site_tasks(manifest):
+    '''Make the tasks of a pipeline from a manifest
+
+    For each site there is a 'hip' task and a 'dmi' task if configured, and a 'bundle' task that
+    depends on them. There is a single 'top_aquifer_potential' task if configured.
+
+    Parameters
+    ----------
+    manifest : dict
+      As returned by `read_manifest`
+
+    Returns
+    -------
+    tasks : list of graph.Task
+    '''
+    tasks = []
+    outdir = manifest['outdir']
+    if 'top_aquifer_potential' in manifest:
+        tasks.append(Task('top_aquifer_potential', 'top_aquifer_potential',
+                          extract_site_potential,
+                          (manifest['hip'], manifest['top_aquifer_potential']),
+                          outputs=[manifest['top_aquifer_potential']['outpath']]))
+    for site in manifest['sites']:
+        site_dir = os.path.join(outdir, site['id'])
+        deps = []
+        if 'hip' in manifest:
+            hip_dir = os.path.join(site_dir, 'hip')
+            tasks.append(Task(f'hip/{site["id"]}', 'hip', prepare_site_hip,
+                              (site['x'], site['y'], manifest['hip'], hip_dir),
+                              outputs=[os.path.join(hip_dir, name) for name in HIP_FILES]))
+            deps.append(tasks[-1].task_id)
+        if 'dmi' in manifest:
+            dmi_dir = os.path.join(site_dir, 'dmi')
+            # Network bound, so run in threads
+            tasks.append(Task(f'dmi/{site["id"]}', 'dmi', fetch_site_weather,
+                              (site['latitude'], site['longitude'], manifest['dmi'], dmi_dir),
+                              outputs=[os.path.join(dmi_dir, name) for name in DMI_FILES],
+                              pool='thread'))
+            deps.append(tasks[-1].task_id)
+        bundle_path = os.path.join(site_dir, 'site.json')
+        tasks.append(Task(f'bundle/{site["id"]}', 'bundle', write_site_bundle,
+                          (site, site_dir, bundle_path), deps=deps, outputs=[bundle_path]))
+    return tasks
+
+
+# Open datasets of a worker process, so they are reused across sites
+_datasets = None
+
+def prepare_site_hip(x, y, hip, outdir):
+    '''Run `prepare_hip_data_for_daisy` for a site and save the result in `outdir`
+
+    Parameters
+    ----------
+    x, y : float
+      Site coordinates in EPSG:25832
+
+    hip : dict
+      The "hip" section of a manifest
+
+    outdir : str
+    '''
+    global _datasets # pylint: disable=global-statement
+    if _datasets is None:
+        _datasets = OpenDatasets()
+    cache = None
+    if 'cache_dir' in hip:
+        cache = ResultCache(hip['cache_dir'])
+    result = cached_prepare_hip_data_for_daisy(
+        hip['hs_model'], hip['gw_potential'], f'DK{hip["dk_model"]}', x, y,
+        cfunits.Units(hip.get('unit', 'cm')), cache=cache, datasets=_datasets,
+        start=hip.get('start'), end=hip.get('end'), method=hip.get('method', 'linear')
+    )
+    save_hip_data_for_daisy(outdir, *result, truncate=hip.get('truncate', False))
+
+
+def fetch_site_weather(latitude, longitude, dmi, outdir):
+    '''Get weather data from the DMI stations closest to a site and save it in `outdir`
+
+    See `DMIOpenDataClient.get_data`
+
+    Parameters
+    ----------
+    latitude, longitude : float
+
+    dmi : dict
+      The "dmi" section of a manifest
+
+    outdir : str
+    '''
+    api_key = dmi.get('api_key', os.environ.get('DMI_API_KEY'))
+    store = None
+    if 'observation_store' in dmi:
+        store = ObservationStore(dmi['observation_store'])
+    try:
+        with DMIOpenDataClient(api_key=api_key, api_name='climateData',
+                               station_cache=dmi.get('station_cache'),
+                               observation_store=store, window=dmi.get('window'),
+                               rate_limit=dmi.get('rate_limit'),
+                               rate_burst=dmi.get('rate_burst'),
+                               rate_limit_file=dmi.get('rate_limit_file')) as client:
+            data, meta = client.get_data(
+                latitude=latitude, longitude=longitude, timeres=dmi.get('timeres', 'hour'),
+                pars=dmi['pars'], startdate=_parse_datetime(dmi.get('start')),
+                enddate=_parse_datetime(dmi.get('end'))
+            )
+    finally:
+        if store is not None:
+            store.close()
+    os.makedirs(outdir, exist_ok=True)
+    data.sort_index().to_csv(os.path.join(outdir, 'weather.csv'))
+    meta.to_csv(os.path.join(outdir, 'weather_meta.csv'), index=False)
+
+
+def extract_site_potential(hip, potential):
+    '''Run `extract_top_aquifer_potential` on the files of a manifest
+
+    Parameters
+    ----------
+    hip : dict
+      The "hip" section of a manifest
+
+    potential : dict
+      The "top_aquifer_potential" section of a manifest
+    '''
+    dk_model = f'DK{hip["dk_model"]}'
+    unit = cfunits.Units(potential.get('unit', hip.get('unit', 'cm')))
+    outpath = potential['outpath']
+    # Write to a temporary file, so a partial file is never taken as done
+    tmp_path = outpath + '.tmp'
+    if os.path.isdir(hip['gw_potential']):
+        with GwPotentialMosaic(hip['gw_potential']) as mosaic:
+            extract_top_aquifer_potential_from_mosaic(
+                hip['hs_model'], mosaic, dk_model, tmp_path, base_unit=unit,
+                start=hip.get('start'), end=hip.get('end')
+            )
+    else:
+        with xr.open_dataset(hip['hs_model']) as hs_model, \
+             xr.open_dataset(hip['gw_potential']) as gw_potential:
+            ta_potential = extract_top_aquifer_potential(hs_model, gw_potential, dk_model,
+                                                         base_unit=unit, start=hip.get('start'),
+                                                         end=hip.get('end'))
+        ta_potential.to_netcdf(tmp_path, unlimited_dims=[ta_potential.dims[0]])
+    os.replace(tmp_path, outpath)
+
+
+def write_site_bundle(site, site_dir, path):
+    '''Write a description of the files of a site
+
+    Parameters
+    ----------
+    site : dict
+      Site as in `read_manifest`
+
+    site_dir : str
+      Directory holding the hip and dmi outputs of the site
+
+    path : str
+      Path of the JSON file to write
+    '''
+    files = {}
+    for step, names in (('hip', HIP_FILES), ('dmi', DMI_FILES)):
+        for name in names:
+            if os.path.exists(os.path.join(site_dir, step, name)):
+                files.setdefault(step, []).append(f'{step}/{name}')
+    os.makedirs(site_dir, exist_ok=True)
+    with open(path, 'w', encoding='utf8') as f:
+        json.dump({ **site, 'files' : files }, f, indent=2)
+
+
+def _complete_sites(sites):
+    sites = [dict(site) for site in sites]
+    ids = set()
+    for site in sites:
+        if 'id' not in site or 'x' not in site or 'y' not in site:
+            raise ValueError(f'Site {site} must have id, x and y')
+        site['id'] = str(site['id'])
+        if site['id'] in ids:
+            raise ValueError(f'Site id "{site["id"]}" is not unique')
+        ids.add(site['id'])
+        site['x'], site['y'] = float(site['x']), float(site['y'])
+    missing = [site for site in sites
+               if pd.isna(site.get('latitude', float('nan'))) or
+               pd.isna(site.get('longitude', float('nan')))]
+    if missing:
+        transformer = pyproj.Transformer.from_crs('EPSG:25832', 'EPSG:4326', always_xy=True)
+        longitude, latitude = transformer.transform([site['x'] for site in missing],
+                                                    [site['y'] for site in missing])
+        for site, lat, lon in zip(missing, latitude, longitude):
+            site['latitude'], site['longitude'] = float(lat), float(lon)
+    for site in sites:
+        site['latitude'], site['longitude'] = float(site['latitude']), float(site['longitude'])
+    return sites
+
+
+def _parse_datetime(value):
+    if value is None:
+        return None
+    return datetime.fromisoformat(value)